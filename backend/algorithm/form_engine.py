@@ -0,0 +1,183 @@
+#player form over any window of gameweeks, answered from cumulative sums of the tensor store
+#prefix[p, g] is the sum of a stat over gameweeks 1..g, so a window [a, b] is prefix[:, b] - prefix[:, a - 1]
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer import tensor_store
+from data_layer.tensor_store import open_store
+
+DEFAULT_WINDOW = 5
+DEFAULT_TOP_K = 10
+
+#fpl element types
+POSITIONS = {"gk": 1, "def": 2, "mid": 3, "fwd": 4}
+
+
+def position_id(position):
+    if position is None or position == "":
+        return None
+    if str(position).lower() in POSITIONS:
+        return POSITIONS[str(position).lower()]
+    value = int(position)
+    if value not in POSITIONS.values():
+        raise ValueError(f"Unknown position: {position}")
+    return value
+
+class FormEngine:
+
+    def __init__(self, store):
+        self.store = store
+        self.gameweeks = store.index["gameweeks"]
+        self.player_ids = np.array([p["player_id"] for p in store.index["players"]], dtype=np.int64)
+        self.positions = np.array([p["position_id"] for p in store.index["players"]], dtype=np.int64)
+        self.prefixes = {}
+        self.lock = threading.Lock()
+        #matches played is a prefix sum like any stat
+        self.matches = self.cumulative(store.played()[:len(self.positions)].astype(np.float64))
+
+    #one leading zero column so gameweek g is column g
+    @staticmethod
+    def cumulative(values):
+        prefix = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.cumsum(values, axis=1, out=prefix[:, 1:])
+        return prefix
+
+    def stats(self):
+        return list(self.store.index["stats"])
+
+    #built on first use for each stat, O(players x gameweeks) once
+    def prefix(self, stat):
+        if stat not in self.store.stat_index:
+            raise ValueError(f"Unknown stat: {stat}")
+        prefix = self.prefixes.get(stat)
+        if prefix is None:
+            with self.lock:
+                prefix = self.prefixes.get(stat)
+                if prefix is None:
+                    prefix = self.cumulative(self.store.stat(stat)[:len(self.positions)])
+                    self.prefixes[stat] = prefix
+        return prefix
+
+    def last_gameweek(self):
+        return max(self.gameweeks) if self.gameweeks else 0
+
+    #window [start, end], the last `window` gameweeks up to end by default
+    def bounds(self, window=None, end=None, start=None):
+        end = self.last_gameweek() if end is None else min(int(end), self.matches.shape[1] - 1)
+        if start is None:
+            window = DEFAULT_WINDOW if window is None else int(window)
+            if window < 1:
+                raise ValueError("window must be at least 1")
+            start = end - window + 1
+        return max(int(start), 1), end
+
+    #totals of every player over the window, O(1) per player
+    def window_sums(self, stat, start, end):
+        if end < start:
+            return np.zeros(len(self.positions))
+        prefix = self.prefix(stat)
+        return prefix[:, end] - prefix[:, start - 1]
+
+    def window_matches(self, start, end):
+        if end < start:
+            return np.zeros(len(self.positions))
+        return self.matches[:, end] - self.matches[:, start - 1]
+
+    #latest team of the player up to the end of the window
+    def team_of(self, player, end):
+        teams = self.store.teams[player, :end]
+        played = np.flatnonzero(teams >= 0)
+        if len(played) == 0:
+            return None
+        return self.store.index["teams"][teams[played[-1]]]
+
+    def top(self, stat, window=None, k=DEFAULT_TOP_K, position=None, end=None, start=None, per_match=False):
+        k = int(k)
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        start, end = self.bounds(window, end, start)
+        values = self.window_sums(stat, start, end)
+        matches = self.window_matches(start, end)
+        if per_match:
+            values = np.divide(values, matches, out=np.zeros_like(values), where=matches > 0)
+
+        #only players who played in the window, optionally of one position
+        candidates = matches > 0
+        position = position_id(position)
+        if position is not None:
+            candidates &= self.positions == position
+        candidates = np.flatnonzero(candidates)
+
+        if k < len(candidates):
+            #partial selection, then only the k best are sorted
+            kth = np.argpartition(-values[candidates], k - 1)[:k]
+            threshold = values[candidates][kth].min()
+            candidates = candidates[values[candidates] >= threshold]
+        #highest value first, ties by player id
+        order = np.lexsort((self.player_ids[candidates], -values[candidates]))
+        selected = candidates[order][:k]
+
+        players = []
+        for rank, player in enumerate(selected, start=1):
+            info = self.store.index["players"][player]
+            players.append({
+                "rank": rank,
+                "player_id": info["player_id"],
+                "name": info["name"],
+                "team": self.team_of(player, end),
+                "position_id": info["position_id"],
+                "value": round(float(values[player]), 2),
+                "matches_played": int(matches[player])
+            })
+
+        return {"stat": stat, "start": start, "end": end, "window": end - start + 1,
+                "position_id": position, "per_match": per_match, "players": players}
+
+    #form of one player over the window for every stat
+    def player_form(self, player_id, window=None, end=None, start=None):
+        player = self.store.player_index.get(player_id)
+        if player is None:
+            return None
+        start, end = self.bounds(window, end, start)
+        stats = {}
+        for stat in self.stats():
+            prefix = self.prefix(stat)
+            stats[stat] = round(float(prefix[player, end] - prefix[player, start - 1]), 2) if end >= start else 0.0
+        info = self.store.index["players"][player]
+        return {"player_id": player_id, "name": info["name"], "team": self.team_of(player, end),
+                "start": start, "end": end, "matches_played": int(self.window_matches(start, end)[player]),
+                "stats": stats}
+
+
+_engine = None
+_engine_key = None
+_engine_lock = threading.Lock()
+
+#shared engine, rebuilt when the store on disk changes
+def get_form_engine(path=None):
+    global _engine, _engine_key
+
+    path = path or tensor_store.TENSOR_PATH
+    #the index is rewritten after every append, its mtime identifies the version of the store
+    key = (path, os.stat(os.path.join(path, "index.json")).st_mtime_ns)
+    with _engine_lock:
+        if _engine is None or _engine_key != key:
+            _engine = FormEngine(open_store(path))
+            _engine_key = key
+    return _engine
+
+def top_form(stat, window=DEFAULT_WINDOW, k=DEFAULT_TOP_K, position=None, end=None, per_match=False):
+    return get_form_engine().top(stat, window=window, k=k, position=position, end=end, per_match=per_match)
+
+if __name__ == "__main__":
+    stat = sys.argv[1] if len(sys.argv) > 1 else "total_points"
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WINDOW
+    result = top_form(stat, window)
+    print(f"Top {stat} in gameweeks {result['start']}-{result['end']}")
+    for player in result["players"]:
+        print(f"{player['rank']:>3} {player['name']} ({player['team']}) {player['value']}")
@@ -0,0 +1,201 @@
+#season leaderboards for every numeric stat, overall, per position and per team
+#each group's players are pre-sorted once per gameweek, so top k is a slice and a rank is a binary search
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer import tensor_store
+from data_layer.tensor_store import open_store
+from algorithm.form_engine import position_id
+
+LEADERBOARD_FILE = "leaderboard.npz"
+DEFAULT_TOP_K = 10
+
+#totals are rounded before sorting so decimal sums that should tie do tie
+ROUND_DIGITS = 6
+
+
+def store_version(path):
+    return os.stat(os.path.join(path, "index.json")).st_mtime_ns
+
+class Leaderboard:
+
+    def __init__(self, meta, totals, orders, keys, offsets):
+        self.meta = meta
+        self.stats = meta["stats"]
+        self.players = meta["players"]
+        self.groups = meta["groups"]
+        self.version = meta["version"]
+        self.path = None
+        self.totals = totals        #player x stat
+        self.orders = orders        #stat x (3 * players), the players of every group, best first
+        self.keys = keys            #stat x (3 * players), minus the sorted totals, ascending
+        self.offsets = offsets      #group -> start of its segment, groups partition the players three times
+
+        self.stat_index = {stat: i for i, stat in enumerate(self.stats)}
+        self.group_index = {group: i for i, group in enumerate(self.groups)}
+        self.player_index = {p["player_id"]: i for i, p in enumerate(self.players)}
+
+    # ---------- building ----------
+    @classmethod
+    def build(cls, store):
+        count = len(store.index["players"])
+        played = store.played()[:count]
+        matches = played.sum(axis=1)
+        rows = np.flatnonzero(matches > 0)
+
+        #season totals per player, matches played is ranked like any other stat
+        stats = list(store.index["stats"]) + ["matches_played"]
+        totals = np.empty((len(rows), len(stats)))
+        totals[:, :-1] = store.stats[rows, :, :].sum(axis=1)
+        totals[:, -1] = matches[rows]
+        totals = np.round(totals, ROUND_DIGITS)
+
+        players = []
+        for row in rows:
+            info = store.index["players"][row]
+            teams = store.teams[row][played[row]]
+            players.append({"player_id": info["player_id"], "name": info["name"],
+                            "team": store.index["teams"][teams[-1]], "position_id": info["position_id"]})
+
+        #"all", then one group per position, then one per team (by latest team)
+        members = {"all": np.arange(len(rows))}
+        for position in sorted({p["position_id"] for p in players}):
+            members[f"position:{position}"] = np.array(
+                [i for i, p in enumerate(players) if p["position_id"] == position], dtype=np.int64)
+        for team in sorted({p["team"] for p in players}):
+            members[f"team:{team}"] = np.array([i for i, p in enumerate(players) if p["team"] == team], dtype=np.int64)
+
+        groups = list(members)
+        offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(members[group]) for group in groups])
+
+        player_ids = np.array([p["player_id"] for p in players], dtype=np.int64)
+        orders = np.empty((len(stats), offsets[-1]), dtype=np.int32)
+        keys = np.empty((len(stats), offsets[-1]))
+        for s in range(len(stats)):
+            values = totals[:, s]
+            for g, group in enumerate(groups):
+                index = members[group]
+                #highest total first, ties by player id
+                order = index[np.lexsort((player_ids[index], -values[index]))]
+                orders[s, offsets[g]:offsets[g + 1]] = order
+                keys[s, offsets[g]:offsets[g + 1]] = -values[order]
+
+        meta = {"version": store_version(store.path), "stats": stats, "players": players, "groups": groups,
+                "gameweeks": store.index["gameweeks"]}
+        return cls(meta, totals, orders, keys, offsets)
+
+    def save(self, path):
+        tmp_path = os.path.join(path, LEADERBOARD_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(self.meta)), totals=self.totals, orders=self.orders,
+                     keys=self.keys, offsets=self.offsets)
+        os.replace(tmp_path, os.path.join(path, LEADERBOARD_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(os.path.join(path, LEADERBOARD_FILE)) as data:
+            return cls(json.loads(str(data["meta"])), data["totals"], data["orders"], data["keys"], data["offsets"])
+
+    # ---------- queries ----------
+    def group(self, position=None, team=None):
+        if position not in (None, "") and team not in (None, ""):
+            raise ValueError("Filter by position or by team, not both")
+        if team not in (None, ""):
+            name = f"team:{team}"
+        elif position not in (None, ""):
+            name = f"position:{position_id(position)}"
+        else:
+            name = "all"
+        if name not in self.group_index:
+            raise ValueError(f"Unknown group: {name.split(':', 1)[-1]}")
+        return self.group_index[name]
+
+    def stat(self, stat):
+        if stat not in self.stat_index:
+            raise ValueError(f"Unknown stat: {stat}")
+        return self.stat_index[stat]
+
+    def segment(self, s, g):
+        return slice(self.offsets[g], self.offsets[g + 1])
+
+    #competition ranking (1, 2, 2, 4), a binary search in the group's sorted totals
+    def rank_of_value(self, s, g, value):
+        return int(np.searchsorted(self.keys[s, self.segment(s, g)], -value, side="left")) + 1
+
+    def entry(self, s, g, row):
+        value = float(self.totals[row, s])
+        return dict(self.players[row], rank=self.rank_of_value(s, g, value), value=round(value, 2))
+
+    #O(k) once the group is sorted
+    def top(self, stat, k=DEFAULT_TOP_K, position=None, team=None, offset=0):
+        s = self.stat(stat)
+        g = self.group(position, team)
+        segment = self.orders[s, self.segment(s, g)]
+        offset = max(int(offset), 0)
+        rows = segment[offset:offset + max(int(k), 0)]
+        return {"stat": stat, "group": self.groups[g], "total": len(segment), "offset": offset,
+                "gameweeks": self.meta["gameweeks"], "players": [self.entry(s, g, row) for row in rows]}
+
+    #rank of one player overall, in their position and in their team
+    def rank(self, player_id, stat):
+        s = self.stat(stat)
+        row = self.player_index.get(player_id)
+        if row is None:
+            return None
+        player = self.players[row]
+        value = float(self.totals[row, s])
+
+        ranks = {}
+        for label, g in (("overall", self.group_index["all"]),
+                         ("position", self.group_index[f"position:{player['position_id']}"]),
+                         ("team", self.group_index[f"team:{player['team']}"])):
+            ranks[label] = {"rank": self.rank_of_value(s, g, value), "of": int(self.offsets[g + 1] - self.offsets[g])}
+
+        return dict(player, stat=stat, value=round(value, 2), ranks=ranks)
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+#the saved leaderboard if it matches the store, otherwise built in memory
+def get_leaderboard(path=None):
+    global _leaderboard
+
+    path = path or tensor_store.TENSOR_PATH
+    version = store_version(path)
+    if _leaderboard is not None and _leaderboard.version == version and _leaderboard.path == path:
+        return _leaderboard
+
+    with _leaderboard_lock:
+        if _leaderboard is None or _leaderboard.version != version or _leaderboard.path != path:
+            leaderboard = None
+            if os.path.exists(os.path.join(path, LEADERBOARD_FILE)):
+                leaderboard = Leaderboard.load(path)
+                if leaderboard.version != version:
+                    leaderboard = None
+            if leaderboard is None:
+                leaderboard = Leaderboard.build(open_store(path))
+            leaderboard.path = path
+            _leaderboard = leaderboard
+    return _leaderboard
+
+#called by the ingestion once the new gameweeks are in the tensor store
+def refresh_leaderboard(path=None):
+    path = path or tensor_store.TENSOR_PATH
+    leaderboard = Leaderboard.build(open_store(path))
+    leaderboard.save(path)
+    print(f"Leaderboards refreshed for {len(leaderboard.stats)} stats and {len(leaderboard.groups)} groups")
+    return leaderboard
+
+if __name__ == "__main__":
+    leaderboard = refresh_leaderboard()
+    stat = sys.argv[1] if len(sys.argv) > 1 else "total_points"
+    for player in leaderboard.top(stat)["players"]:
+        print(f"{player['rank']:>3} {player['name']} ({player['team']}) {player['value']}")
@@ -0,0 +1,155 @@
+#side by side comparison of a few players: per-gameweek series, totals, per-90 rates and league percentiles
+#the records of every player come from one query, then all the numbers are computed on (player, gameweek, stat) arrays
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.storage import get_storage
+from algorithm.form_engine import get_form_engine
+
+DEFAULT_STATS = ["total_points", "goals_scored", "assists", "expected_goals", "minutes"]
+MAX_PLAYERS = int(os.getenv("COMPARE_MAX_PLAYERS", "30"))
+MAX_STATS = 20
+#gameweeks of a premier league season
+MAX_GAMEWEEK = 38
+#numeric fields of the statistics of a raw row (the stats of the fpl live endpoint)
+STATS = [
+    "minutes", "total_points", "goals_scored", "assists", "clean_sheets", "goals_conceded", "own_goals",
+    "penalties_saved", "penalties_missed", "yellow_cards", "red_cards", "saves", "bonus", "bps", "influence",
+    "creativity", "threat", "ict_index", "starts", "expected_goals", "expected_assists",
+    "expected_goal_involvements", "expected_goals_conceded", "clearances_blocks_interceptions", "recoveries",
+    "tackles", "defensive_contribution", "in_dreamteam"
+]
+
+
+def parse_ids(values):
+    ids = []
+    for value in values:
+        for part in str(value).split(","):
+            part = part.strip()
+            if part:
+                player_id = int(part)
+                if player_id not in ids:
+                    ids.append(player_id)
+    if not ids:
+        raise ValueError("ids is required")
+    if len(ids) > MAX_PLAYERS:
+        raise ValueError(f"At most {MAX_PLAYERS} players can be compared")
+    return ids
+
+def parse_stats(text):
+    stats = []
+    for stat in (text or "").split(","):
+        stat = stat.strip()
+        if not stat:
+            continue
+        if stat not in STATS:
+            raise ValueError(f"Unknown stat: {stat}")
+        if stat not in stats:
+            stats.append(stat)
+    if len(stats) > MAX_STATS:
+        raise ValueError(f"At most {MAX_STATS} stats can be compared")
+    return stats or list(DEFAULT_STATS)
+
+def check_gameweek(name, gameweek):
+    if gameweek is not None and not 1 <= gameweek <= MAX_GAMEWEEK:
+        raise ValueError(f"{name} must be between 1 and {MAX_GAMEWEEK}")
+
+#(players x gameweeks x stats) values and (players x gameweeks) played mask from the records
+def build_arrays(records, player_ids, gameweeks, stats):
+    player_index = {player_id: i for i, player_id in enumerate(player_ids)}
+    columns = ["minutes"] + stats
+    values = np.zeros((len(player_ids), len(gameweeks), len(columns)))
+    played = np.zeros((len(player_ids), len(gameweeks)), dtype=bool)
+    if not records:
+        return values, played
+
+    rows = np.array([player_index[record["player_id"]] for record in records])
+    cols = np.array([record["gameweek"] - gameweeks[0] for record in records])
+    cells = np.array([[float((record.get("statistics") or {}).get(stat) or 0) for stat in columns]
+                      for record in records])
+    values[rows, cols] = cells
+    played[rows, cols] = True
+    return values, played
+
+#share of the players who played in the window with a total at most the player's, in percent
+def league_percentiles(stats, totals, start, end):
+    try:
+        engine = get_form_engine()
+    except Exception as e:
+        print(f"Error opening the form engine: {e}")
+        return None
+    start, end = engine.bounds(start=start, end=end)
+
+    percentiles = np.full(totals.shape, np.nan)
+    active = engine.window_matches(start, end) > 0
+    if not active.any():
+        return percentiles
+    for s, stat in enumerate(stats):
+        try:
+            league = np.sort(engine.window_sums(stat, start, end)[active])
+        except ValueError:
+            #not a stat of the tensor store
+            continue
+        percentiles[:, s] = np.searchsorted(league, totals[:, s] + 1e-9, side="right") / len(league) * 100
+    return percentiles
+
+#two decimals as python floats, None where the value is nan
+def rounded(values):
+    result = np.round(values, 2).astype(object)
+    result[np.isnan(values)] = None
+    return result
+
+def compare_players(player_ids, stats=None, from_gw=None, to_gw=None):
+    stats = stats or list(DEFAULT_STATS)
+    check_gameweek("from_gw", from_gw)
+    check_gameweek("to_gw", to_gw)
+    fields = ["player_id", "gameweek", "name", "team", "position_id"] + ["statistics." + stat
+                                                                        for stat in ["minutes"] + stats]
+    records = get_storage().fetch_records_of_players(player_ids, from_gw, to_gw, fields=fields)
+
+    present = {record["player_id"] for record in records}
+    found = [player_id for player_id in player_ids if player_id in present]
+    first = from_gw if from_gw is not None else min((r["gameweek"] for r in records), default=1)
+    last = to_gw if to_gw is not None else max((r["gameweek"] for r in records), default=first)
+    if last < first:
+        raise ValueError("to_gw must not be before from_gw")
+    gameweeks = list(range(first, last + 1))
+
+    values, played = build_arrays(records, found, gameweeks, stats)
+    minutes = values[:, :, 0].sum(axis=1)
+    series = values[:, :, 1:]
+    totals = series.sum(axis=1)
+    per_90 = np.divide(totals * 90, minutes[:, None], out=np.full(totals.shape, np.nan), where=minutes[:, None] > 0)
+    percentiles = league_percentiles(stats, totals, first, last)
+
+    #null for the gameweeks a player has no record in
+    series = rounded(np.where(played[:, :, None], series, np.nan))
+    totals = rounded(totals)
+    per_90 = rounded(per_90)
+    if percentiles is not None:
+        percentiles = rounded(percentiles)
+
+    #name and team of the latest record of each player in the window
+    latest = {record["player_id"]: record for record in records}
+    players = []
+    for p, player_id in enumerate(found):
+        record = latest[player_id]
+        players.append({
+            "player_id": player_id,
+            "name": record.get("name"),
+            "team": record.get("team"),
+            "position_id": record.get("position_id"),
+            "matches_played": int(played[p].sum()),
+            "minutes": int(minutes[p]),
+            "series": dict(zip(stats, series[p].T.tolist())),
+            "totals": dict(zip(stats, totals[p].tolist())),
+            "per_90": dict(zip(stats, per_90[p].tolist())),
+            "percentiles": dict(zip(stats, percentiles[p].tolist())) if percentiles is not None else None,
+        })
+
+    return {"from_gw": first, "to_gw": last, "gameweeks": gameweeks, "stats": stats, "players": players,
+            "missing": [player_id for player_id in player_ids if player_id not in present]}
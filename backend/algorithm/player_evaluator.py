@@ -3,11 +3,16 @@ import os
 import json
 import pandas as pd
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
-from data_layer.database import fetch_gameweek_data, save_gameweek_data
+from data_layer.database import content_digest
+from data_layer.instrumentation import count
+from data_layer.storage import (fetch_gameweek_data, save_gameweek_data, fetch_gameweeks_data, save_gameweeks_data,
+                                fetch_gameweek_ids, fetch_summary_digests)
+from data_layer.tensor_store import open_store
 
 file_path = os.path.abspath(__file__)
 current_folder = os.path.dirname(file_path)
@@ -16,17 +21,52 @@ parent_folder = os.path.dirname(current_folder)
 # datalayer/analytics
 ANALYTICS_FOLDER = os.path.join(parent_folder, "data_layer", "analytics")
 
+#processes used by calculate_metrics_many
+METRICS_WORKERS = int(os.getenv("METRICS_WORKERS", str(os.cpu_count() or 1)))
+
+#where calculate_metrics_many reads the rows: documents (storage backend) or tensor (memory mapped store)
+METRICS_ENGINE = os.getenv("METRICS_ENGINE", "documents")
+
+#columns used by the gameweek metrics and their default when the stat is missing
+METRIC_DEFAULTS = {
+    'minutes': 0,
+    'total_points': 0,
+    'goals_scored': 0,
+    'assists': 0,
+    'influence': 0.0,
+    'yellow_cards': 0,
+    'in_dreamteam': False,
+    'red_cards': 0,
+    'goals_conceded': 0
+}
+
+#players per position in the dream team (gk, def, mid, fwd)
+DREAM_TEAM_SLOTS = {1: 1, 2: 3, 3: 4, 4: 3}
+
 def best_players(pos_id, count, df, dream_team):
-            position_df = df[df['position_id'] == pos_id]
-            sorted_pos = position_df.sort_values(by='total_points', ascending=False)
-            best = sorted_pos.head(count)
-            
-            for index, p in best.iterrows():
-                dream_team.append({
-                    "name": p['name'],
-                    "team": p['team'],
-                    "total_points": int(p['total_points'])
-                })
+    position_df = df[df['position_id'] == pos_id]
+    best = position_df.sort_values(by='total_points', ascending=False, kind='stable').head(count)
+    dream_team.extend(dream_team_rows(best))
+
+def dream_team_rows(best):
+    rows = []
+    for name, team, points in zip(best['name'], best['team'], best['total_points']):
+        rows.append({
+            "name": name,
+            "team": team,
+            "total_points": int(points)
+        })
+    return rows
+
+#whole dream team with a single sort, the best N of each position
+def dream_team_picks(df, slots=None):
+    slots = slots or DREAM_TEAM_SLOTS
+    sorted_df = df.sort_values(by='total_points', ascending=False, kind='stable')
+    rank_in_position = sorted_df.groupby('position_id').cumcount()
+    picked = sorted_df[rank_in_position < sorted_df['position_id'].map(slots).fillna(0)]
+    #gk first, then def, mid and fwd, keeping the points order inside each position
+    picked = picked.sort_values(by='position_id', kind='stable')
+    return dream_team_rows(picked)
 
 #function to take top team lists 
 def top_teams(team_stats, column, method='max'):
@@ -37,132 +77,254 @@ def top_teams(team_stats, column, method='max'):
         
     filtered = team_stats[team_stats[column] == target_value]
     result_list = []
-    for index, row in filtered.iterrows():
+    for team, value in zip(filtered['team'], filtered[column]):
         result_list.append({
-            "team": row['team'],
-            "value": int(row[column])
+            "team": team,
+            "value": int(value)
         })
     return result_list
 
-def calculate_metrics(gameweek_id):
-    print(f"Calculating metrics for gameweek {gameweek_id}")
+#columnar dataframe straight from the raw documents
+def docs_to_frame(gameweek_data):
+    columns = {
+        'player_id': [doc['player_id'] for doc in gameweek_data],
+        'name': [doc['name'] for doc in gameweek_data],
+        'team': [doc['team'] for doc in gameweek_data],
+        'position_id': [doc['position_id'] for doc in gameweek_data],
+        'gameweek': [doc.get('gameweek') for doc in gameweek_data]
+    }
+    all_stats = [doc.get('statistics', {}) for doc in gameweek_data]
+    for column, default in METRIC_DEFAULTS.items():
+        columns[column] = [stats.get(column, default) for stats in all_stats]
+
+    return pd.DataFrame(columns)
+
+def build_gameweek_summary(df, gameweek_id):
+    #MVP with no draw option
+    df_sorted = df.sort_values(
+        by=['total_points', 'goals_scored', 'in_dreamteam', 'influence', 'yellow_cards'],
+        ascending=[False, False, False, False, True]
+    )
+
+    #selects first row, highest value (MVP)
+    mvp_row = df_sorted.iloc[0] #iloc to find for position
     
-    try:
+    mvp_dict = {
+        "name": mvp_row['name'],
+        "team": mvp_row['team'],
+        "points": int(mvp_row['total_points']),
+        "goals": int(mvp_row['goals_scored'])
+    }
+
+    #top scorers, every player tied on the max goals
+    scorers = df[df['goals_scored'] == df['goals_scored'].max()]
+    top_scorers = []
+    for name, team, goals in zip(scorers['name'], scorers['team'], scorers['goals_scored']):
+        top_scorers.append({
+            "name": name,
+            "team": team,
+            "goals": int(goals)
+        })
+
+    #dreamteam
+    dream_team = dream_team_picks(df)
+
+    #team stats
+    team_stats = df.groupby('team').agg({
+        'goals_scored': 'sum',      #sum of all goals of all players in a team
+        'goals_conceded': 'max',    
+        'yellow_cards': 'sum',
+        'red_cards': 'sum'
+    }).reset_index()
+
+    #total of targets in a team
+    team_stats['total_cards'] = team_stats['yellow_cards'] + team_stats['red_cards']
+
+    #tops of teams
+    most_attacking = top_teams(team_stats, 'goals_scored', 'max')
+    best_defense = top_teams(team_stats, 'goals_conceded', 'min')
+    most_cards = top_teams(team_stats, 'total_cards', 'max')
+    least_cards = top_teams(team_stats, 'total_cards', 'min')
+
+    #prepare json file
+    return {
+        "_id": "summary_gw_" + str(gameweek_id),
+        "gameweek": gameweek_id,
+        "mvp": mvp_dict,
+        "top_scorers": top_scorers,
+        "dream_team": dream_team,
+        "team_stats": {
+            "most_goals_scored": most_attacking,
+            "least_goals_conceded": best_defense,
+            "most_cards_conceded": most_cards,
+            "least_cards_conceded": least_cards
+        }
+    }
+
+def summary_file_path(gameweek_id):
+    file_name = "analytics_gw_" + str(gameweek_id) + ".json"
+    return os.path.join(ANALYTICS_FOLDER, file_name)
+
+def write_summary_file(summary):
+    #save to file
+    if not os.path.exists(ANALYTICS_FOLDER):
+        os.makedirs(ANALYTICS_FOLDER)
+
+    with open(summary_file_path(summary["gameweek"]), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+#digest of the raw rows of each gameweek, {gameweek: digest}
+def gameweek_digests(gameweek_data):
+    partitions = {}
+    for doc in gameweek_data:
+        partitions.setdefault(doc['gameweek'], []).append(doc)
+
+    digests = {}
+    for gameweek_id, docs in partitions.items():
+        digests[gameweek_id] = content_digest(docs)
+    return digests
+
+#gameweeks whose rows differ from the ones their stored summary was computed from
+def changed_gameweeks(digests, stored_digests, force=False):
+    changed = []
+    for gameweek_id in sorted(digests):
+        unchanged = (
+            stored_digests.get(gameweek_id) == digests[gameweek_id]
+            and os.path.exists(summary_file_path(gameweek_id))
+        )
+        if force or not unchanged:
+            changed.append(gameweek_id)
+    return changed
+
+#metrics of one gameweek, None when its rows did not change, errors are raised to the caller
+#pool is an optional process pool for the summary itself (the staged pipeline shares one)
+def metrics_for_gameweek(gameweek_id, force=False, engine=None, pool=None):
+    engine = engine or METRICS_ENGINE
+
+    if engine == 'tensor':
+        store = open_store()
+        if gameweek_id not in store.index["gameweeks"]:
+            print("There is not available data for this gameweek.")
+            return None
+        digest = store.gameweek_digest(gameweek_id)
+    else:
         gameweek_data = fetch_gameweek_data(gameweek_id)
-        players_list = []
-
-        for doc in gameweek_data:
-            stats = doc.get('statistics', {})
-            
-            row = {
-                'player_id': doc['player_id'],
-                'name': doc['name'],
-                'team': doc['team'],
-                'position_id': doc['position_id'],
-                'minutes': stats.get('minutes', 0),
-                'total_points': stats.get('total_points', 0),
-                'goals_scored': stats.get('goals_scored', 0),
-                'assists': stats.get('assists', 0),
-                'influence': stats.get('influence', 0.0),
-                'yellow_cards': stats.get('yellow_cards', 0),
-                'in_dreamteam': stats.get('in_dreamteam', False),
-                'red_cards': stats.get('red_cards', 0),
-                'goals_conceded': stats.get('goals_conceded', 0)
-            }
-            players_list.append(row)
-
-        if len(players_list) == 0:
+        if len(gameweek_data) == 0:
             print("There is not available data for this gameweek.")
-            return
+            return None
+        digest = content_digest(gameweek_data)
 
-        df = pd.DataFrame(players_list)
-    
+    #same rows as last time, the stored summary is still valid
+    if not changed_gameweeks({gameweek_id: digest}, fetch_summary_digests([gameweek_id]), force):
+        print(f"Gameweek {gameweek_id} unchanged, skipping metrics")
+        return None
+
+    if engine == 'tensor':
+        df = store.frame([gameweek_id], METRIC_DEFAULTS)
+    else:
+        df = docs_to_frame(gameweek_data)
+    count(rows=len(df))
+
+    if pool is None:
+        summary = build_gameweek_summary(df, gameweek_id)
+    else:
+        summary = pool.submit(summary_from_frame, (gameweek_id, df)).result()
+    summary["input_digest"] = digest
+
+    write_summary_file(summary)
+
+    save_gameweek_data(summary)
+    print(f"Metrics uploaded to MongoDB for GW {gameweek_id}")
+    return summary
+
+def calculate_metrics(gameweek_id, force=False):
+    print(f"Calculating metrics for gameweek {gameweek_id}")
     
-        #MVP with no draw option
-        df_sorted = df.sort_values(
-            by=['total_points', 'goals_scored', 'in_dreamteam', 'influence', 'yellow_cards'],
-            ascending=[False, False, False, False, True]
-        )
+    try:
+        return metrics_for_gameweek(gameweek_id, force)
+        
+    except Exception as e:
+        print(f"Something happened: {e}")
+        return None
 
-        if not df_sorted.empty:
-            #selects first row, highest value (MVP)
-            mvp_row = df_sorted.iloc[0] #iloc to find for position
+#runs in the worker processes, one gameweek per call
+def summary_from_frame(task):
+    gameweek_id, df = task
+    return build_gameweek_summary(df, gameweek_id)
+
+#one (gameweek, frame) task per gameweek in the rows
+def gameweek_tasks(gameweek_data):
+    #columnar frames are much cheaper to send to the workers than lists of dicts
+    df = docs_to_frame(gameweek_data)
+    tasks = []
+    for gameweek_id, partition in df.groupby('gameweek', sort=True):
+        tasks.append((int(gameweek_id), partition.reset_index(drop=True)))
+    return tasks
+
+#computes the summaries of the tasks on a process pool
+def summarise_tasks(tasks, workers=None):
+    workers = workers or METRICS_WORKERS
+
+    if workers <= 1 or len(tasks) <= 1:
+        return [summary_from_frame(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        return list(pool.map(summary_from_frame, tasks))
+
+#partitions the rows by gameweek and computes the summaries on a process pool
+def summarise_gameweeks(gameweek_data, workers=None):
+    return summarise_tasks(gameweek_tasks(gameweek_data), workers)
+
+#batch version of calculate_metrics: one fetch, parallel summaries, one bulk write
+#only the gameweeks whose rows changed are recomputed unless force is set
+#the tensor engine slices the memory mapped store instead of fetching documents
+def calculate_metrics_many(gameweek_ids, workers=None, force=False, engine=None):
+    engine = engine or METRICS_ENGINE
+    gameweek_ids = sorted(set(gameweek_ids))
+    print(f"Calculating metrics for gameweeks {gameweek_ids}")
+
+    try:
+        if engine == 'tensor':
+            store = open_store()
+            digests = {}
+            for gameweek_id in gameweek_ids:
+                if gameweek_id in store.index["gameweeks"]:
+                    digests[gameweek_id] = store.gameweek_digest(gameweek_id)
         else:
-            mvp_row = None
-        
-        mvp_dict = {
-            "name": mvp_row['name'],
-            "team": mvp_row['team'],
-            "points": int(mvp_row['total_points']),
-            "goals": int(mvp_row['goals_scored'])
-        }
+            gameweek_data = fetch_gameweeks_data(gameweek_ids)
+            digests = gameweek_digests(gameweek_data)
 
-        #top scorers
-        max_goals = df['goals_scored'].max()
-        top_scorers = []
-
-        for index, player in df.iterrows(): # TODO: document it
-            if player['goals_scored'] == max_goals:
-                top_scorers.append({
-                    "name": player['name'],
-                    "team": player['team'],
-                    "goals": int(player['goals_scored'])
-                })
-
-        #dreamteam
-        dream_team = []    
-
-        best_players(1, 1, df, dream_team) #gk
-        best_players(2, 3, df, dream_team) #def
-        best_players(3, 4, df, dream_team) #mid
-        best_players(4, 3, df, dream_team) #fwd
-
-        #team stats
-        team_stats = df.groupby('team').agg({
-            'goals_scored': 'sum',      #sum of all goals of all players in a team
-            'goals_conceded': 'max',    
-            'yellow_cards': 'sum',
-            'red_cards': 'sum'
-        }).reset_index()
-
-        #total of targets in a team
-        team_stats['total_cards'] = team_stats['yellow_cards'] + team_stats['red_cards']
-
-        #tops of teams
-        most_attacking = top_teams(team_stats, 'goals_scored', 'max')
-        best_defense = top_teams(team_stats, 'goals_conceded', 'min')
-        most_cards = top_teams(team_stats, 'total_cards', 'max')
-        least_cards = top_teams(team_stats, 'total_cards', 'min')
-
-        #prepare json file
-        summary = {
-            "_id": "summary_gw_" + str(gameweek_id),
-            "gameweek": gameweek_id,
-            "mvp": mvp_dict,
-            "top_scorers": top_scorers,
-            "dream_team": dream_team,
-            "team_stats": {
-                "most_goals_scored": most_attacking,
-                "least_goals_conceded": best_defense,
-                "most_cards_conceded": most_cards,
-                "least_cards_conceded": least_cards
-            }
-        }
+        if len(digests) == 0:
+            print("There is not available data for these gameweeks.")
+            return []
 
-        #save to file
-        if not os.path.exists(ANALYTICS_FOLDER):
-            os.makedirs(ANALYTICS_FOLDER)
+        pending = changed_gameweeks(digests, fetch_summary_digests(gameweek_ids), force)
+        skipped = len(digests) - len(pending)
+        if skipped:
+            print(f"{skipped} gameweeks unchanged, skipping their metrics")
+        if not pending:
+            return []
 
-        file_name = "analytics_gw_" + str(gameweek_id) + ".json"
-        full_path = os.path.join(ANALYTICS_FOLDER, file_name)
+        if engine == 'tensor':
+            tasks = [(gameweek_id, store.frame([gameweek_id], METRIC_DEFAULTS)) for gameweek_id in sorted(pending)]
+        else:
+            tasks = gameweek_tasks([doc for doc in gameweek_data if doc['gameweek'] in pending])
+        summaries = summarise_tasks(tasks, workers)
 
-        with open(full_path, 'w') as f:
-            json.dump(summary, f, indent=2)
+        for summary in summaries:
+            summary["input_digest"] = digests[summary["gameweek"]]
+            write_summary_file(summary)
+
+        save_gameweeks_data(summaries)
+        print(f"Metrics uploaded to MongoDB for {len(summaries)} gameweeks")
+        return summaries
 
-        save_gameweek_data(summary)
-        print(f"Metrics uploaded to MongoDB for GW {gameweek_id}")
-        
     except Exception as e:
         print(f"Something happened: {e}")
-        
+        return []
 
+#reprocess the given gameweeks (all of them by default), --force ignores the digests
+if __name__ == "__main__":
+    force = "--force" in sys.argv
+    requested = [int(arg) for arg in sys.argv[1:] if arg != "--force"]
+    calculate_metrics_many(requested or fetch_gameweek_ids(), force=force)
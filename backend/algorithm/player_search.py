@@ -0,0 +1,168 @@
+#in-memory name search over the players directory, used by the autocomplete and the player pages
+#names are folded (case, accents), a query matches on word prefixes first and on trigrams for typos
+import os
+import re
+import sys
+import threading
+from bisect import bisect_left
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.database import normalise_name, read_error_count
+from data_layer.storage import get_storage
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+#share of trigrams a word needs with a query term to count as a fuzzy match
+MIN_SIMILARITY = 0.3
+
+#letters that unicode does not decompose into a base letter and an accent
+EXTRA_FOLDS = str.maketrans({
+    "ø": "o", "đ": "d", "ı": "i", "ł": "l", "ß": "ss", "æ": "ae", "œ": "oe", "þ": "th"
+})
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def fold(text):
+    return normalise_name(text).translate(EXTRA_FOLDS)
+
+#"Rayan Aït-Nouri" -> ["rayan", "ait", "nouri"]
+def words(text):
+    return WORD.findall(fold(text))
+
+def trigrams(word):
+    padded = "  " + word + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class PlayerSearch:
+
+    def __init__(self, players, version=None):
+        self.version = version
+        self.players = []
+        self.names = []
+        vocabulary = {}
+        word_players = []
+
+        for player in players:
+            index = len(self.players)
+            self.players.append({"_id": player["_id"], "name": player["name"], "team": player.get("team"),
+                                 "position_id": player.get("position_id")})
+            self.names.append(" ".join(words(player["name"])))
+            for word in set(words(player["name"])):
+                if word not in vocabulary:
+                    vocabulary[word] = len(vocabulary)
+                    word_players.append([])
+                word_players[vocabulary[word]].append(index)
+
+        #sorted words for the prefix lookups, word ids in the same order
+        self.words = sorted(vocabulary)
+        self.word_players = [word_players[vocabulary[word]] for word in self.words]
+        self.word_trigrams = [len(trigrams(word)) for word in self.words]
+        self.trigram_words = {}
+        for word_id, word in enumerate(self.words):
+            for trigram in trigrams(word):
+                self.trigram_words.setdefault(trigram, []).append(word_id)
+
+    def __len__(self):
+        return len(self.players)
+
+    #ids of the words starting with term, a contiguous range of the sorted words
+    def prefix_words(self, term):
+        start = bisect_left(self.words, term)
+        end = start
+        while end < len(self.words) and self.words[end].startswith(term):
+            end += 1
+        return range(start, end)
+
+    #(word id, jaccard similarity of the trigrams) of the words sharing trigrams with term
+    def similar_words(self, term):
+        term_trigrams = trigrams(term)
+        shared = {}
+        for trigram in term_trigrams:
+            for word_id in self.trigram_words.get(trigram, ()):
+                shared[word_id] = shared.get(word_id, 0) + 1
+        for word_id, hits in shared.items():
+            yield word_id, hits / (len(term_trigrams) + self.word_trigrams[word_id] - hits)
+
+    def prefix_scores(self, terms, query):
+        matched = None
+        for term in terms:
+            players = set()
+            for word_id in self.prefix_words(term):
+                players.update(self.word_players[word_id])
+            matched = players if matched is None else matched & players
+            if not matched:
+                return {}
+
+        #exact name first, then names starting with the query, then any word order
+        scores = {}
+        for index in matched:
+            if self.names[index] == query:
+                scores[index] = 3.0
+            elif self.names[index].startswith(query):
+                scores[index] = 2.0
+            else:
+                scores[index] = 1.0
+        return scores
+
+    #average over the query terms of the best similarity of a word of the name, always below a prefix match
+    def fuzzy_scores(self, terms):
+        totals = {}
+        for term in terms:
+            best = {}
+            for word_id, similarity in self.similar_words(term):
+                for index in self.word_players[word_id]:
+                    if similarity > best.get(index, 0):
+                        best[index] = similarity
+            for index, similarity in best.items():
+                totals[index] = totals.get(index, 0) + similarity / len(terms)
+        return {index: score * 0.99 for index, score in totals.items() if score >= MIN_SIMILARITY}
+
+    def search(self, text, limit=DEFAULT_LIMIT):
+        terms = words(text or "")
+        if not terms:
+            return []
+        limit = max(1, min(int(limit), MAX_LIMIT))
+
+        scores = self.prefix_scores(terms, " ".join(terms))
+        #typos are only looked at when the prefixes do not fill the page
+        if len(scores) < limit:
+            for index, score in self.fuzzy_scores(terms).items():
+                scores.setdefault(index, score)
+
+        ranked = sorted(scores, key=lambda index: (-scores[index], self.names[index], str(self.players[index]["_id"])))
+        return [dict(self.players[index], score=round(scores[index], 3)) for index in ranked[:limit]]
+
+    #the player a free text url points to, None if nothing is close enough
+    def best_match(self, text):
+        results = self.search(text, limit=1)
+        return results[0] if results else None
+
+
+_search = None
+_search_lock = threading.Lock()
+
+#the index of the current data, rebuilt from the players directory when the version changes
+#a directory that failed to load or came back empty is used for this call only and read again on the next one
+def get_player_search(version=None):
+    global _search
+
+    if _search is not None and _search.version == version:
+        return _search
+
+    with _search_lock:
+        if _search is not None and _search.version == version:
+            return _search
+        errors = read_error_count()
+        search = PlayerSearch(get_storage().fetch_players_directory(), version)
+        if len(search) and read_error_count() == errors:
+            _search = search
+    return search
+
+def search_players(text, limit=DEFAULT_LIMIT, version=None):
+    return get_player_search(version).search(text, limit)
+
+if __name__ == "__main__":
+    query = " ".join(sys.argv[1:])
+    for player in search_players(query):
+        print(f"{player['score']:>5} {player['name']} ({player['team']}) id={player['_id']}")
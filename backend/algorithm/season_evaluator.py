@@ -1,6 +1,7 @@
 # with the info of all gameweeks, calculates seasons metrics
 import os
 import json
+import numpy as np
 import pandas as pd
 import sys
 from datetime import datetime
@@ -9,7 +10,11 @@ from collections import Counter
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
 
-from data_layer.database import fetch_all_raw_data, save_season_data, fetch_mvp_data
+from data_layer.database import content_digest
+from data_layer.storage import (fetch_all_raw_data, save_season_data, fetch_mvp_data, aggregate_player_totals,
+                                aggregate_max_gameweek, aggregate_recent_stats, aggregate_team_goals,
+                                aggregate_team_conceded, fetch_summary_digests, fetch_season_digest)
+from data_layer.tensor_store import open_store
 
 file_path = os.path.abspath(__file__)
 current_folder = os.path.dirname(file_path)
@@ -75,10 +80,20 @@ def find_winners(dataframe, column_name, method):
     return results
 
 
-def calculate_season_stats():
-    print("Recalculating season stats")
+#which engine computes the season totals: pandas (default), pushdown (aggregated by the storage backend)
+#or tensor (numpy over the memory mapped store), "mongo" is still accepted for pushdown
+SEASON_ENGINE = os.getenv("SEASON_ENGINE", "pandas")
 
-    raw_data = fetch_all_raw_data()     #get the info of all players in each gameweek (Players table in MongoDB)
+PLAYER_KEYS = ['player_id', 'name', 'team', 'position_id']
+#float sums, which depend on the order of the additions: the pushdown and tensor engines add the values of a
+#group in the order the pandas engine reads the rows in, with the same groupby
+DECIMAL_SUM_COLUMNS = ['expected_goals']
+PLAYER_SUM_COLUMNS = [
+    'goals_scored', 'assists', 'minutes', 'goals_conceded', 'clean_sheets', 'penalties_saved',
+    'yellow_cards', 'red_cards', 'expected_goals', 'in_dreamteam', 'total_points'
+]
+
+def raw_to_frame(raw_data):
     players_list = []
     
     for doc in raw_data:
@@ -104,30 +119,192 @@ def calculate_season_stats():
         }
         players_list.append(row)
 
-    if len(players_list) == 0:
-        print("No raw data found in database.")
-        return
-
-    df = pd.DataFrame(players_list)
+    return pd.DataFrame(players_list)
 
+#season aggregates from the row level dataframe
+def season_frames_pandas(df):
     #group by players to later sum stats across al gameweeks
-    p_totals = df.groupby(['player_id', 'name', 'team', 'position_id']).agg({
+    aggregations = {}
+    for column in PLAYER_SUM_COLUMNS:
+        aggregations[column] = 'sum'
+    aggregations['gameweek'] = 'count' # matches played by this player
+
+    p_totals = df.groupby(PLAYER_KEYS).agg(aggregations).reset_index()
+    p_totals.rename(columns={'gameweek': 'matches_played'}, inplace=True)
+
+    current_max_gw = df['gameweek'].max()
+
+    #last 3 games stats
+    start_gameweek = current_max_gw - 2 
+    recent_df = df[df['gameweek'] >= start_gameweek]
+    
+    #group the recent data available
+    recent_stats = recent_df.groupby(['name', 'team']).agg({
         'goals_scored': 'sum',
         'assists': 'sum',
-        'minutes': 'sum',
-        'goals_conceded': 'sum',
-        'clean_sheets': 'sum',
-        'penalties_saved': 'sum',
-        'yellow_cards': 'sum',
-        'red_cards': 'sum',
-        'expected_goals': 'sum',
-        'in_dreamteam': 'sum', 
-        'total_points': 'sum',
-        'gameweek': 'count' # matches played by this player
+        'gameweek': 'count'
     }).reset_index()
+    recent_stats.rename(columns={'gameweek': 'matches_played'}, inplace=True)
 
-    p_totals.rename(columns={'gameweek': 'matches_played'}, inplace=True)
+    #team most scored goals
+    team_goals = df.groupby('team')['goals_scored'].sum().reset_index()
+
+    #least conceded goals
+    goals_conceded_per_gw = df.groupby(['team', 'gameweek'])['goals_conceded'].max().reset_index()
+    team_conceded = goals_conceded_per_gw.groupby('team')['goals_conceded'].sum().reset_index()
+
+    return p_totals, recent_stats, team_goals, team_conceded, current_max_gw
+
+#rows coming from an aggregation, ordered and typed like a pandas groupby would
+def grouped_frame(rows, keys, columns):
+    frame = pd.DataFrame(rows, columns=keys + columns)
+    for column in columns:
+        if column in ('in_dreamteam', 'matches_played'):
+            frame[column] = frame[column].fillna(0).astype('int64')
+        else:
+            frame[column] = frame[column].fillna(0).astype('float64')
+    return frame.sort_values(by=keys).reset_index(drop=True)
+
+#float sums of the decimal columns by the pandas groupby, values are added in the order they are given
+#(a $sum or a SUM of floats adds them in its own way, the last digits would differ from the pandas engine)
+def decimal_sums(groups, values, count):
+    sums = pd.Series(values, dtype='float64').groupby(groups).sum()
+    return sums.reindex(range(count), fill_value=0.0).to_numpy()
+
+#the storage returns the values of every row of a group for the decimal columns, in the order of its raw reads
+def sum_decimal_values(rows):
+    for column in DECIMAL_SUM_COLUMNS:
+        groups, values = [], []
+        for position, row in enumerate(rows):
+            groups.extend([position] * len(row.get(column) or []))
+            values.extend(float(value or 0) for value in row.get(column) or [])
+        for row, total in zip(rows, decimal_sums(groups, values, len(rows))):
+            row[column] = float(total)
+    return rows
+
+#same aggregates computed by the storage (mongo pipelines or sql), only grouped rows are transferred
+def season_frames_pushdown():
+    current_max_gw = aggregate_max_gameweek()
+    if current_max_gw is None:
+        return None
+
+    p_totals = grouped_frame(
+        sum_decimal_values(aggregate_player_totals()), PLAYER_KEYS, PLAYER_SUM_COLUMNS + ['matches_played']
+    )
+    recent_stats = grouped_frame(
+        aggregate_recent_stats(current_max_gw - 2), ['name', 'team'],
+        ['goals_scored', 'assists', 'matches_played']
+    )
+
+    team_goals = grouped_frame(aggregate_team_goals(), ['team'], ['goals_scored'])
+    team_conceded = grouped_frame(aggregate_team_conceded(), ['team'], ['goals_conceded'])
+
+    return p_totals, recent_stats, team_goals, team_conceded, current_max_gw
+
+#sums of values per group code, the cells of a group come in gameweek order (the order of the uploads)
+def group_sums(codes, values, column, groups):
+    if column in DECIMAL_SUM_COLUMNS:
+        return decimal_sums(codes, values, groups)
+    return np.bincount(codes, weights=values, minlength=groups)
+
+#codes of the distinct rows of the key columns, and the first position of each one
+def group_codes(*columns):
+    keys, first, codes = np.unique(np.stack(columns, axis=1), axis=0, return_index=True, return_inverse=True)
+    return codes.reshape(-1), first, len(keys)
+
+#same aggregates computed with numpy on the tensor store, no document is parsed
+def season_frames_tensor(store=None):
+    store = store or open_store()
+    players, gameweeks = store.played_cells()
+    if len(players) == 0:
+        return None
+
+    teams = store.teams[players, gameweeks]
+    current_max_gw = int(gameweeks.max()) + 1
+
+    #a player who changed team gets one row per team, like the groupby on the rows
+    codes, first, groups = group_codes(players, teams)
+    columns = {
+        'player_id': [store.index["players"][p]["player_id"] for p in players[first]],
+        'name': store.player_column("name", players[first]),
+        'team': store.team_names(teams[first]),
+        'position_id': [store.index["players"][p]["position_id"] for p in players[first]],
+        'matches_played': np.bincount(codes, minlength=groups)
+    }
+    for column in PLAYER_SUM_COLUMNS:
+        values = store.values(players, gameweeks, column)
+        if column == 'in_dreamteam':
+            values = (values != 0).astype('float64')
+        columns[column] = group_sums(codes, values, column, groups)
+    p_totals = grouped_frame(columns, PLAYER_KEYS, PLAYER_SUM_COLUMNS + ['matches_played'])
+
+    #last 3 games, grouped by name and team
+    recent = gameweeks >= current_max_gw - 3
+    recent_players, recent_gameweeks, recent_teams = players[recent], gameweeks[recent], teams[recent]
+    names = store.player_column("name", recent_players)
+    name_codes = np.unique(names.astype(str), return_inverse=True)[1].reshape(-1)
+    codes, first, groups = group_codes(name_codes, recent_teams)
+    recent_stats = grouped_frame({
+        'name': names[first],
+        'team': store.team_names(recent_teams[first]),
+        'goals_scored': group_sums(codes, store.values(recent_players, recent_gameweeks, 'goals_scored'),
+                                   'goals_scored', groups),
+        'assists': group_sums(codes, store.values(recent_players, recent_gameweeks, 'assists'), 'assists', groups),
+        'matches_played': np.bincount(codes, minlength=groups)
+    }, ['name', 'team'], ['goals_scored', 'assists', 'matches_played'])
+
+    team_ids = np.unique(teams)
+    goals = np.bincount(teams, weights=store.values(players, gameweeks, 'goals_scored'),
+                        minlength=len(store.index["teams"]))
+    team_goals = grouped_frame({'team': store.team_names(team_ids), 'goals_scored': goals[team_ids]},
+                               ['team'], ['goals_scored'])
+
+    #a team concedes the max of its players' goals_conceded in each gameweek
+    conceded = np.full((len(store.index["teams"]), store.rows.shape[1]), -np.inf)
+    np.maximum.at(conceded, (teams, gameweeks), store.values(players, gameweeks, 'goals_conceded'))
+    conceded = np.where(np.isinf(conceded), 0.0, conceded).sum(axis=1)
+    team_conceded = grouped_frame({'team': store.team_names(team_ids), 'goals_conceded': conceded[team_ids]},
+                                  ['team'], ['goals_conceded'])
+
+    return p_totals, recent_stats, team_goals, team_conceded, current_max_gw
+
+def most_mvps(analytics_data):
+    mvp_names = []    
+    for doc in analytics_data:
+        mvp_data = doc.get('mvp', {})
+
+        if 'name' in mvp_data:
+            mvp_names.append(mvp_data['name'])
+            
+    most_mvps_result = {"names": [], "count": 0}
     
+    if len(mvp_names) > 0:
+        #counter to find the most frequent name
+        counts = Counter(mvp_names)
+        max_mvps = max(counts.values())
+        #players who have that max count
+        most_mvps_list = []
+        for name, count in counts.items():
+            if count == max_mvps:
+                most_mvps_list.append(name)
+                
+        most_mvps_result = {"names": most_mvps_list, "count": max_mvps}
+
+    return most_mvps_result
+
+def current_season_id():
+    today = datetime.now()
+    if today.month > 6:
+        start_year = today.year
+    else:
+        start_year = today.year - 1
+    
+    end_year = start_year + 1
+    return "season_" + str(start_year) + "_" + str(end_year)
+
+#leaders, teams and top lists from the season aggregates
+def build_season_summary(p_totals, recent_stats, team_goals, team_conceded, current_max_gw, most_mvps_result):
+    p_totals = p_totals.copy()
     p_totals['total_cards'] = p_totals['yellow_cards'] + p_totals['red_cards']
 
     #Scorers/Asistants
@@ -137,7 +314,6 @@ def calculate_season_stats():
     most_yellows = find_winners(p_totals, 'yellow_cards', 'max')
     most_reds = find_winners(p_totals, 'red_cards', 'max')
 
-    current_max_gw = df['gameweek'].max()
     min_played = current_max_gw * 90 * 0.60
     
     #goalkeaper must have played atleast 60% of minutes
@@ -159,29 +335,14 @@ def calculate_season_stats():
     outfield_players = p_totals[p_totals['position_id'] != 1]
     most_min_played = find_winners(outfield_players, 'minutes', 'max')
 
-    #last 3 games stats
-    start_gameweek = current_max_gw - 2 
-    recent_df = df[df['gameweek'] >= start_gameweek]
-    
-    #group the recent data available
-    recent_stats = recent_df.groupby(['name', 'team']).agg({
-        'goals_scored': 'sum',
-        'assists': 'sum',
-        'gameweek': 'count'
-    }).reset_index()
-    recent_stats.rename(columns={'gameweek': 'matches_played'}, inplace=True)
-
     top_3_recent_scorers = get_top_3_ranking(recent_stats, 'goals_scored')
     top_3_recent_assisters = get_top_3_ranking(recent_stats, 'assists')
 
     #team most scored goals
-    team_goals = df.groupby('team')['goals_scored'].sum().reset_index()
     max_team_goals = team_goals['goals_scored'].max()
     most_scoring_teams = team_goals[team_goals['goals_scored'] == max_team_goals].to_dict('records')
 
     #least conceded goals
-    goals_conceded_per_gw = df.groupby(['team', 'gameweek'])['goals_conceded'].max().reset_index()
-    team_conceded = goals_conceded_per_gw.groupby('team')['goals_conceded'].sum().reset_index()
     min_team_conceded = team_conceded['goals_conceded'].min()
     least_conceded_teams = team_conceded[team_conceded['goals_conceded'] == min_team_conceded].to_dict('records')
 
@@ -194,42 +355,9 @@ def calculate_season_stats():
     defenders_df = p_totals[p_totals['position_id'] == 2]
     top_3_defenders = get_top_3_ranking(defenders_df, 'total_points')
 
-    #most MVPs
-    analytics_data = fetch_mvp_data()      #mvp of each gameweek (Gameweeks table)
-    mvp_names = []    
-    for doc in analytics_data:
-        mvp_data = doc.get('mvp', {})
-
-        if 'name' in mvp_data:
-            mvp_names.append(mvp_data['name'])
-            
-    most_mvps_result = {"names": [], "count": 0}
-    
-    if len(mvp_names) > 0:
-        #counter to find the most frequent name
-        counts = Counter(mvp_names)
-        max_mvps = max(counts.values())
-        #players who have that max count
-        most_mvps_list = []
-        for name, count in counts.items():
-            if count == max_mvps:
-                most_mvps_list.append(name)
-                
-        most_mvps_result = {"names": most_mvps_list, "count": max_mvps}
-
-    #calculate season id
-    today = datetime.now()
-    if today.month > 6:
-        start_year = today.year
-    else:
-        start_year = today.year - 1
-    
-    end_year = start_year + 1
-    season_id = "season_" + str(start_year) + "_" + str(end_year)
-    
     #preapare json file
-    season_summary = {
-        "_id": season_id,
+    return {
+        "_id": current_season_id(),
         "last_updated_gw": int(current_max_gw),
         "leaders": {
             "top_scorers": pichichis,
@@ -254,15 +382,60 @@ def calculate_season_stats():
         }
     }
 
+def season_file_path():
+    return os.path.join(ANALYTICS_FOLDER, "season_overview.json")
+
+#the season is a function of the gameweeks, so the digests of their summaries identify its input
+def summaries_digest(digests):
+    return content_digest([{"_id": str(gw), "digest": digest} for gw, digest in digests.items()])
+
+def season_input_digest():
+    return summaries_digest(fetch_summary_digests())
+
+def season_unchanged(digest):
+    return fetch_season_digest(current_season_id()) == digest and os.path.exists(season_file_path())
+
+def write_season_file(season_summary):
     #save to file
     if not os.path.exists(ANALYTICS_FOLDER):
         os.makedirs(ANALYTICS_FOLDER)
     
-    json_path = os.path.join(ANALYTICS_FOLDER, "season_overview.json")
-    
-    with open(json_path, 'w') as f:
+    with open(season_file_path(), 'w') as f:
         json.dump(season_summary, f, indent=2)
 
+def save_season_summary(season_summary):
+    write_season_file(season_summary)
     save_season_data(season_summary)
- 
- 
+
+def calculate_season_stats(engine=None, save=True, force=False):
+    engine = engine or SEASON_ENGINE
+    print(f"Recalculating season stats ({engine} engine)")
+
+    digest = season_input_digest()
+    if save and not force and season_unchanged(digest):
+        print("Season input unchanged, skipping season stats")
+        return None
+
+    if engine in ('pushdown', 'mongo', 'tensor'):
+        frames = season_frames_tensor() if engine == 'tensor' else season_frames_pushdown()
+        if frames is None:
+            print("No raw data found in database.")
+            return
+    else:
+        #get the info of all players in each gameweek (Players table in MongoDB)
+        df = raw_to_frame(fetch_all_raw_data())
+
+        if df.empty:
+            print("No raw data found in database.")
+            return
+
+        frames = season_frames_pandas(df)
+
+    #most MVPs
+    analytics_data = fetch_mvp_data()      #mvp of each gameweek (Gameweeks table)
+    season_summary = build_season_summary(*frames, most_mvps(analytics_data))
+    season_summary["input_digest"] = digest
+
+    if save:
+        save_season_summary(season_summary)
+    return season_summary
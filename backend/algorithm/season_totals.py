@@ -0,0 +1,237 @@
+# running season totals, each new gameweek is folded in without recomputing the season
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.instrumentation import count
+from data_layer.storage import (fetch_all_raw_data, fetch_gameweek_data, fetch_gameweek_summary, fetch_mvp_data,
+                                fetch_season_totals, save_season_totals)
+from algorithm.season_evaluator import (PLAYER_KEYS, PLAYER_SUM_COLUMNS, build_season_summary, calculate_season_stats,
+                                        current_season_id, grouped_frame, most_mvps, save_season_summary,
+                                        season_input_digest)
+
+#length of the recent form window used by the season summary
+RECENT_WINDOW = 3
+
+#stored as integer hundredths so the sums are exact whatever the folding order
+DECIMAL_COLUMNS = ['expected_goals']
+
+
+def totals_id(season_id=None):
+    return "totals_" + (season_id or current_season_id())
+
+def empty_totals(season_id=None):
+    return {
+        "_id": totals_id(season_id),
+        "gameweeks": [],
+        "players": [],
+        "recent": [],
+        "team_goals": [],
+        "team_conceded": [],
+        "mvps": []
+    }
+
+#lists are what gets stored, dicts keyed by the groupby keys are used while folding
+def index_rows(rows, keys):
+    index = {}
+    for row in rows:
+        index[tuple(row[k] for k in keys)] = row
+    return index
+
+def stat_value(stats, column):
+    value = stats.get(column, 0)
+    if column == 'in_dreamteam':
+        return int(bool(value))
+    if column in DECIMAL_COLUMNS:
+        return int(round(float(value) * 100))
+    return float(value)
+
+#adds one gameweek of raw rows to the totals, O(rows in that gameweek)
+def fold_gameweek(totals, gameweek_id, rows, mvp_name=None):
+    if gameweek_id in totals["gameweeks"]:
+        return False
+    count(rows=len(rows))
+
+    players = index_rows(totals["players"], PLAYER_KEYS)
+    team_goals = index_rows(totals["team_goals"], ['team'])
+    gameweek_conceded = {}
+    recent_rows = []
+
+    for doc in rows:
+        stats = doc.get('statistics', {})
+        key = (doc['player_id'], doc['name'], doc['team'], doc['position_id'])
+
+        player = players.get(key)
+        if player is None:
+            player = dict(zip(PLAYER_KEYS, key))
+            for column in PLAYER_SUM_COLUMNS:
+                player[column] = 0
+            player['matches_played'] = 0
+            players[key] = player
+            totals["players"].append(player)
+
+        for column in PLAYER_SUM_COLUMNS:
+            player[column] += stat_value(stats, column)
+        player['matches_played'] += 1
+
+        team = doc['team']
+        goals = stat_value(stats, 'goals_scored')
+        if (team,) not in team_goals:
+            team_goals[(team,)] = {"team": team, "goals_scored": 0.0}
+            totals["team_goals"].append(team_goals[(team,)])
+        team_goals[(team,)]["goals_scored"] += goals
+
+        #a team concedes the max of its players' goals_conceded in the gameweek
+        conceded = stat_value(stats, 'goals_conceded')
+        gameweek_conceded[team] = max(gameweek_conceded.get(team, conceded), conceded)
+
+        recent_rows.append({
+            "gameweek": gameweek_id,
+            "name": doc['name'],
+            "team": team,
+            "goals_scored": goals,
+            "assists": stat_value(stats, 'assists')
+        })
+
+    for team, conceded in gameweek_conceded.items():
+        totals["team_conceded"].append({"team": team, "gameweek": gameweek_id, "goals_conceded": conceded})
+
+    totals["gameweeks"].append(gameweek_id)
+    totals["gameweeks"].sort()
+
+    #only the rows inside the recent window are kept
+    start_gameweek = max(totals["gameweeks"]) - (RECENT_WINDOW - 1)
+    if gameweek_id >= start_gameweek:
+        totals["recent"].extend(recent_rows)
+    kept = []
+    for row in totals["recent"]:
+        if row["gameweek"] >= start_gameweek:
+            kept.append(row)
+    totals["recent"] = kept
+
+    if mvp_name:
+        totals["mvps"].append({"gameweek": gameweek_id, "name": mvp_name})
+
+    return True
+
+#same frames as season_frames_pandas, built from the totals only
+def totals_to_frames(totals):
+    players = []
+    for row in totals["players"]:
+        player = dict(row)
+        for column in DECIMAL_COLUMNS:
+            player[column] = player[column] / 100
+        players.append(player)
+    columns = PLAYER_SUM_COLUMNS + ['matches_played']
+    p_totals = grouped_frame(players, PLAYER_KEYS, columns)
+
+    recent = {}
+    for row in totals["recent"]:
+        key = (row["name"], row["team"])
+        if key not in recent:
+            recent[key] = {"name": row["name"], "team": row["team"], "goals_scored": 0.0, "assists": 0.0,
+                           "matches_played": 0}
+        recent[key]["goals_scored"] += row["goals_scored"]
+        recent[key]["assists"] += row["assists"]
+        recent[key]["matches_played"] += 1
+    recent_stats = grouped_frame(list(recent.values()), ['name', 'team'], ['goals_scored', 'assists', 'matches_played'])
+
+    team_goals = grouped_frame(totals["team_goals"], ['team'], ['goals_scored'])
+
+    conceded = {}
+    for row in totals["team_conceded"]:
+        conceded[row["team"]] = conceded.get(row["team"], 0.0) + row["goals_conceded"]
+    team_conceded = grouped_frame(
+        [{"team": team, "goals_conceded": value} for team, value in conceded.items()], ['team'], ['goals_conceded']
+    )
+
+    return p_totals, recent_stats, team_goals, team_conceded, max(totals["gameweeks"])
+
+def summary_from_totals(totals):
+    mvp_docs = []
+    for row in sorted(totals["mvps"], key=lambda r: r["gameweek"]):
+        mvp_docs.append({"mvp": {"name": row["name"]}})
+    return build_season_summary(*totals_to_frames(totals), most_mvps(mvp_docs))
+
+#full rebuild of the totals from every raw row, used the first time and to verify
+def rebuild_totals(season_id=None):
+    by_gameweek = {}
+    for doc in fetch_all_raw_data():
+        by_gameweek.setdefault(doc['gameweek'], []).append(doc)
+
+    mvps = {}
+    for doc in fetch_mvp_data():
+        if 'gameweek' in doc and 'name' in doc.get('mvp', {}):
+            mvps[doc['gameweek']] = doc['mvp']['name']
+
+    totals = empty_totals(season_id)
+    for gameweek_id in sorted(by_gameweek):
+        fold_gameweek(totals, gameweek_id, by_gameweek[gameweek_id], mvps.get(gameweek_id))
+    return totals
+
+def update_season_incremental(gameweek_ids, save=True):
+    print(f"Updating season totals with gameweeks {list(gameweek_ids)}")
+
+    totals = fetch_season_totals(totals_id())
+    rebuild = totals is None
+
+    if not rebuild:
+        for gameweek_id in gameweek_ids:
+            #a gameweek ingested again cannot be folded twice, start from scratch
+            if gameweek_id in totals["gameweeks"]:
+                rebuild = True
+                break
+
+    if rebuild:
+        print("Rebuilding season totals from raw data")
+        totals = rebuild_totals()
+    else:
+        for gameweek_id in sorted(gameweek_ids):
+            summary = fetch_gameweek_summary(gameweek_id) or {}
+            mvp_name = summary.get('mvp', {}).get('name')
+            fold_gameweek(totals, gameweek_id, fetch_gameweek_data(gameweek_id), mvp_name)
+
+    if not totals["gameweeks"]:
+        print("No raw data found in database.")
+        return None
+
+    season_summary = summary_from_totals(totals)
+    season_summary["input_digest"] = season_input_digest()
+    if save:
+        save_season_totals(totals)
+        save_season_summary(season_summary)
+    return season_summary
+
+#mvp names are listed in the order they were found, which differs between both paths
+def comparable(summary):
+    summary = dict(summary)
+    summary.pop("input_digest", None)
+    leaders = dict(summary["leaders"])
+    leaders["most_mvps"] = dict(leaders["most_mvps"], names=sorted(leaders["most_mvps"]["names"]))
+    summary["leaders"] = leaders
+    return summary
+
+#checks the stored incremental totals against a full recalculation
+def verify_incremental():
+    totals = fetch_season_totals(totals_id())
+    if totals is None or not totals["gameweeks"]:
+        print("No season totals stored yet.")
+        return False
+
+    incremental = comparable(summary_from_totals(totals))
+    full = comparable(calculate_season_stats(save=False))
+    matches = incremental == full
+    print("Incremental season totals match the full recalculation" if matches
+          else "Incremental season totals differ from the full recalculation")
+    return matches
+
+if __name__ == "__main__":
+    if "--verify" in sys.argv:
+        verify_incremental()
+    else:
+        totals = rebuild_totals()
+        save_season_totals(totals)
+        season_summary = summary_from_totals(totals)
+        season_summary["input_digest"] = season_input_digest()
+        save_season_summary(season_summary)
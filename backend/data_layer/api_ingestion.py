@@ -1,48 +1,170 @@
 import requests
 import json
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-FPL_BASE = "https://fantasy.premierleague.com/api"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.instrumentation import count
+
+FPL_BASE = os.getenv("FPL_BASE", "https://fantasy.premierleague.com/api")
+
+#concurrent downloads settings
+MAX_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+MAX_RETRIES = int(os.getenv("INGEST_RETRIES", "5"))
+BACKOFF_FACTOR = float(os.getenv("INGEST_BACKOFF", "0.5"))
+REQUEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "30"))
+RETRY_STATUS = (429, 500, 502, 503, 504)
 
 #current file and directory
 file_path = os.path.abspath(__file__)
 current_dir = os.path.dirname(file_path)
 OUT_PATH = os.path.join(current_dir, "raw")
 
-def get_bootstrap():
-    url = f"{FPL_BASE}/bootstrap-static/"
+_session = None
+
+#one pooled session with retries so every gameweek reuses the same connections
+def make_session(pool_size=MAX_WORKERS, retries=MAX_RETRIES, backoff=BACKOFF_FACTOR):
+    retry = Retry(
+        total=retries,
+        connect=min(retries, 2),
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = make_session()
+    return _session
+
+def get_bootstrap(session=None, base_url=None):
+    session = session or get_session()
+    url = f"{base_url or FPL_BASE}/bootstrap-static/"
     try:
-        res = requests.get(url)
+        res = session.get(url, timeout=REQUEST_TIMEOUT)
         res.raise_for_status()
+        count(bytes=len(res.content))
         return res.json()
     except Exception as e:
         print(f"Error: Failed to get bootstrap. {e}")
         return None
 
-def last_gameweek(event_id):
-    url = f"{FPL_BASE}/event/{event_id}/live/"
+#conditional bootstrap request with the validators of the last response
+#returns (status, data, validators), data is None when the server answers 304 Not Modified
+def get_bootstrap_if_changed(validators=None, session=None, base_url=None):
+    session = session or get_session()
+    url = f"{base_url or FPL_BASE}/bootstrap-static/"
+
+    headers = {}
+    validators = validators or {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    res = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if res.status_code == 304:
+        return 304, None, validators
+    res.raise_for_status()
+
+    new_validators = {"etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified")}
+    return res.status_code, res.json(), new_validators
+
+def last_gameweek(event_id, session=None, base_url=None):
+    session = session or get_session()
+    url = f"{base_url or FPL_BASE}/event/{event_id}/live/"
     try:
-        res = requests.get(url)
+        res = session.get(url, timeout=REQUEST_TIMEOUT)
         res.raise_for_status()   #found thanks to testing
+        count(bytes=len(res.content))
         return res.json()
     except Exception as e:
         print(f"Error getting stats for Gameweek {event_id}: {e}")
         return None
 
-def data_extraction():
-    print("Getting Bootstrap...")
-    
-    #make sure that output path exists
-    if not os.path.exists(OUT_PATH):
-        os.makedirs(OUT_PATH)
+#player and team lookups, built once per run instead of once per gameweek
+def build_maps(basic_data):
+    player_map = {}
+    for p in basic_data['elements']:
+        player_map[p['id']] = p
 
-    basic_data = get_bootstrap()
-    if not basic_data: return []
+    team_map = {}
+    for t in basic_data['teams']:
+        team_map[t['id']] = t['name']
+
+    return player_map, team_map
+
+def build_gameweek_rows(gameweek_id, live_data, player_map, team_map):
+    final_output = []
+
+    for live_player in live_data['elements']:
+        stats = live_player['stats']
+
+        if stats['minutes'] == 0:
+            continue
+
+        player_id = live_player['id']
+        player_info = player_map.get(player_id)
+
+        if not player_info:
+            continue
+
+        row = {
+            "player_id": live_player['id'],
+            "name": f"{player_info['first_name']} {player_info['second_name']}",
+            "team": team_map.get(player_info['team'], "Unknown"),
+            "position_code": player_info['element_type'],
+            "gameweek_index": gameweek_id,
+            "statistics": stats
+        }
+        final_output.append(row)
+
+    return final_output
 
-    events_list = basic_data['events']
+def gameweek_file_path(gameweek_id, out_path=None):
+    json_filename = "gameweek_" + str(gameweek_id) + ".json"
+    return os.path.join(out_path or OUT_PATH, json_filename)
+
+#download one gameweek and write its file, returns the path or None
+def download_gameweek(gw, player_map, team_map, session=None, base_url=None, out_path=None):
+    gameweek_id = gw['id']
+    file_path = gameweek_file_path(gameweek_id, out_path)
+
+    print(f"Downloading new data: {gw['name']} (ID: {gameweek_id})")
+
+    last_gw_played = last_gameweek(gameweek_id, session=session, base_url=base_url)
+    if not last_gw_played:
+        return None
+
+    final_output = build_gameweek_rows(gameweek_id, last_gw_played, player_map, team_map)
+    count(rows=len(final_output))
+
+    #write to a temp file first so a half written gameweek is never picked up
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(final_output, f, indent=2)
+    os.replace(tmp_path, file_path)
+
+    print(f"JSON created and saved in: {file_path}")
+    return file_path
+
+def pending_gameweeks(basic_data, out_path=None):
     completed_gameweeks = []
 
-    for event in events_list:
+    for event in basic_data['events']:
         is_finished = event['finished']
         is_verified = event['data_checked']
 
@@ -53,59 +175,50 @@ def data_extraction():
         print("There are not gameweek finished")
         return []
 
-    new_files_created = [] 
-
+    missing = []
     for gw in completed_gameweeks:
-        gameweek_id = gw['id']
-        json_filename = "gameweek_" + str(gameweek_id) + ".json"
-        file_path = os.path.join(OUT_PATH, json_filename)
+        if not os.path.exists(gameweek_file_path(gw['id'], out_path)):
+            missing.append(gw)
+    return missing
 
-        if os.path.exists(file_path):
-            continue
+def data_extraction(max_workers=None, session=None, base_url=None, out_path=None, basic_data=None):
+    out_path = out_path or OUT_PATH
+    session = session or get_session()
+    max_workers = max_workers or MAX_WORKERS
 
-        print(f"Downloading new data: {gw['name']} (ID: {gameweek_id})")
+    #make sure that output path exists
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
 
-        last_gw_played = last_gameweek(gameweek_id)
-        if not last_gw_played: continue
+    if basic_data is None:
+        print("Getting Bootstrap...")
+        basic_data = get_bootstrap(session=session, base_url=base_url)
+    if not basic_data: return []
 
-        #mapping
-        player_map = {}
-        for p in basic_data['elements']:
-            player_map[p['id']] = p
+    missing = pending_gameweeks(basic_data, out_path)
+    if not missing:
+        return []
 
-        team_map = {}
-        for t in basic_data['teams']:
-            team_map[t['id']] = t['name']
+    player_map, team_map = build_maps(basic_data)
 
-        final_output = []
+    new_files_created = []
 
-        for live_player in last_gw_played['elements']: 
-            stats = live_player['stats']
+    #bounded pool, the session's connection pool is shared between workers
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for gw in missing:
+            future = pool.submit(download_gameweek, gw, player_map, team_map, session, base_url, out_path)
+            futures[future] = gw['id']
 
-            if stats['minutes'] == 0: 
+        for future in as_completed(futures):
+            try:
+                path = future.result()
+            except Exception as e:
+                print(f"Error saving Gameweek {futures[future]}: {e}")
                 continue
-            
-            player_id = live_player['id']
-            player_info = player_map.get(player_id)
+            if path:
+                new_files_created.append(path)
 
-            if not player_info: 
-                continue
-            
-            row = {
-                "player_id": live_player['id'],
-                "name": f"{player_info['first_name']} {player_info['second_name']}",
-                "team": team_map.get(player_info['team'], "Unknown"),
-                "position_code": player_info['element_type'],
-                "gameweek_index": gameweek_id,
-                "statistics": stats
-            }
-            final_output.append(row)
-
-        #save the new gameweek file
-        with open(file_path, 'w') as f:
-            json.dump(final_output, f, indent=2)
-            
-        print(f"JSON created and saved in: {file_path}")
-        new_files_created.append(file_path) 
-
-    return new_files_created
\ No newline at end of file
+    #keep the gameweek order the rest of the pipeline expects
+    new_files_created.sort(key=lambda p: int(os.path.basename(p).split('_')[1].replace('.json', '')))
+    return new_files_created
@@ -1,10 +1,22 @@
 #file that communicates with MongoDB
 
+import atexit
+import bisect
+import hashlib
 import json
 import os
-from pymongo import MongoClient
+import re
+import sys
+import threading
+import unicodedata
+import uuid
+from datetime import datetime, timezone
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.instrumentation import COMMAND_LISTENER, count
 
 load_dotenv()
 
@@ -13,6 +25,96 @@ DB_NAME = os.getenv("DB_NAME")
 COLLECTION = os.getenv("COLLECTION")
 ANALYTICS_COLL = os.getenv("ANALYTICS_COLL")
 SEASON_COLL = os.getenv("SEASON_COLL")
+TOTALS_COLL = os.getenv("TOTALS_COLL", "season_totals")
+META_COLL = os.getenv("META_COLL", "meta")
+#one document per player, kept up to date by the uploads (see fold_player)
+PLAYERS_COLL = os.getenv("PLAYERS_COLL", "players")
+
+#document bumped by the backend each time it publishes new data, the frontend caches follow it
+DATA_VERSION_ID = "data_version"
+#uploads whose raw rows may be replaced but are not folded into the players yet, see upload_many
+PLAYERS_STALE_ID = "players_stale"
+
+#operations sent per bulk_write call
+BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "1000"))
+#documents fetched per round trip by the streamed reads
+STREAM_BATCH = int(os.getenv("STREAM_BATCH_SIZE", "200"))
+
+#shared client settings
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+SERVER_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_TIMEOUT_MS", "10000"))
+CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000"))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+#one client per process, created on first use and reused by every call
+def get_client():
+    global _client, _client_pid
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            #a client inherited through fork must not be used in the child
+            _client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=SERVER_TIMEOUT_MS,
+                connectTimeoutMS=CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=SOCKET_TIMEOUT_MS,
+                #counts the round trips of the pipeline stages, see instrumentation.py
+                event_listeners=[COMMAND_LISTENER],
+                connect=False
+            )
+            _client_pid = pid
+    return _client
+
+def get_db():
+    return get_client()[DB_NAME]
+
+#round trip to the server, raises when it cannot be reached
+def ping():
+    get_client().admin.command("ping")
+    return True
+
+def close_client():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+#forked children (process pools) start without the parent's client
+def _reset_after_fork():
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+atexit.register(close_client)
+
+#reads print their errors and return an empty result, the errors of the current thread are also counted
+#so a caller can tell an empty answer from a failed read (the response cache does not keep those pages)
+_read_errors = threading.local()
+
+def read_error(message):
+    print(message)
+    _read_errors.count = read_error_count() + 1
+
+def read_error_count():
+    return getattr(_read_errors, "count", 0)
 
 
 #convert some string fields into float
@@ -40,74 +142,166 @@ def clean_metrics(stats):
     
     return cleaned
 
-def upload_to_mongo(json_file_path):
-    print(f"\nUploading to Mongo: {json_file_path}")
+#lowercase and without accents, used for the name search index
+def normalise_name(name):
+    if not name:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", name)
+    letters = []
+    for char in decomposed:
+        if not unicodedata.combining(char):
+            letters.append(char)
+    return " ".join("".join(letters).lower().split())
+
+#words of the normalised name, a search matches the beginning of any of them
+def name_tokens(name):
+    return sorted(set(normalise_name(name).split()))
+
+#digest of a set of documents, independent of the order they were fetched in
+def content_digest(docs):
+    ordered = sorted(docs, key=lambda doc: str(doc.get("_id")))
+    payload = json.dumps(ordered, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+#raw json row to the document stored in mongo
+def build_player_doc(player):
+    gw_index = str(player['gameweek_index'])
+    player_id = str(player['player_id'])
+    unique_id = "gw" + gw_index + "_p" + player_id
+
+    statistics = player.get('statistics')
+    clean_stats = clean_metrics(statistics)
+
+    return {
+        "_id": unique_id,
+        "player_id": player['player_id'],
+        "name": player['name'],
+        "name_search": normalise_name(player['name']),
+        "name_tokens": name_tokens(player['name']),
+        "team": player['team'],
+        "position_id": player['position_code'],
+        "gameweek": player['gameweek_index'],
+        "statistics": clean_stats,
+    }
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+#groups the upserts in unordered bulk_write calls, one round trip per batch
+def bulk_replace(col, docs, batch_size=None):
+    batch_size = batch_size or BATCH_SIZE
+    counts = {"inserted": 0, "modified": 0, "upserted": 0, "matched": 0, "round_trips": 0}
+
+    for batch in chunked(docs, batch_size):
+        operations = []
+        for doc in batch:
+            operations.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+
+        result = col.bulk_write(operations, ordered=False)
+        counts["inserted"] += result.inserted_count
+        counts["modified"] += result.modified_count
+        counts["upserted"] += result.upserted_count
+        counts["matched"] += result.matched_count
+        counts["round_trips"] += 1
+
+    return counts
+
+STAGING_SUFFIX = "_staging"
+
+#full rebuild: every collection is loaded into a fresh staging copy with its indexes, then renamed over the live one
+#a rename is atomic on the server, readers see the old collection or the complete new one, never a partial load
+#contents is {collection: docs}, the collections are swapped in that order once all of them are loaded
+#mongo has no rename of several collections at once: between the first and the last rename, back to back
+#round trips after every copy is loaded and indexed, a reader can see new raw rows with the old analytics
+#the data version is published after the swap, so a page cached in that window is not served for the new version
+def replace_collections(contents, indexes=None, batch_size=None):
+    db = get_db()
+    counts = {}
+
+    for name, docs in contents.items():
+        staging = db[name + STAGING_SUFFIX]
+        staging.drop()
+        db.create_collection(name + STAGING_SUFFIX)
+        for batch in chunked(docs, batch_size or BATCH_SIZE):
+            staging.insert_many(batch, ordered=False)
+        for keys, options in (indexes or {}).get(name, []):
+            staging.create_index(keys, **options)
+        count(rows=len(docs))
+        counts[name] = len(docs)
+
+    for name in contents:
+        db[name + STAGING_SUFFIX].rename(name, dropTarget=True)
+
+    return counts
+
+def load_player_docs(json_file_path):
+    with open(json_file_path, 'r') as file:
+        data = json.load(file)
+
+    docs = []
+    for player in data:
+        docs.append(build_player_doc(player))
+    return docs
+
+def upload_to_mongo(json_file_path, batch_size=None):
+    return upload_many([json_file_path], batch_size)
+
+#uploads several gameweek files sharing the same batches
+def upload_many(json_file_paths, batch_size=None):
+    for path in json_file_paths:
+        print(f"\nUploading to Mongo: {path}")
 
     #connection
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
+        db = get_db()
         col = db[COLLECTION]
     except Exception as e:
         print(f"Database connection error: {e}")
-        return
+        return None
 
     try:
-        with open(json_file_path, 'r') as file:
-            data = json.load(file)
+        docs = []
+        for path in json_file_paths:
+            try:
+                docs.extend(load_player_docs(path))
+            except FileNotFoundError:
+                print(f"File {path} not found")
+
+        #read before the replace, the players documents move by the difference
+        previous, round_trips = fetch_previous_rows(col, docs, batch_size)
+        #the raw rows and the players are two writes: the upload stays listed until its fold is done, a
+        #re-upload of the same rows folds nothing, so backfill_players regroups the players of a failed one
+        upload_id = uuid.uuid4().hex
+        db[META_COLL].update_one({"_id": PLAYERS_STALE_ID}, {"$addToSet": {"uploads": upload_id}}, upsert=True)
+        counts = bulk_replace(col, docs, batch_size)
+        count(rows=len(docs))
+        directory = fold_players(docs, previous, batch_size, db)
+        db[META_COLL].update_one({"_id": PLAYERS_STALE_ID}, {"$pull": {"uploads": upload_id}})
+        counts["round_trips"] += round_trips + directory["round_trips"] + 2
+        print("Processed/Inserted " + str(len(docs)) + " players "
+              f"(inserted {counts['inserted']}, modified {counts['modified']}, "
+              f"upserted {counts['upserted']}, {counts['round_trips']} round trips)")
+        return counts
 
-        count = 0
-        
-        #each player id for specific gameweek
-        for player in data:
-            gw_index = str(player['gameweek_index'])
-            player_id = str(player['player_id'])
-            unique_id = "gw" + gw_index + "_p" + player_id
-            
-            statistics = player.get('statistics')
-            clean_stats = clean_metrics(statistics)
-
-            #prepare to upload in mongo
-            doc = {
-                "_id": unique_id,
-                "player_id": player['player_id'],
-                "name": player['name'],
-                "team": player['team'],
-                "position_id": player['position_code'],
-                "gameweek": player['gameweek_index'],
-                "statistics": clean_stats,
-            }
-
-            col.replace_one({"_id": unique_id}, doc, upsert=True)
-            count += 1
-
-        print("Processed/Inserted " + str(count) + " players")
-           
-    except FileNotFoundError:
-        print(f"File {json_file_path} not found")
     except Exception as e:
         print(e)
-    finally:
-        client.close()
+        return None
 
 
 def fetch_all_raw_data():
-    client = MongoClient(MONGO_URI)
     try:
-        db = client[DB_NAME]
+        db = get_db()
         collection = db[COLLECTION]
         return list(collection.find({}))
     
     except Exception as e:
-        print(f"Error fetching raw data: {e}")
+        read_error(f"Error fetching raw data: {e}")
         return []
-    finally:
-        client.close()
 
 def save_season_data(season_summary):
-    client = MongoClient(MONGO_URI)
     try:
-        db = client[DB_NAME]
+        db = get_db()
         season_collection = db[SEASON_COLL] 
         
         season_collection.replace_one(
@@ -118,16 +312,13 @@ def save_season_data(season_summary):
         print(f"Season stats for {season_summary['_id']} saved successfully to MongoDB")
     except Exception as e:
         print(f"Error saving analytics: {e}")
-    finally:
-        client.close()
 
 
 def fetch_mvp_data():
-    client = MongoClient(MONGO_URI)
     try:
-        db = client[DB_NAME]
+        db = get_db()
         analytics_collection = db[ANALYTICS_COLL]
-        cursor = analytics_collection.find({}, {"mvp": 1})
+        cursor = analytics_collection.find({}, {"mvp": 1, "gameweek": 1})
 
         mvp_results = []
         for doc in cursor:
@@ -135,17 +326,360 @@ def fetch_mvp_data():
         return mvp_results
     
     except Exception as e:
-        print(f"Error fetching analytics MVPs: {e}")
+        read_error(f"Error fetching analytics MVPs: {e}")
         return []
     
-    finally:
-        client.close()
+
+#summary of one gameweek from the analytics collection
+def fetch_gameweek_summary(gameweek_id):
+    try:
+        db = get_db()
+        return db[ANALYTICS_COLL].find_one({"gameweek": gameweek_id})
+    except Exception as e:
+        read_error(f"Error fetching gameweek {gameweek_id} summary: {e}")
+        return None
+
+#input digests stored with the gameweek summaries, {gameweek: digest}
+def fetch_summary_digests(gameweek_ids=None):
+    try:
+        db = get_db()
+        query = {}
+        if gameweek_ids is not None:
+            query = {"gameweek": {"$in": list(gameweek_ids)}}
+        digests = {}
+        for doc in db[ANALYTICS_COLL].find(query, {"gameweek": 1, "input_digest": 1}):
+            if "gameweek" in doc:
+                digests[doc["gameweek"]] = doc.get("input_digest")
+        return digests
+    except Exception as e:
+        read_error(f"Error fetching summary digests: {e}")
+        return {}
+
+def fetch_season_digest(season_id):
+    try:
+        db = get_db()
+        doc = db[SEASON_COLL].find_one({"_id": season_id}, {"input_digest": 1})
+        return doc.get("input_digest") if doc else None
+    except Exception as e:
+        read_error(f"Error fetching season digest: {e}")
+        return None
+
+#running season totals kept by the incremental season stats
+def fetch_season_totals(totals_id):
+    try:
+        db = get_db()
+        return db[TOTALS_COLL].find_one({"_id": totals_id})
+    except Exception as e:
+        read_error(f"Error fetching season totals: {e}")
+        return None
+
+def save_season_totals(totals):
+    try:
+        db = get_db()
+        db[TOTALS_COLL].replace_one({"_id": totals["_id"]}, totals, upsert=True)
+    except Exception as e:
+        print(f"Error saving season totals: {e}")
+
+#version counter of the published data, with the last gameweek and the time it was published
+def publish_data_version(last_updated_gw=None):
+    try:
+        db = get_db()
+        return db[META_COLL].find_one_and_update(
+            {"_id": DATA_VERSION_ID},
+            {"$inc": {"version": 1},
+             "$set": {"last_updated_gw": last_updated_gw, "published_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        print(f"Error publishing data version: {e}")
+        return None
+
+def fetch_data_version():
+    try:
+        db = get_db()
+        return db[META_COLL].find_one({"_id": DATA_VERSION_ID})
+    except Exception as e:
+        read_error(f"Error fetching data version: {e}")
+        return None
+
+#season aggregations pushed down to mongo, only the grouped rows come back
+SEASON_SUM_FIELDS = [
+    'goals_scored', 'assists', 'minutes', 'goals_conceded', 'clean_sheets',
+    'penalties_saved', 'yellow_cards', 'red_cards', 'expected_goals', 'total_points'
+]
+
+#decimal stats (two decimals from the api), summed as integer hundredths in the players totals so a fold
+#gives the same total whatever the upload order, returned as the values of each row to the season engine
+DECIMAL_FIELDS = ['expected_goals']
+
+#per-gameweek arrays of the players documents, parallel to series.gameweek, for the player page
+SERIES_FIELDS = ['total_points', 'minutes', 'goals_scored', 'assists', 'expected_goals', 'expected_assists', 'bps']
+
+#$sum skips missing values, the caller casts the totals to float
+def stat_sum(field):
+    if field in DECIMAL_FIELDS:
+        return {"$sum": {"$round": [{"$multiply": [{"$ifNull": ["$statistics." + field, 0]}, 100]}, 0]}}
+    return {"$sum": "$statistics." + field}
+
+#the value of every row, in the order of the collection scan (the order fetch_all_raw_data reads them in),
+#the season engine adds them like the pandas engine
+def stat_values(field):
+    return {"$push": {"$ifNull": ["$statistics." + field, 0]}}
+
+def stat_total(field):
+    if field in DECIMAL_FIELDS:
+        return {"$divide": ["$" + field, 100]}
+    return 1
+
+def run_aggregation(coll_name, pipeline):
+    try:
+        db = get_db()
+        return list(db[coll_name].aggregate(pipeline, allowDiskUse=True))
+    except Exception as e:
+        read_error(f"Error running aggregation on {coll_name}: {e}")
+        return []
+
+#same grouping as the pandas season totals (player_id, name, team, position_id)
+def aggregate_player_totals():
+    group = {
+        "_id": {"player_id": "$player_id", "name": "$name", "team": "$team", "position_id": "$position_id"},
+        "in_dreamteam": {"$sum": {"$cond": [{"$ifNull": ["$statistics.in_dreamteam", False]}, 1, 0]}},
+        "matches_played": {"$sum": 1}
+    }
+    for field in SEASON_SUM_FIELDS:
+        group[field] = stat_values(field) if field in DECIMAL_FIELDS else stat_sum(field)
+
+    project = {"_id": 0, "in_dreamteam": 1, "matches_played": 1}
+    for key in ("player_id", "name", "team", "position_id"):
+        project[key] = "$_id." + key
+    for field in SEASON_SUM_FIELDS:
+        project[field] = 1
+
+    pipeline = [{"$group": group}, {"$project": project}]
+    return run_aggregation(COLLECTION, pipeline)
+
+def aggregate_max_gameweek():
+    rows = run_aggregation(COLLECTION, [
+        {"$group": {"_id": None, "gameweek": {"$max": "$gameweek"}}}
+    ])
+    if not rows:
+        return None
+    return rows[0]["gameweek"]
+
+#goals and assists from start_gameweek onwards
+def aggregate_recent_stats(start_gameweek):
+    pipeline = [
+        {"$match": {"gameweek": {"$gte": start_gameweek}}},
+        {"$group": {
+            "_id": {"name": "$name", "team": "$team"},
+            "goals_scored": stat_sum("goals_scored"),
+            "assists": stat_sum("assists"),
+            "matches_played": {"$sum": 1}
+        }},
+        {"$project": {"_id": 0, "name": "$_id.name", "team": "$_id.team",
+                      "goals_scored": 1, "assists": 1, "matches_played": 1}}
+    ]
+    return run_aggregation(COLLECTION, pipeline)
+
+def aggregate_team_goals():
+    pipeline = [
+        {"$group": {"_id": "$team", "goals_scored": stat_sum("goals_scored")}},
+        {"$project": {"_id": 0, "team": "$_id", "goals_scored": 1}}
+    ]
+    return run_aggregation(COLLECTION, pipeline)
+
+#a team concedes the max of its players' goals_conceded in each gameweek
+def aggregate_team_conceded():
+    pipeline = [
+        {"$group": {
+            "_id": {"team": "$team", "gameweek": "$gameweek"},
+            "goals_conceded": {"$max": "$statistics.goals_conceded"}
+        }},
+        {"$group": {"_id": "$_id.team", "goals_conceded": {"$sum": "$goals_conceded"}}},
+        {"$project": {"_id": 0, "team": "$_id", "goals_conceded": 1}}
+    ]
+    return run_aggregation(COLLECTION, pipeline)
+
+#players directory: name, team and position of the latest gameweek, appearances, season totals
+#and the gameweek series of the player page
+#an upload folds its rows into the documents of their players (fold_player / player_fold_update), the full
+#regroups (build_players_directory, player_directory_pipeline) are only used by the rebuild and the backfill
+
+def new_player(player_id):
+    return {"_id": player_id, "player_id": player_id, "appearances": 0, "latest_gameweek": 0,
+            "totals": {field: 0 for field in SEASON_SUM_FIELDS},
+            "series": {field: [] for field in ["gameweek"] + SERIES_FIELDS}}
+
+#contribution of a raw row to the totals, decimal fields in integer hundredths
+def row_totals(doc):
+    statistics = (doc or {}).get("statistics") or {}
+    totals = {}
+    for field in SEASON_SUM_FIELDS:
+        value = statistics.get(field) or 0
+        totals[field] = round(value * 100) if field in DECIMAL_FIELDS else value
+    return totals
+
+def series_values(doc):
+    statistics = doc.get("statistics") or {}
+    return {"gameweek": doc["gameweek"], **{field: statistics.get(field) or 0 for field in SERIES_FIELDS}}
+
+#folds one raw row into the document of its player, previous is the raw row it replaces (None for a new one)
+#the totals move by the difference of the two rows, the series slot of the gameweek is replaced or inserted
+#in gameweek order, and the latest gameweek sets the name, team and position
+def fold_player(player, doc, previous=None):
+    player = player or new_player(doc["player_id"])
+    if previous is None:
+        player["appearances"] += 1
+    new, old = row_totals(doc), row_totals(previous)
+    for field in SEASON_SUM_FIELDS:
+        if field in DECIMAL_FIELDS:
+            player["totals"][field] = (round(player["totals"][field] * 100) + new[field] - old[field]) / 100
+        else:
+            player["totals"][field] += new[field] - old[field]
+
+    if doc["gameweek"] >= player["latest_gameweek"]:
+        player["name"] = doc["name"]
+        player["name_search"] = doc.get("name_search", normalise_name(doc["name"]))
+        player["team"] = doc["team"]
+        player["position_id"] = doc["position_id"]
+        player["latest_gameweek"] = doc["gameweek"]
+
+    series = player["series"]
+    values = series_values(doc)
+    if doc["gameweek"] in series["gameweek"]:
+        slot = series["gameweek"].index(doc["gameweek"])
+        for field, value in values.items():
+            series[field][slot] = value
+    else:
+        slot = bisect.bisect_left(series["gameweek"], doc["gameweek"])
+        for field, value in values.items():
+            series[field].insert(slot, value)
+    return player
+
+#every player from all of their raw rows, for the full rebuild
+def build_players_directory(raw_docs):
+    players = {}
+    for doc in sorted(raw_docs, key=lambda d: d["gameweek"]):
+        players[doc["player_id"]] = fold_player(players.get(doc["player_id"]), doc)
+    return list(players.values())
+
+#fold_player as an update pipeline, applied atomically by the server to the one document of the player
+#the totals and series only move by this row, so two uploads touching the same player do not overwrite each other
+def player_fold_update(doc, previous=None):
+    new, old = row_totals(doc), row_totals(previous)
+    gameweek = doc["gameweek"]
+    latest = {"$gte": [gameweek, {"$ifNull": ["$latest_gameweek", 0]}]}
+
+    fold = {
+        "player_id": doc["player_id"],
+        "appearances": {"$add": [{"$ifNull": ["$appearances", 0]}, 0 if previous is not None else 1]},
+        "latest_gameweek": {"$max": [gameweek, {"$ifNull": ["$latest_gameweek", 0]}]},
+    }
+    for field in ("name", "name_search", "team", "position_id"):
+        value = doc.get(field) if field != "name_search" else doc.get(field, normalise_name(doc["name"]))
+        fold[field] = {"$cond": [latest, {"$literal": value}, "$" + field]}
+    for field in SEASON_SUM_FIELDS:
+        current = {"$ifNull": ["$totals." + field, 0]}
+        if field in DECIMAL_FIELDS:
+            hundredths = {"$round": [{"$multiply": [current, 100]}, 0]}
+            fold["totals." + field] = {"$divide": [{"$add": [hundredths, new[field] - old[field]]}, 100]}
+        else:
+            fold["totals." + field] = {"$add": [current, new[field] - old[field]]}
+
+    #the series is kept in gameweek order: the gameweek takes its slot, replacing the entry of a re-upload,
+    #and the other entries are picked from their old slot, the number of gameweeks before them
+    gameweeks = {"$ifNull": ["$series.gameweek", []]}
+    merged = {"$concatArrays": [{"$filter": {"input": gameweeks, "cond": {"$lt": ["$$this", gameweek]}}},
+                                [gameweek],
+                                {"$filter": {"input": gameweeks, "cond": {"$gt": ["$$this", gameweek]}}}]}
+    before = {"$size": {"$filter": {"input": gameweeks, "as": "w", "cond": {"$lt": ["$$w", "$$g"]}}}}
+    for field, value in series_values(doc).items():
+        if field == "gameweek":
+            continue
+        current = {"$ifNull": ["$series." + field, []]}
+        fold["series." + field] = {"$map": {"input": merged, "as": "g", "in": {"$cond": [
+            {"$eq": ["$$g", gameweek]}, {"$literal": value}, {"$arrayElemAt": [current, before]}]}}}
+    #the gameweeks are moved last, the stage above picks the entries from the old ones
+    return [{"$set": fold}, {"$set": {"series.gameweek": merged}}]
+
+#folds the uploaded rows into the players collection, previous is {_id: raw row replaced by the upload}
+#rows identical to the one they replace are skipped, a re-upload of the same file writes nothing
+def fold_players(docs, previous, batch_size=None, db=None):
+    db = db if db is not None else get_db()
+    changed = [doc for doc in docs if previous.get(doc["_id"]) != doc]
+    round_trips = 0
+    for batch in chunked(changed, batch_size or BATCH_SIZE):
+        operations = [UpdateOne({"_id": doc["player_id"]}, player_fold_update(doc, previous.get(doc["_id"])),
+                                upsert=True) for doc in batch]
+        db[PLAYERS_COLL].bulk_write(operations, ordered=False)
+        round_trips += 1
+    return {"players": len({doc["player_id"] for doc in changed}), "round_trips": round_trips}
+
+#stored raw rows with the ids of the uploaded ones, the contribution an upload takes out of the players
+def fetch_previous_rows(col, docs, batch_size=None):
+    previous = {}
+    round_trips = 0
+    for batch in chunked([doc["_id"] for doc in docs], batch_size or BATCH_SIZE):
+        for doc in col.find({"_id": {"$in": batch}}):
+            previous[doc["_id"]] = doc
+        round_trips += 1
+    return previous, round_trips
+
+#regroups all the raw rows and merges the result into the players collection, for the backfill
+#same documents as build_players_directory
+def player_directory_pipeline():
+    group = {
+        "_id": "$player_id",
+        "name": {"$last": "$name"},
+        "name_search": {"$last": "$name_search"},
+        "team": {"$last": "$team"},
+        "position_id": {"$last": "$position_id"},
+        "latest_gameweek": {"$max": "$gameweek"},
+        "appearances": {"$sum": 1}
+    }
+    for field in SEASON_SUM_FIELDS:
+        group[field] = stat_sum(field)
+    #$push keeps the gameweek order of the $sort, a missing stat is a 0 so the arrays stay parallel
+    group["series_gameweek"] = {"$push": "$gameweek"}
+    for field in SERIES_FIELDS:
+        group["series_" + field] = {"$push": {"$ifNull": ["$statistics." + field, 0]}}
+
+    project = {"_id": 1, "player_id": "$_id", "name": 1, "name_search": 1, "team": 1, "position_id": 1,
+               "latest_gameweek": 1, "appearances": 1, "totals": {}, "series": {}}
+    for field in SEASON_SUM_FIELDS:
+        total = stat_total(field)
+        project["totals"][field] = "$" + field if total == 1 else total
+    for field in ["gameweek"] + SERIES_FIELDS:
+        project["series"][field] = "$series_" + field
+
+    return [
+        {"$sort": {"player_id": 1, "gameweek": 1}},
+        {"$group": group},
+        {"$project": project},
+        {"$merge": {"into": PLAYERS_COLL, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+#whole players collection from the raw rows, in the given database (the app's by default), None on failure
+def refresh_players(db=None):
+    db = db if db is not None else get_db()
+    try:
+        db[COLLECTION].aggregate(player_directory_pipeline(), allowDiskUse=True)
+    except Exception as e:
+        print(f"Error rebuilding the players directory: {e}")
+        return None
+    return {"players": None, "round_trips": 1}
+
+#ids of the uploads that did not finish folding their rows into the players
+def stale_uploads(db=None):
+    db = db if db is not None else get_db()
+    doc = db[META_COLL].find_one({"_id": PLAYERS_STALE_ID})
+    return (doc or {}).get("uploads") or []
 
 #data for specific gameweek
 def fetch_gameweek_data(gameweek_id):
-    client = MongoClient(MONGO_URI)
     try:
-        db = client[DB_NAME]
+        db = get_db()
         collection = db[COLLECTION]
         
         cursor = collection.find({"gameweek": gameweek_id})
@@ -156,17 +690,42 @@ def fetch_gameweek_data(gameweek_id):
         return gameweek_data
     
     except Exception as e:
-        print(f"Error fetching gameweek {gameweek_id}: {e}")
+        read_error(f"Error fetching gameweek {gameweek_id}: {e}")
         return []
     
-    finally:
-        client.close()
+
+#data for several gameweeks in a single query
+def fetch_gameweeks_data(gameweek_ids):
+    try:
+        db = get_db()
+        collection = db[COLLECTION]
+        return list(collection.find({"gameweek": {"$in": list(gameweek_ids)}}))
+
+    except Exception as e:
+        read_error(f"Error fetching gameweeks {list(gameweek_ids)}: {e}")
+        return []
+
+def fetch_gameweek_ids():
+    try:
+        db = get_db()
+        return sorted(db[COLLECTION].distinct("gameweek"))
+    except Exception as e:
+        read_error(f"Error fetching gameweek ids: {e}")
+        return []
+
+#all the summaries in one bulk write
+def save_gameweeks_data(summaries):
+    try:
+        db = get_db()
+        return bulk_replace(db[ANALYTICS_COLL], summaries)
+    except Exception as e:
+        print(f"Error saving gameweek analytics: {e}")
+        return None
 
 #save data for specific gameweek
 def save_gameweek_data(summary_data):
-    client = MongoClient(MONGO_URI)
     try:
-        db = client[DB_NAME]
+        db = get_db()
         analytics_db = db[ANALYTICS_COLL]
         
         analytics_db.replace_one(
@@ -178,17 +737,184 @@ def save_gameweek_data(summary_data):
     except Exception as e:
         print(f"Error saving gameweek analytics: {e}")
 
-    finally:
-        client.close()
+
+# ---------- reads used by the frontend ----------
+#case and accent insensitive search: every word of the text starts a word of the name ("sal" and "mo salah"
+#find Mohamed Salah), anchored regexes on the indexed name_tokens are index range scans
+def name_query(text):
+    words = normalise_name(text).split()
+    clauses = [{"name_tokens": {"$regex": "^" + re.escape(word)}} for word in words]
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses} if clauses else {}
+
+def find_one_doc(coll_name, query):
+    try:
+        db = get_db()
+        return db[coll_name].find_one(query, projection={"_id": False})
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return None
+
+#field selection of the read api, "name,statistics.minutes" -> ["name", "statistics.minutes"]
+FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+def parse_fields(text):
+    if not text:
+        return None
+    fields = []
+    for field in text.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        if not FIELD_NAME.match(field):
+            raise ValueError(f"Invalid field: {field}")
+        fields.append(field)
+
+    #a field inside a selected one is already returned (and mongo rejects the overlap)
+    selected = set(fields)
+    kept = []
+    for field in fields:
+        parts = field.split(".")
+        parents = {".".join(parts[:i]) for i in range(1, len(parts))}
+        if field not in kept and not parents & selected:
+            kept.append(field)
+    return kept or None
+
+def projection(fields=None):
+    result = {"_id": False}
+    for field in fields or []:
+        result[field] = True
+    return result
+
+def find_docs(coll_name, query, limit=0, fields=None):
+    try:
+        db = get_db()
+        cursor = db[coll_name].find(query, projection=projection(fields))
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return []
+
+def fetch_season():
+    return find_one_doc(SEASON_COLL, {})
+
+def fetch_gameweek_summaries(limit=0):
+    return find_docs(ANALYTICS_COLL, {}, limit)
+
+def fetch_gameweek_players(gameweek_id, fields=None):
+    return find_docs(COLLECTION, {"gameweek": gameweek_id}, fields=fields)
+
+#records of several players in one query on the (player_id, gameweek) index, optionally within [from_gw, to_gw]
+def fetch_records_of_players(player_ids, from_gw=None, to_gw=None, fields=None):
+    query = {"player_id": {"$in": list(player_ids)}}
+    gameweeks = {}
+    if from_gw is not None:
+        gameweeks["$gte"] = from_gw
+    if to_gw is not None:
+        gameweeks["$lte"] = to_gw
+    if gameweeks:
+        query["gameweek"] = gameweeks
+    try:
+        cursor = get_db()[COLLECTION].find(query, projection=projection(fields))
+        return list(cursor.sort([("player_id", 1), ("gameweek", 1)]))
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return []
+
+#keyset pagination on the gameweek: the page after `after`, sorted on an index, never skipping the previous pages
+def gameweek_query(query, after=None):
+    if after is None:
+        return query
+    return dict(query, gameweek={"$gt": after})
+
+#documents sent as the cursor yields them, a batch at a time, instead of a list of the whole result
+#an error is raised to the reader, a stream cut short must not look like a complete page
+def iter_docs(coll_name, query, limit=0, fields=None):
+    try:
+        cursor = get_db()[coll_name].find(query, projection=projection(fields))
+        cursor = cursor.sort("gameweek", 1).batch_size(STREAM_BATCH)
+        if limit:
+            cursor = cursor.limit(limit)
+        with cursor:
+            for doc in cursor:
+                yield doc
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        raise
+
+#gameweek the next page starts after, None on the last page (only the index is read)
+def next_after(coll_name, query, limit=0):
+    if not limit:
+        return None
+    #raised like iter_docs, a missing link would make the page look like the last one
+    try:
+        keys = list(get_db()[coll_name].find(query, projection={"_id": False, "gameweek": True})
+                    .sort("gameweek", 1).skip(limit - 1).limit(2))
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        raise
+    return keys[0]["gameweek"] if len(keys) == 2 else None
+
+#(documents, next after) of a page of summaries or of a player's records
+def gameweek_summaries_page(after=None, limit=0, fields=None):
+    query = gameweek_query({}, after)
+    return iter_docs(ANALYTICS_COLL, query, limit, fields), next_after(ANALYTICS_COLL, query, limit)
+
+def player_records_page(player_id, after=None, limit=0, fields=None):
+    query = gameweek_query({"player_id": player_id}, after)
+    return iter_docs(COLLECTION, query, limit, fields), next_after(COLLECTION, query, limit)
+
+#every gameweek record of a player, by id or by (part of) the name
+def fetch_player_records(player_id=None, name=None):
+    if player_id is not None:
+        return find_docs(COLLECTION, {"player_id": player_id})
+    return find_docs(COLLECTION, name_query(name or ""))
+
+#one entry per player for the players page, read from the materialised players collection
+#the (name, _id) index serves the sort, so a page costs skip + limit documents
+def fetch_players_directory(skip=0, limit=0):
+    try:
+        db = get_db()
+        cursor = db[PLAYERS_COLL].find({}, projection={"totals": False, "series": False})
+        cursor = cursor.sort([("name", 1), ("_id", 1)])
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return []
+
+#the players document with its totals and gameweek series, one read on the _id index
+def fetch_player(player_id):
+    try:
+        return get_db()[PLAYERS_COLL].find_one({"_id": player_id}, projection={"name_search": False})
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return None
+
+def count_players():
+    try:
+        return get_db()[PLAYERS_COLL].count_documents({})
+    except Exception as e:
+        read_error(f"DB error: {e}")
+        return 0
 
 if __name__ == "__main__":
 
     folder_path = "raw/"    
     if os.path.exists(folder_path):
+        paths = []
         files = os.listdir(folder_path)
         for filename in files:
             if filename.endswith(".json"):
                 full_path = os.path.join(folder_path, filename)
-                upload_to_mongo(full_path)
+                paths.append(full_path)
+        #all the files in a few bulk writes instead of one per player
+        upload_many(paths)
     else:
         print(f"No folder found: {folder_path}")
\ No newline at end of file
@@ -0,0 +1,124 @@
+#declares and creates the indexes used by the backend and the frontend queries
+import os
+import sys
+from pymongo import ASCENDING, UpdateMany
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.database import (get_db, normalise_name, name_tokens, name_query, refresh_players, stale_uploads,
+                                 COLLECTION, ANALYTICS_COLL, SEASON_COLL, PLAYERS_COLL, META_COLL, PLAYERS_STALE_ID)
+
+#collection -> list of (keys, options)
+#(player_id, gameweek) also serves the player_id-only lookups through its prefix
+INDEXES = {
+    COLLECTION: [
+        ([("gameweek", ASCENDING)], {"name": "gameweek_1"}),
+        ([("player_id", ASCENDING), ("gameweek", ASCENDING)], {"name": "player_id_1_gameweek_1"}),
+        ([("name_tokens", ASCENDING)], {"name": "name_tokens_1"}),
+    ],
+    ANALYTICS_COLL: [
+        ([("gameweek", ASCENDING)], {"name": "gameweek_1"}),
+    ],
+    #the season collection is only read by _id, which is always indexed
+    SEASON_COLL: [],
+    #players page: sorted by name, _id breaks the ties so the pages are stable
+    PLAYERS_COLL: [
+        ([("name", ASCENDING), ("_id", ASCENDING)], {"name": "name_1__id_1"}),
+    ],
+}
+
+#representative filters of the queries we run, used to spot collection scans
+QUERY_CHECKS = [
+    (COLLECTION, {"gameweek": 1}),
+    (COLLECTION, {"player_id": 1}),
+    (COLLECTION, {"player_id": 1, "gameweek": 1}),
+    (COLLECTION, name_query("salah")),
+    (COLLECTION, name_query("mo salah")),
+    (ANALYTICS_COLL, {"gameweek": 1}),
+]
+
+def ensure_indexes(db=None):
+    db = db if db is not None else get_db()
+    created = []
+
+    for coll_name, indexes in INDEXES.items():
+        if not coll_name:
+            continue
+        for keys, options in indexes:
+            #create_index does nothing if the same index already exists
+            name = db[coll_name].create_index(keys, **options)
+            created.append(coll_name + "." + name)
+
+    backfill_name_search(db)
+    backfill_players(db)
+    return created
+
+#documents uploaded before name_search (or name_tokens) existed
+def backfill_name_search(db=None):
+    db = db if db is not None else get_db()
+    col = db[COLLECTION]
+
+    names = col.distinct("name", {"name_tokens": {"$exists": False}})
+    if not names:
+        return 0
+
+    operations = []
+    for name in names:
+        operations.append(UpdateMany(
+            {"name": name, "name_tokens": {"$exists": False}},
+            {"$set": {"name_search": normalise_name(name), "name_tokens": name_tokens(name)}}
+        ))
+    result = col.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+#players collection of a database uploaded before it (or its gameweek series) existed, built once from the raw rows
+#also regroups it after an upload that replaced its raw rows but failed before folding them (see upload_many)
+def backfill_players(db=None):
+    db = db if db is not None else get_db()
+    stale = stale_uploads(db)
+    if not stale and db[PLAYERS_COLL].find_one({}, projection={"_id": True}) is not None \
+            and db[PLAYERS_COLL].find_one({"series": {"$exists": False}}, projection={"_id": True}) is None:
+        return False
+    if db[COLLECTION].find_one({}, projection={"_id": True}) is None:
+        return False
+    if refresh_players(db) is None:
+        return False
+    #only the uploads read above, one listed since then is regrouped by the next backfill
+    if stale:
+        db[META_COLL].update_one({"_id": PLAYERS_STALE_ID}, {"$pullAll": {"uploads": stale}})
+    return True
+
+#walks an explain plan and returns the stages that scan the whole collection
+def find_collscans(plan):
+    stages = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            stages.append(plan)
+        for value in plan.values():
+            stages.extend(find_collscans(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(find_collscans(item))
+    return stages
+
+def check_collscans(db=None, checks=None):
+    db = db if db is not None else get_db()
+    report = []
+
+    for coll_name, query in checks or QUERY_CHECKS:
+        try:
+            explain = db.command("explain", {"find": coll_name, "filter": query}, verbosity="queryPlanner")
+        except Exception as e:
+            print(f"Error explaining query on {coll_name}: {e}")
+            continue
+
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if find_collscans(winning_plan):
+            print(f"Warning: collection scan on {coll_name} for {query}")
+            report.append({"collection": coll_name, "filter": query})
+
+    return report
+
+if __name__ == "__main__":
+    print("Indexes ready: " + ", ".join(ensure_indexes()))
+    check_collscans()
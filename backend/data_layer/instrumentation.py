@@ -0,0 +1,307 @@
+#run instrumentation: wall time, rows, bytes, database round trips and memory per stage and per gameweek
+#a run writes a json report and a prometheus text file, a chosen stage can also be captured with cProfile
+#outside of a run (single scripts, the web app) every call here is a no-op
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from pymongo import monitoring
+
+try:
+    import resource
+except ImportError:
+    #not available on windows, memory is then left out of the report
+    resource = None
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+REPORT_PATH = os.getenv("RUN_REPORT_PATH", os.path.join(current_dir, "run_report.json"))
+PROMETHEUS_PATH = os.getenv("RUN_METRICS_PATH", os.path.join(current_dir, "run_metrics.prom"))
+
+#PROFILE_STAGE=calculate_metrics captures every call of that stage, the .prof files go to PROFILE_DIR
+PROFILE_STAGE = os.getenv("PROFILE_STAGE") or None
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(current_dir, "profiles"))
+
+STAGES = ("data_extraction", "upload_to_mongo", "calculate_metrics", "calculate_season_stats")
+COUNTERS = ("rows", "bytes", "round_trips")
+
+_run = None
+_local = threading.local()
+
+
+def rss_bytes():
+    #current resident memory, linux only
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+#high water mark of the process (or of its finished children, e.g. the metrics process pool)
+def peak_rss_bytes(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    #ru_maxrss is in kilobytes on linux
+    return usage.ru_maxrss * 1024
+
+
+class Span:
+
+    def __init__(self, stage, gameweek=None):
+        self.stage = stage
+        self.gameweek = gameweek
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.start = time.perf_counter()
+        self.rss_start = rss_bytes()
+        self.peak_start = peak_rss_bytes()
+        self.seconds = None
+        self.rss_end = None
+        self.process_peak_rss = None
+        self.peak_growth = None
+        self.error = None
+
+    #the high water mark is per process: the growth is how much higher it got while the span ran,
+    #spans running at the same time on other threads add to each other's growth
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+        self.rss_end = rss_bytes()
+        self.process_peak_rss = peak_rss_bytes()
+        if self.peak_start is not None and self.process_peak_rss is not None:
+            self.peak_growth = self.process_peak_rss - self.peak_start
+
+    def to_dict(self):
+        data = dict(self.counters, seconds=round(self.seconds, 4), rss_bytes=self.rss_end,
+                    process_peak_rss_bytes=self.process_peak_rss, peak_rss_growth_bytes=self.peak_growth)
+        if self.rss_start is not None and self.rss_end is not None:
+            data["rss_delta_bytes"] = self.rss_end - self.rss_start
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class RunRecorder:
+
+    def __init__(self, profile_stage=None, profile_dir=None):
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir or PROFILE_DIR
+        self.lock = threading.Lock()
+        #cProfile can only be active on one thread at a time
+        self.profile_lock = threading.Lock()
+        self.spans = []
+        self.profiles = []
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.extra = {}
+
+    @contextmanager
+    def stage(self, name, gameweek=None):
+        span = Span(name, gameweek)
+        spans = getattr(_local, "spans", None)
+        if spans is None:
+            spans = _local.spans = []
+        spans.append(span)
+
+        profiler = None
+        if name == self.profile_stage and self.profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profile_lock.release()
+                self.save_profile(profiler, span)
+            span.finish()
+            spans.pop()
+            with self.lock:
+                self.spans.append(span)
+
+    def save_profile(self, profiler, span):
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        suffix = "" if span.gameweek is None else f"_gw{span.gameweek}"
+        path = os.path.join(self.profile_dir, f"{span.stage}{suffix}.prof")
+        profiler.dump_stats(path)
+        with self.lock:
+            self.profiles.append(path)
+
+    def stage_totals(self):
+        stages = {}
+        for span in self.spans:
+            totals = stages.setdefault(span.stage, dict(dict.fromkeys(COUNTERS, 0), calls=0, errors=0,
+                                                        seconds=0.0, peak_rss_growth_bytes=None))
+            totals["calls"] += 1
+            totals["errors"] += 1 if span.error else 0
+            totals["seconds"] += span.seconds
+            for counter in COUNTERS:
+                totals[counter] += span.counters[counter]
+            if span.peak_growth is not None:
+                totals["peak_rss_growth_bytes"] = max(totals["peak_rss_growth_bytes"] or 0, span.peak_growth)
+        for totals in stages.values():
+            totals["seconds"] = round(totals["seconds"], 4)
+        return stages
+
+    def report(self):
+        gameweeks = {}
+        for span in sorted(self.spans, key=lambda s: (str(s.gameweek), s.start)):
+            if span.gameweek is not None:
+                gameweeks.setdefault(str(span.gameweek), {})[span.stage] = span.to_dict()
+
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "wall_seconds": round(time.perf_counter() - self.start, 4),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "children_peak_rss_bytes": peak_rss_bytes(children=True),
+            "stages": self.stage_totals(),
+            "gameweeks": gameweeks,
+            "profiles": sorted(self.profiles)
+        }
+        report.update(self.extra)
+        return report
+
+    #text summary of the captured stage, the .prof files can be opened with snakeviz or python -m pstats
+    def profile_summary(self, limit=30):
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0], stream=io.StringIO())
+        for path in self.profiles[1:]:
+            stats.add(path)
+        stats.sort_stats("cumulative").print_stats(limit)
+        path = os.path.join(self.profile_dir, f"{self.profile_stage}.txt")
+        with open(path, "w") as f:
+            f.write(stats.stream.getvalue())
+        return path
+
+
+# ---------- prometheus ----------
+def label_text(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+#text exposition format, for the node exporter textfile collector or any scraper
+def prometheus_text(report):
+    metrics = []
+
+    def metric(name, help_text, samples):
+        metrics.append(f"# HELP {name} {help_text}")
+        metrics.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            if value is not None:
+                metrics.append(f"{name}{label_text(labels)} {value}")
+
+    stages = report["stages"]
+    metric("fpl_pipeline_run_seconds", "Wall time of the last pipeline run.", [(None, report["wall_seconds"])])
+    metric("fpl_pipeline_run_timestamp_seconds", "End of the last pipeline run.",
+           [(None, datetime.fromisoformat(report["finished_at"]).timestamp())])
+    metric("fpl_pipeline_peak_rss_bytes", "Peak resident memory of the pipeline process.",
+           [(None, report["peak_rss_bytes"])])
+    metric("fpl_pipeline_children_peak_rss_bytes", "Peak resident memory of the worker processes.",
+           [(None, report["children_peak_rss_bytes"])])
+
+    for field, help_text in (("seconds", "Time spent in the stage, summed over its calls."),
+                             ("calls", "Calls of the stage."),
+                             ("errors", "Failed calls of the stage."),
+                             ("rows", "Rows processed by the stage."),
+                             ("bytes", "Bytes transferred by the stage."),
+                             ("round_trips", "Database round trips of the stage."),
+                             ("peak_rss_growth_bytes", "Largest rise of the peak resident memory in one call.")):
+        metric(f"fpl_pipeline_stage_{field}", help_text,
+               [({"stage": stage}, totals[field]) for stage, totals in sorted(stages.items())])
+
+    samples = []
+    for gameweek, gameweek_stages in sorted(report["gameweeks"].items(), key=lambda item: int(item[0])):
+        for stage, span in sorted(gameweek_stages.items()):
+            samples.append(({"stage": stage, "gameweek": gameweek}, span["seconds"]))
+    metric("fpl_pipeline_gameweek_seconds", "Time of each stage for each gameweek of the last run.", samples)
+
+    return "\n".join(metrics) + "\n"
+
+def write_atomic(path, text):
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# ---------- module level api ----------
+def start_run(profile_stage=None, profile_dir=None):
+    global _run
+    _run = RunRecorder(profile_stage or PROFILE_STAGE, profile_dir)
+    return _run
+
+def current_run():
+    return _run
+
+#records a stage of the current run, does nothing when no run was started
+@contextmanager
+def stage(name, gameweek=None):
+    if _run is None:
+        yield None
+        return
+    with _run.stage(name, gameweek) as span:
+        yield span
+
+#adds to the counters of the innermost stage running on this thread
+def count(rows=0, bytes=0, round_trips=0):
+    spans = getattr(_local, "spans", None)
+    if not spans:
+        return
+    span = spans[-1]
+    span.counters["rows"] += rows
+    span.counters["bytes"] += bytes
+    span.counters["round_trips"] += round_trips
+
+#extra sections for the report, e.g. the queue stats of the pipeline
+def annotate(**sections):
+    if _run is not None:
+        _run.extra.update(sections)
+
+#writes the json report and the prometheus file, then ends the run
+def finish_run(report_path=None, prometheus_path=None):
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+
+    report = run.report()
+    summary = run.profile_summary()
+    if summary:
+        report["profile_summary"] = summary
+
+    write_atomic(report_path or REPORT_PATH, json.dumps(report, indent=2, default=str))
+    write_atomic(prometheus_path or PROMETHEUS_PATH, prometheus_text(report))
+    return report
+
+
+#every mongo command is one round trip, counted on the thread that sent it
+class CommandCounter(monitoring.CommandListener):
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        count(round_trips=1)
+
+    def failed(self, event):
+        count(round_trips=1)
+
+COMMAND_LISTENER = CommandCounter()
@@ -0,0 +1,829 @@
+#storage interface used by the evaluators and the frontend
+#mongo (data_layer.database) is the default, sqlite is an embedded engine that needs no server
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer import database
+from data_layer.instrumentation import count
+from data_layer.database import chunked, load_player_docs, name_tokens, normalise_name, BATCH_SIZE, STREAM_BATCH
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SQLITE_PATH = os.path.join(current_dir, "local.db")
+
+
+class MongoStorage:
+    name = "mongo"
+
+    def upload_many(self, json_file_paths, batch_size=None):
+        return database.upload_many(json_file_paths, batch_size)
+
+    def fetch_all_raw_data(self):
+        return database.fetch_all_raw_data()
+
+    def fetch_gameweek_data(self, gameweek_id):
+        return database.fetch_gameweek_data(gameweek_id)
+
+    def fetch_gameweeks_data(self, gameweek_ids):
+        return database.fetch_gameweeks_data(gameweek_ids)
+
+    def fetch_gameweek_ids(self):
+        return database.fetch_gameweek_ids()
+
+    def save_gameweek_data(self, summary_data):
+        return database.save_gameweek_data(summary_data)
+
+    def save_gameweeks_data(self, summaries):
+        return database.save_gameweeks_data(summaries)
+
+    def fetch_gameweek_summary(self, gameweek_id):
+        return database.fetch_gameweek_summary(gameweek_id)
+
+    def fetch_summary_digests(self, gameweek_ids=None):
+        return database.fetch_summary_digests(gameweek_ids)
+
+    def fetch_mvp_data(self):
+        return database.fetch_mvp_data()
+
+    def save_season_data(self, season_summary):
+        return database.save_season_data(season_summary)
+
+    def fetch_season_digest(self, season_id):
+        return database.fetch_season_digest(season_id)
+
+    def fetch_season_totals(self, totals_id):
+        return database.fetch_season_totals(totals_id)
+
+    def save_season_totals(self, totals):
+        return database.save_season_totals(totals)
+
+    def publish_data_version(self, last_updated_gw=None):
+        return database.publish_data_version(last_updated_gw)
+
+    def fetch_data_version(self):
+        return database.fetch_data_version()
+
+    def aggregate_player_totals(self):
+        return database.aggregate_player_totals()
+
+    def aggregate_max_gameweek(self):
+        return database.aggregate_max_gameweek()
+
+    def aggregate_recent_stats(self, start_gameweek):
+        return database.aggregate_recent_stats(start_gameweek)
+
+    def aggregate_team_goals(self):
+        return database.aggregate_team_goals()
+
+    def aggregate_team_conceded(self):
+        return database.aggregate_team_conceded()
+
+    def fetch_season(self):
+        return database.fetch_season()
+
+    def fetch_gameweek_summaries(self, limit=0):
+        return database.fetch_gameweek_summaries(limit)
+
+    def fetch_gameweek_players(self, gameweek_id, fields=None):
+        return database.fetch_gameweek_players(gameweek_id, fields)
+
+    def gameweek_summaries_page(self, after=None, limit=0, fields=None):
+        return database.gameweek_summaries_page(after, limit, fields)
+
+    def fetch_records_of_players(self, player_ids, from_gw=None, to_gw=None, fields=None):
+        return database.fetch_records_of_players(player_ids, from_gw, to_gw, fields)
+
+    def player_records_page(self, player_id, after=None, limit=0, fields=None):
+        return database.player_records_page(player_id, after, limit, fields)
+
+    def fetch_player_records(self, player_id=None, name=None):
+        return database.fetch_player_records(player_id, name)
+
+    def fetch_players_directory(self, skip=0, limit=0):
+        return database.fetch_players_directory(skip, limit)
+
+    def fetch_player(self, player_id):
+        return database.fetch_player(player_id)
+
+    def count_players(self):
+        return database.count_players()
+
+    def ping(self):
+        return database.ping()
+
+    def refresh_players(self, batch_size=None):
+        return database.refresh_players()
+
+    def ensure_indexes(self):
+        from data_layer.indexes import ensure_indexes
+        return ensure_indexes()
+
+    def replace_all(self, raw_docs, summaries, season_summary, totals, batch_size=None):
+        from data_layer.indexes import INDEXES
+        contents = {
+            database.COLLECTION: raw_docs,
+            database.ANALYTICS_COLL: summaries,
+            database.TOTALS_COLL: [totals],
+            database.SEASON_COLL: [season_summary],
+            database.PLAYERS_COLL: database.build_players_directory(raw_docs),
+        }
+        return database.replace_collections(contents, INDEXES, batch_size)
+
+    def close(self):
+        database.close_client()
+
+
+#documents are stored as json text, the fields we filter on get their own indexed columns
+SQLITE_TABLES = {
+    "raw": """_id TEXT PRIMARY KEY, player_id INTEGER, name TEXT, name_search TEXT, team TEXT,
+        position_id INTEGER, gameweek INTEGER, doc TEXT NOT NULL""",
+    "analytics": "_id TEXT PRIMARY KEY, gameweek INTEGER, doc TEXT NOT NULL",
+    "season": "_id TEXT PRIMARY KEY, doc TEXT NOT NULL",
+    "totals": "_id TEXT PRIMARY KEY, doc TEXT NOT NULL",
+    "meta": "_id TEXT PRIMARY KEY, doc TEXT NOT NULL",
+    "players": "_id INTEGER PRIMARY KEY, name TEXT, team TEXT, doc TEXT NOT NULL",
+    #words of the raw names, a name search is a range scan of its primary key per word
+    "raw_tokens": "token TEXT, _id TEXT, PRIMARY KEY (token, _id)",
+}
+
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS raw_gameweek ON raw (gameweek)",
+    "CREATE INDEX IF NOT EXISTS raw_player_gameweek ON raw (player_id, gameweek)",
+    "CREATE INDEX IF NOT EXISTS raw_name_search ON raw (name_search)",
+    "CREATE INDEX IF NOT EXISTS analytics_gameweek ON analytics (gameweek)",
+    "CREATE INDEX IF NOT EXISTS players_name ON players (name, _id)",
+]
+
+SQLITE_SCHEMA = []
+for table, columns in SQLITE_TABLES.items():
+    SQLITE_SCHEMA.append("CREATE TABLE IF NOT EXISTS " + table + " (" + columns + ")")
+SQLITE_SCHEMA += SQLITE_INDEXES
+
+STAGING_SUFFIX = "_staging"
+
+def raw_row(doc):
+    return (doc["_id"], doc["player_id"], doc["name"], doc.get("name_search", normalise_name(doc["name"])),
+            doc["team"], doc["position_id"], doc["gameweek"], json.dumps(doc))
+
+def token_rows(doc):
+    return [(token, doc["_id"]) for token in doc.get("name_tokens", name_tokens(doc["name"]))]
+
+#bounds of the tokens starting with the word
+def prefix_range(word):
+    return word, word[:-1] + chr(ord(word[-1]) + 1)
+
+def analytics_row(summary):
+    return (summary["_id"], summary.get("gameweek"), json.dumps(summary))
+
+def doc_row(doc):
+    return (doc["_id"], json.dumps(doc))
+
+def player_row(player):
+    return (player["_id"], player["name"], player["team"], json.dumps(player))
+
+def stat(field):
+    return "json_extract(doc, '$.statistics." + field + "')"
+
+#sql expression of the projected document, the selected fields rebuilt with json_object
+#field names are checked by database.parse_fields, so they are safe inside the json paths
+def select_fields(fields=None):
+    if not fields:
+        return "doc"
+    tree = {}
+    for field in fields:
+        parts = field.split(".")
+        node = tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = None
+
+    def build(node, path):
+        arguments = []
+        for key, child in node.items():
+            arguments.append("'" + key + "'")
+            if child is None:
+                arguments.append("json_extract(doc, '" + path + "." + key + "')")
+            else:
+                arguments.append(build(child, path + "." + key))
+        return "json_object(" + ", ".join(arguments) + ")"
+    return build(tree, "$")
+
+#fields missing from the document are left out, like a mongo projection
+def drop_missing(doc):
+    result = {}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            value = drop_missing(value)
+            if not value:
+                continue
+        if value is not None:
+            result[key] = value
+    return result
+
+#same sums as the mongo pipelines, decimals as the [rowid, value] of every row (see database.stat_values)
+#a SUM with no value is NULL, a $sum is 0
+def stat_sum_sql(field):
+    if field in database.DECIMAL_FIELDS:
+        return "json_group_array(json_array(rowid, COALESCE(" + stat(field) + ", 0))) AS " + field
+    return "COALESCE(SUM(" + stat(field) + "), 0) AS " + field
+
+#sqlite reads fail like the mongo ones: the error is printed and counted by database.read_error,
+#the caller gets an empty result (default() for a list or a dict), the streamed pages still raise
+def read_or(default):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.Error as e:
+                database.read_error(f"SQLite error in {method.__name__}: {e}")
+                return default() if callable(default) else default
+        return wrapper
+    return decorate
+
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_SQLITE_PATH
+        self.local = threading.local()
+        self.ensure_indexes()
+
+    #one connection per thread (and per process after a fork)
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def query(self, sql, params=()):
+        count(round_trips=1)
+        return self.conn().execute(sql, params).fetchall()
+
+    def docs(self, sql, params=(), keep_id=True):
+        results = []
+        for (doc,) in self.query(sql, params):
+            doc = json.loads(doc)
+            if not keep_id:
+                doc.pop("_id", None)
+            results.append(doc)
+        return results
+
+    #streamed version of docs, STREAM_BATCH rows in memory at a time
+    def iter_docs(self, sql, params=(), fields=None):
+        count(round_trips=1)
+        cursor = self.conn().execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH)
+                if not rows:
+                    break
+                for (doc,) in rows:
+                    doc = json.loads(doc)
+                    #whole documents are returned without their _id, like the mongo reads
+                    if fields:
+                        doc = drop_missing(doc)
+                    else:
+                        doc.pop("_id", None)
+                    yield doc
+        finally:
+            cursor.close()
+
+    def ensure_indexes(self):
+        conn = self.conn()
+        with conn:
+            for statement in SQLITE_SCHEMA:
+                conn.execute(statement)
+        #databases filled before the name tokens existed
+        if self.query("SELECT EXISTS (SELECT 1 FROM raw) AND NOT EXISTS (SELECT 1 FROM raw_tokens)")[0][0]:
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO raw_tokens (token, _id) VALUES (?, ?)",
+                                 [(token, _id) for _id, name in self.query("SELECT _id, name FROM raw")
+                                  for token in name_tokens(name)])
+        #databases filled before the players table, or its gameweek series, existed
+        if self.query("SELECT (NOT EXISTS (SELECT 1 FROM players) AND EXISTS (SELECT 1 FROM raw)) "
+                      "OR EXISTS (SELECT 1 FROM players WHERE json_extract(doc, '$.series') IS NULL)")[0][0]:
+            self.refresh_players()
+        return ["raw_gameweek", "raw_player_gameweek", "raw_name_search", "analytics_gameweek", "players_name"]
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.pid == os.getpid():
+            conn.close()
+        self.local.conn = None
+
+    # ---------- full rebuild ----------
+    #fills staging tables next to the live ones, then swaps them in a single transaction
+    #readers keep their snapshot of the old tables until the commit (wal mode), they never see a partial rebuild
+    def replace_all(self, raw_docs, summaries, season_summary, totals, batch_size=None):
+        conn = self.conn()
+        contents = {
+            "raw": ("?, ?, ?, ?, ?, ?, ?, ?", [raw_row(doc) for doc in raw_docs]),
+            "raw_tokens": ("?, ?", [row for doc in raw_docs for row in token_rows(doc)]),
+            "analytics": ("?, ?, ?", [analytics_row(summary) for summary in summaries]),
+            "season": ("?, ?", [doc_row(season_summary)]),
+            "totals": ("?, ?", [doc_row(totals)]),
+            "players": ("?, ?, ?, ?", [player_row(player) for player in database.build_players_directory(raw_docs)]),
+        }
+
+        with conn:
+            for table, (marks, rows) in contents.items():
+                staging = table + STAGING_SUFFIX
+                conn.execute("DROP TABLE IF EXISTS " + staging)
+                conn.execute("CREATE TABLE " + staging + " (" + SQLITE_TABLES[table] + ")")
+                for batch in chunked(rows, batch_size or BATCH_SIZE):
+                    conn.executemany("INSERT INTO " + staging + " VALUES (" + marks + ")", batch)
+                    count(rows=len(batch), round_trips=1)
+
+        #ddl is transactional in sqlite, the indexes are rebuilt inside the swap under their usual names
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in contents:
+                conn.execute("DROP TABLE IF EXISTS " + table)
+                conn.execute("ALTER TABLE " + table + STAGING_SUFFIX + " RENAME TO " + table)
+            for statement in SQLITE_INDEXES:
+                conn.execute(statement)
+        count(round_trips=1)
+
+        return {table: len(rows) for table, (marks, rows) in contents.items()}
+
+    # ---------- raw rows ----------
+    def upsert_raw(self, docs, batch_size=None):
+        conn = self.conn()
+        counts = {"inserted": 0, "modified": 0, "upserted": 0, "matched": 0, "round_trips": 0}
+
+        for batch in chunked(docs, batch_size or BATCH_SIZE):
+            ids = [doc["_id"] for doc in batch]
+            marks = ",".join("?" * len(ids))
+            rows = [raw_row(doc) for doc in batch]
+
+            with conn:
+                #the raw rows and the players they are folded into change in one write transaction
+                conn.execute("BEGIN IMMEDIATE")
+                previous = {}
+                for (doc,) in conn.execute("SELECT doc FROM raw WHERE _id IN (" + marks + ")", ids):
+                    doc = json.loads(doc)
+                    previous[doc["_id"]] = doc
+                existing = len(previous)
+                before = conn.total_changes
+                #rows whose document did not change are left untouched
+                conn.executemany(
+                    """INSERT INTO raw (_id, player_id, name, name_search, team, position_id, gameweek, doc)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(_id) DO UPDATE SET player_id = excluded.player_id, name = excluded.name,
+                           name_search = excluded.name_search, team = excluded.team,
+                           position_id = excluded.position_id, gameweek = excluded.gameweek, doc = excluded.doc
+                       WHERE raw.doc IS NOT excluded.doc""",
+                    rows
+                )
+                changes = conn.total_changes - before
+                renamed = [doc for doc in batch if (previous.get(doc["_id"]) or {}).get("name") != doc["name"]]
+                if renamed:
+                    renamed_ids = [doc["_id"] for doc in renamed]
+                    conn.execute("DELETE FROM raw_tokens WHERE _id IN (" + ",".join("?" * len(renamed_ids)) + ")",
+                                 renamed_ids)
+                    conn.executemany("INSERT INTO raw_tokens (token, _id) VALUES (?, ?)",
+                                     [row for doc in renamed for row in token_rows(doc)])
+                self.fold_players(conn, batch, previous)
+
+            counts["upserted"] += len(batch) - existing
+            counts["matched"] += existing
+            counts["modified"] += changes - (len(batch) - existing)
+            counts["round_trips"] += 1
+            count(round_trips=1)
+
+        return counts
+
+    def upload_many(self, json_file_paths, batch_size=None):
+        docs = []
+        for path in json_file_paths:
+            print(f"\nUploading to SQLite: {path}")
+            try:
+                docs.extend(load_player_docs(path))
+            except FileNotFoundError:
+                print(f"File {path} not found")
+
+        counts = self.upsert_raw(docs, batch_size)
+        count(rows=len(docs))
+        print("Processed/Inserted " + str(len(docs)) + " players "
+              f"(modified {counts['modified']}, upserted {counts['upserted']})")
+        return counts
+
+    @read_or(list)
+    def fetch_all_raw_data(self):
+        return self.docs("SELECT doc FROM raw ORDER BY rowid")
+
+    @read_or(list)
+    def fetch_gameweek_data(self, gameweek_id):
+        return self.docs("SELECT doc FROM raw WHERE gameweek = ? ORDER BY rowid", (gameweek_id,))
+
+    @read_or(list)
+    def fetch_gameweeks_data(self, gameweek_ids):
+        gameweek_ids = list(gameweek_ids)
+        if not gameweek_ids:
+            return []
+        marks = ",".join("?" * len(gameweek_ids))
+        return self.docs("SELECT doc FROM raw WHERE gameweek IN (" + marks + ") ORDER BY rowid", gameweek_ids)
+
+    @read_or(list)
+    def fetch_gameweek_ids(self):
+        return [row[0] for row in self.query("SELECT DISTINCT gameweek FROM raw ORDER BY gameweek")]
+
+    # ---------- players directory ----------
+    #folds the uploaded rows into the documents of their players, previous is {_id: raw row replaced}
+    #only the players of the batch are read and written, whatever the number of gameweeks stored
+    def fold_players(self, conn, docs, previous):
+        changed = [doc for doc in docs if previous.get(doc["_id"]) != doc]
+        player_ids = sorted({doc["player_id"] for doc in changed})
+        if not player_ids:
+            return 0
+        marks = ",".join("?" * len(player_ids))
+        players = {}
+        for (doc,) in conn.execute("SELECT doc FROM players WHERE _id IN (" + marks + ")", player_ids):
+            doc = json.loads(doc)
+            players[doc["_id"]] = doc
+        for doc in changed:
+            players[doc["player_id"]] = database.fold_player(players.get(doc["player_id"]), doc,
+                                                             previous.get(doc["_id"]))
+        conn.executemany("INSERT OR REPLACE INTO players (_id, name, team, doc) VALUES (?, ?, ?, ?)",
+                         [player_row(players[player_id]) for player_id in player_ids])
+        return len(player_ids)
+
+    #every player again from all the raw rows, for the backfill
+    def refresh_players(self, batch_size=None):
+        player_ids = [row[0] for row in self.query("SELECT DISTINCT player_id FROM raw ORDER BY player_id")]
+
+        conn = self.conn()
+        round_trips = 0
+        for batch in chunked(player_ids, batch_size or BATCH_SIZE):
+            marks = ",".join("?" * len(batch))
+            docs = self.docs("SELECT doc FROM raw WHERE player_id IN (" + marks + ") ORDER BY gameweek, rowid", batch)
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO players (_id, name, team, doc) VALUES (?, ?, ?, ?)",
+                                 [player_row(player) for player in database.build_players_directory(docs)])
+            count(round_trips=1)
+            round_trips += 2
+        return {"players": len(player_ids), "round_trips": round_trips}
+
+    # ---------- analytics ----------
+    def save_gameweeks_data(self, summaries):
+        conn = self.conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO analytics (_id, gameweek, doc) VALUES (?, ?, ?)",
+                [analytics_row(s) for s in summaries]
+            )
+        count(round_trips=1)
+        return {"inserted": 0, "modified": 0, "upserted": len(summaries), "matched": 0, "round_trips": 1}
+
+    def save_gameweek_data(self, summary_data):
+        self.save_gameweeks_data([summary_data])
+
+    @read_or(None)
+    def fetch_gameweek_summary(self, gameweek_id):
+        docs = self.docs("SELECT doc FROM analytics WHERE gameweek = ? LIMIT 1", (gameweek_id,))
+        return docs[0] if docs else None
+
+    @read_or(dict)
+    def fetch_summary_digests(self, gameweek_ids=None):
+        sql = "SELECT gameweek, json_extract(doc, '$.input_digest') FROM analytics WHERE gameweek IS NOT NULL"
+        params = []
+        if gameweek_ids is not None:
+            gameweek_ids = list(gameweek_ids)
+            if not gameweek_ids:
+                return {}
+            sql += " AND gameweek IN (" + ",".join("?" * len(gameweek_ids)) + ")"
+            params = gameweek_ids
+        return {gameweek: digest for gameweek, digest in self.query(sql, params)}
+
+    @read_or(list)
+    def fetch_mvp_data(self):
+        results = []
+        for _id, gameweek, mvp in self.query(
+                "SELECT _id, gameweek, json_extract(doc, '$.mvp') FROM analytics ORDER BY rowid"):
+            doc = {"_id": _id, "gameweek": gameweek}
+            if mvp is not None:
+                doc["mvp"] = json.loads(mvp)
+            results.append(doc)
+        return results
+
+    # ---------- season ----------
+    def save_season_data(self, season_summary):
+        conn = self.conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO season (_id, doc) VALUES (?, ?)", doc_row(season_summary))
+        count(round_trips=1)
+        print(f"Season stats for {season_summary['_id']} saved successfully to SQLite")
+
+    @read_or(None)
+    def fetch_season_digest(self, season_id):
+        rows = self.query("SELECT json_extract(doc, '$.input_digest') FROM season WHERE _id = ?", (season_id,))
+        return rows[0][0] if rows else None
+
+    @read_or(None)
+    def fetch_season_totals(self, totals_id):
+        docs = self.docs("SELECT doc FROM totals WHERE _id = ?", (totals_id,))
+        return docs[0] if docs else None
+
+    def save_season_totals(self, totals):
+        conn = self.conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO totals (_id, doc) VALUES (?, ?)", doc_row(totals))
+        count(round_trips=1)
+
+    # ---------- published data version ----------
+    def publish_data_version(self, last_updated_gw=None):
+        conn = self.conn()
+        with conn:
+            #read and bump in one write transaction, two publishers cannot get the same version
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT doc FROM meta WHERE _id = ?", (database.DATA_VERSION_ID,)).fetchone()
+            doc = json.loads(row[0]) if row else {"_id": database.DATA_VERSION_ID, "version": 0}
+            doc["version"] += 1
+            doc["last_updated_gw"] = last_updated_gw
+            doc["published_at"] = datetime.now(timezone.utc).isoformat()
+            conn.execute("INSERT OR REPLACE INTO meta (_id, doc) VALUES (?, ?)", doc_row(doc))
+        count(round_trips=1)
+        return doc
+
+    @read_or(None)
+    def fetch_data_version(self):
+        docs = self.docs("SELECT doc FROM meta WHERE _id = ?", (database.DATA_VERSION_ID,))
+        return docs[0] if docs else None
+
+    # ---------- season aggregations, same rows as the mongo pipelines ----------
+    def dict_rows(self, sql, params=()):
+        cursor = self.conn().execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @read_or(list)
+    def aggregate_player_totals(self):
+        sums = [stat_sum_sql(field) for field in database.SEASON_SUM_FIELDS]
+        sql = (
+            "SELECT player_id, name, team, position_id, " + ", ".join(sums) + ", "
+            "SUM(CASE WHEN " + stat("in_dreamteam") + " THEN 1 ELSE 0 END) AS in_dreamteam, "
+            "COUNT(*) AS matches_played "
+            "FROM raw GROUP BY player_id, name, team, position_id"
+        )
+        rows = self.dict_rows(sql)
+        #the values in rowid order, the order fetch_all_raw_data reads them in
+        for row in rows:
+            for field in database.DECIMAL_FIELDS:
+                row[field] = [value for rowid, value in sorted(json.loads(row[field]))]
+        return rows
+
+    @read_or(None)
+    def aggregate_max_gameweek(self):
+        return self.query("SELECT MAX(gameweek) FROM raw")[0][0]
+
+    @read_or(list)
+    def aggregate_recent_stats(self, start_gameweek):
+        sql = (
+            "SELECT name, team, " + stat_sum_sql("goals_scored") + ", " + stat_sum_sql("assists") + ", "
+            "COUNT(*) AS matches_played FROM raw WHERE gameweek >= ? GROUP BY name, team"
+        )
+        return self.dict_rows(sql, (start_gameweek,))
+
+    @read_or(list)
+    def aggregate_team_goals(self):
+        return self.dict_rows("SELECT team, " + stat_sum_sql("goals_scored") + " FROM raw GROUP BY team")
+
+    @read_or(list)
+    def aggregate_team_conceded(self):
+        sql = (
+            "SELECT team, COALESCE(SUM(conceded), 0) AS goals_conceded FROM ("
+            "SELECT team, gameweek, MAX(" + stat("goals_conceded") + ") AS conceded "
+            "FROM raw GROUP BY team, gameweek) GROUP BY team"
+        )
+        return self.dict_rows(sql)
+
+    # ---------- frontend reads ----------
+    @read_or(None)
+    def fetch_season(self):
+        docs = self.docs("SELECT doc FROM season ORDER BY rowid LIMIT 1", keep_id=False)
+        return docs[0] if docs else None
+
+    @read_or(list)
+    def fetch_gameweek_summaries(self, limit=0):
+        sql = "SELECT doc FROM analytics ORDER BY rowid"
+        if limit:
+            sql += " LIMIT " + str(int(limit))
+        return self.docs(sql, keep_id=False)
+
+    @read_or(list)
+    def fetch_gameweek_players(self, gameweek_id, fields=None):
+        return list(self.iter_docs("SELECT " + select_fields(fields) + " FROM raw WHERE gameweek = ? ORDER BY rowid",
+                                   (gameweek_id,), fields))
+
+    @read_or(list)
+    def fetch_records_of_players(self, player_ids, from_gw=None, to_gw=None, fields=None):
+        player_ids = list(player_ids)
+        if not player_ids:
+            return []
+        marks = ",".join("?" * len(player_ids))
+        sql = "SELECT " + select_fields(fields) + " FROM raw WHERE player_id IN (" + marks + ")"
+        params = player_ids
+        if from_gw is not None:
+            sql += " AND gameweek >= ?"
+            params = params + [from_gw]
+        if to_gw is not None:
+            sql += " AND gameweek <= ?"
+            params = params + [to_gw]
+        return list(self.iter_docs(sql + " ORDER BY player_id, gameweek", params, fields))
+
+    #keyset pages on the gameweek, (documents, gameweek the next page starts after)
+    def gameweeks_page(self, table, where, params, after, limit, fields):
+        if after is not None:
+            where += " AND gameweek > ?"
+            params = params + (after,)
+        sql = "SELECT " + select_fields(fields) + " FROM " + table + " WHERE " + where + " ORDER BY gameweek"
+        following = None
+        if limit:
+            sql += " LIMIT " + str(int(limit))
+            keys = self.query("SELECT gameweek FROM " + table + " WHERE " + where
+                              + " ORDER BY gameweek LIMIT 2 OFFSET ?", params + (int(limit) - 1,))
+            following = keys[0][0] if len(keys) == 2 else None
+        return self.iter_docs(sql, params, fields), following
+
+    def gameweek_summaries_page(self, after=None, limit=0, fields=None):
+        return self.gameweeks_page("analytics", "gameweek IS NOT NULL", (), after, limit, fields)
+
+    def player_records_page(self, player_id, after=None, limit=0, fields=None):
+        return self.gameweeks_page("raw", "player_id = ?", (player_id,), after, limit, fields)
+
+    @read_or(list)
+    def fetch_player_records(self, player_id=None, name=None):
+        if player_id is not None:
+            return self.docs("SELECT doc FROM raw WHERE player_id = ? ORDER BY gameweek", (player_id,), keep_id=False)
+        #same match as database.name_query, every word starts a word of the name
+        sql = "SELECT doc FROM raw"
+        params = []
+        for word in normalise_name(name or "").split():
+            sql += " AND" if params else " WHERE"
+            sql += " _id IN (SELECT _id FROM raw_tokens WHERE token >= ? AND token < ?)"
+            params += prefix_range(word)
+        return self.docs(sql + " ORDER BY rowid", params, keep_id=False)
+
+    @read_or(list)
+    def fetch_players_directory(self, skip=0, limit=0):
+        #served by the (name, _id) index, no sort step
+        #totals and series are dropped in sqlite, the listing does not parse them
+        return self.docs("SELECT json_remove(doc, '$.totals', '$.series') FROM players ORDER BY name, _id "
+                         "LIMIT ? OFFSET ?", (limit or -1, skip))
+
+    @read_or(None)
+    def fetch_player(self, player_id):
+        docs = self.docs("SELECT json_remove(doc, '$.name_search') FROM players WHERE _id = ?", (player_id,))
+        return docs[0] if docs else None
+
+    @read_or(0)
+    def count_players(self):
+        return self.query("SELECT COUNT(*) FROM players")[0][0]
+
+    def ping(self):
+        return self.query("SELECT 1")[0][0] == 1
+
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+
+_storage = None
+_storage_key = None
+_storage_lock = threading.Lock()
+
+#backend chosen from the environment, recreated if the configuration changes
+def get_storage():
+    global _storage, _storage_key
+
+    backend = os.getenv("STORAGE_BACKEND", STORAGE_BACKEND)
+    key = (backend, os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    if _storage is not None and _storage_key == key:
+        return _storage
+
+    with _storage_lock:
+        if _storage is None or _storage_key != key:
+            if backend == "sqlite":
+                _storage = SQLiteStorage(key[1])
+            elif backend == "mongo":
+                _storage = MongoStorage()
+            else:
+                raise ValueError(f"Unknown storage backend: {backend}")
+            _storage_key = key
+    return _storage
+
+def replace_all(raw_docs, summaries, season_summary, totals, batch_size=None):
+    return get_storage().replace_all(raw_docs, summaries, season_summary, totals, batch_size)
+
+def close_storage():
+    global _storage, _storage_key
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
+        _storage = None
+        _storage_key = None
+
+
+# ---------- module level functions, same names as data_layer.database ----------
+def upload_to_mongo(json_file_path, batch_size=None):
+    return get_storage().upload_many([json_file_path], batch_size)
+
+def upload_many(json_file_paths, batch_size=None):
+    return get_storage().upload_many(json_file_paths, batch_size)
+
+def fetch_all_raw_data():
+    return get_storage().fetch_all_raw_data()
+
+def fetch_gameweek_data(gameweek_id):
+    return get_storage().fetch_gameweek_data(gameweek_id)
+
+def fetch_gameweeks_data(gameweek_ids):
+    return get_storage().fetch_gameweeks_data(gameweek_ids)
+
+def fetch_gameweek_ids():
+    return get_storage().fetch_gameweek_ids()
+
+def save_gameweek_data(summary_data):
+    return get_storage().save_gameweek_data(summary_data)
+
+def save_gameweeks_data(summaries):
+    return get_storage().save_gameweeks_data(summaries)
+
+def fetch_gameweek_summary(gameweek_id):
+    return get_storage().fetch_gameweek_summary(gameweek_id)
+
+def fetch_summary_digests(gameweek_ids=None):
+    return get_storage().fetch_summary_digests(gameweek_ids)
+
+def fetch_mvp_data():
+    return get_storage().fetch_mvp_data()
+
+def save_season_data(season_summary):
+    return get_storage().save_season_data(season_summary)
+
+def fetch_season_digest(season_id):
+    return get_storage().fetch_season_digest(season_id)
+
+def fetch_season_totals(totals_id):
+    return get_storage().fetch_season_totals(totals_id)
+
+def save_season_totals(totals):
+    return get_storage().save_season_totals(totals)
+
+def publish_data_version(last_updated_gw=None):
+    return get_storage().publish_data_version(last_updated_gw)
+
+def fetch_data_version():
+    return get_storage().fetch_data_version()
+
+def aggregate_player_totals():
+    return get_storage().aggregate_player_totals()
+
+def aggregate_max_gameweek():
+    return get_storage().aggregate_max_gameweek()
+
+def aggregate_recent_stats(start_gameweek):
+    return get_storage().aggregate_recent_stats(start_gameweek)
+
+def aggregate_team_goals():
+    return get_storage().aggregate_team_goals()
+
+def aggregate_team_conceded():
+    return get_storage().aggregate_team_conceded()
+
+def refresh_players():
+    return get_storage().refresh_players()
+
+def fetch_players_directory(skip=0, limit=0):
+    return get_storage().fetch_players_directory(skip, limit)
+
+def gameweek_summaries_page(after=None, limit=0, fields=None):
+    return get_storage().gameweek_summaries_page(after, limit, fields)
+
+def fetch_records_of_players(player_ids, from_gw=None, to_gw=None, fields=None):
+    return get_storage().fetch_records_of_players(player_ids, from_gw, to_gw, fields)
+
+def player_records_page(player_id, after=None, limit=0, fields=None):
+    return get_storage().player_records_page(player_id, after, limit, fields)
+
+def fetch_player(player_id):
+    return get_storage().fetch_player(player_id)
+
+def count_players():
+    return get_storage().count_players()
+
+def ensure_indexes():
+    return get_storage().ensure_indexes()
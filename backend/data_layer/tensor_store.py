@@ -0,0 +1,348 @@
+#columnar copy of the raw rows: a player x gameweek x stat array kept in memory mapped .npy files
+#one store per season directory, appended to by the ingestion and read with zero-copy slices
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_layer.database import load_player_docs
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+TENSOR_PATH = os.getenv("TENSOR_PATH", os.path.join(current_dir, "tensor"))
+
+#gameweek axis index is gameweek_id - 1, a premier league season has 38
+GAMEWEEK_CAPACITY = 38
+PLAYER_CAPACITY = 256
+
+#arrays of the store: file name -> (dtype, fill value)
+ARRAYS = {
+    "stats": ("float64", 0.0),    #player x gameweek x stat
+    "rows": ("int32", -1),        #player x gameweek, position of the row in its gameweek, -1 if not played
+    "teams": ("int16", -1),       #player x gameweek, team index
+}
+
+
+#files of generation 0 are the unversioned stats.npy, rows.npy and teams.npy
+def array_file(name, generation):
+    return f"{name}.{generation}.npy" if generation else name + ".npy"
+
+def stat_kind(value):
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    return "float"
+
+class TensorStore:
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path or TENSOR_PATH
+        self.read_only = read_only
+        self.index_path = os.path.join(self.path, "index.json")
+
+        #the index names the array files, a swap between reading it and opening them is read again once
+        for attempt in range(2):
+            self.index = read_index(self.path)
+            if self.index is None:
+                if read_only:
+                    raise FileNotFoundError(f"No tensor store in {self.path}")
+                self.index = {"stats": [], "kinds": {}, "players": [], "teams": [], "gameweeks": []}
+            try:
+                self.open_arrays()
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+        self.player_index = {p["player_id"]: i for i, p in enumerate(self.index["players"])}
+        self.team_index = {team: i for i, team in enumerate(self.index["teams"])}
+        self.stat_index = {stat: i for i, stat in enumerate(self.index["stats"])}
+
+    def array_path(self, name, generation=None):
+        generation = self.index.get("generation", 0) if generation is None else generation
+        return os.path.join(self.path, array_file(name, generation))
+
+    def open_arrays(self):
+        mode = "r" if self.read_only else "r+"
+        #a store with gameweeks has its files, a missing one means the index was swapped while opening
+        if self.index["gameweeks"] or os.path.exists(self.array_path("stats")):
+            for name in ARRAYS:
+                setattr(self, name, np.load(self.array_path(name), mmap_mode=mode))
+        else:
+            for name, (dtype, fill) in ARRAYS.items():
+                shape = (0, 0, 0) if name == "stats" else (0, 0)
+                setattr(self, name, np.full(shape, fill, dtype=dtype))
+
+    @property
+    def shape(self):
+        return self.stats.shape
+
+    # ---------- writing ----------
+    #bigger arrays are written as the next generation of files, the index switches to them on the next flush
+    #a mapped file is never replaced or truncated, readers (and windows) keep their old mapping
+    def grow(self, players, gameweeks, stats):
+        old_players, old_gameweeks, old_stats = self.stats.shape
+        if players <= old_players and gameweeks <= old_gameweeks and stats <= old_stats:
+            return
+
+        #players grow by doubling so appends stay amortised O(1)
+        players = max(players, old_players * 2 if players > old_players else old_players, PLAYER_CAPACITY)
+        gameweeks = max(gameweeks, old_gameweeks, GAMEWEEK_CAPACITY)
+        stats = max(stats, old_stats)
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        generation = self.index.get("generation", 0) + 1
+        for name, (dtype, fill) in ARRAYS.items():
+            shape = (players, gameweeks, stats) if name == "stats" else (players, gameweeks)
+            old = getattr(self, name)
+            grown = np.lib.format.open_memmap(self.array_path(name, generation), mode="w+", dtype=dtype, shape=shape)
+            grown[...] = fill
+            if name == "stats":
+                grown[:old_players, :old_gameweeks, :old_stats] = old
+            else:
+                grown[:old_players, :old_gameweeks] = old
+            grown.flush()
+            del grown
+
+        self.close()
+        self.index["generation"] = generation
+        self.open_arrays()
+
+    def add_player(self, doc):
+        index = self.player_index.get(doc["player_id"])
+        if index is None:
+            index = len(self.index["players"])
+            self.index["players"].append({"player_id": doc["player_id"], "name": doc["name"],
+                                          "position_id": doc["position_id"]})
+            self.player_index[doc["player_id"]] = index
+        return index
+
+    def add_team(self, team):
+        if team not in self.team_index:
+            self.team_index[team] = len(self.index["teams"])
+            self.index["teams"].append(team)
+        return self.team_index[team]
+
+    def add_stats(self, stats):
+        for stat, value in stats.items():
+            if stat not in self.stat_index and isinstance(value, (int, float)):
+                self.stat_index[stat] = len(self.index["stats"])
+                self.index["stats"].append(stat)
+                self.index["kinds"][stat] = stat_kind(value)
+
+    #writes (or rewrites) one gameweek from its raw documents
+    def append_gameweek(self, gameweek_id, docs):
+        if self.read_only:
+            raise ValueError("Tensor store opened read only")
+        if gameweek_id < 1:
+            raise ValueError(f"Invalid gameweek id: {gameweek_id}")
+
+        rows = []
+        for position, doc in enumerate(docs):
+            stats = doc.get("statistics", {})
+            self.add_stats(stats)
+            rows.append((self.add_player(doc), self.add_team(doc["team"]), position, stats))
+
+        self.grow(len(self.index["players"]), gameweek_id, len(self.index["stats"]))
+
+        column = gameweek_id - 1
+        #a gameweek ingested again replaces the old values
+        self.stats[:, column, :] = 0.0
+        self.rows[:, column] = -1
+        self.teams[:, column] = -1
+
+        #one matrix per gameweek, written with a single fancy-indexed assignment
+        values = np.zeros((len(rows), self.stats.shape[2]))
+        for i, (player, team, position, stats) in enumerate(rows):
+            for stat, value in stats.items():
+                index = self.stat_index.get(stat)
+                if index is not None:
+                    values[i, index] = float(value or 0)
+
+        if rows:
+            players = np.array([row[0] for row in rows])
+            self.stats[players, column, :] = values
+            self.rows[players, column] = [row[2] for row in rows]
+            self.teams[players, column] = [row[1] for row in rows]
+
+        if gameweek_id not in self.index["gameweeks"]:
+            self.index["gameweeks"].append(gameweek_id)
+            self.index["gameweeks"].sort()
+        self.flush()
+
+    def append_files(self, json_file_paths):
+        gameweeks = []
+        for path in json_file_paths:
+            docs = load_player_docs(path)
+            if not docs:
+                continue
+            by_gameweek = {}
+            for doc in docs:
+                by_gameweek.setdefault(doc["gameweek"], []).append(doc)
+            for gameweek_id, gameweek_docs in sorted(by_gameweek.items()):
+                self.append_gameweek(gameweek_id, gameweek_docs)
+                gameweeks.append(gameweek_id)
+        return gameweeks
+
+    #arrays first, then the index, so the index never names a gameweek that is not on disk
+    #the files of the generations before are removed once the index no longer names them
+    def flush(self):
+        for name in ARRAYS:
+            array = getattr(self, name)
+            if isinstance(array, np.memmap):
+                array.flush()
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        remove_stale_arrays(self.path, self.index)
+
+    #drops the memory maps, their files can then be moved or removed
+    def close(self):
+        for name in ARRAYS:
+            setattr(self, name, None)
+
+    # ---------- reading, all views unless stated otherwise ----------
+    def stat(self, name):
+        return self.stats[:, :, self.stat_index[name]]
+
+    def gameweek(self, gameweek_id):
+        return self.stats[:, gameweek_id - 1, :]
+
+    def played(self):
+        return self.rows >= 0
+
+    #(player, gameweek) cells with a row, in gameweek and then row order
+    def played_cells(self, gameweek_ids=None):
+        if not self.index["gameweeks"]:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        columns = [g - 1 for g in (gameweek_ids or self.index["gameweeks"]) if 0 < g <= self.rows.shape[1]]
+        players, gameweeks = [], []
+        for column in sorted(columns):
+            present = np.flatnonzero(self.rows[:, column] >= 0)
+            order = np.argsort(self.rows[present, column], kind="stable")
+            players.append(present[order])
+            gameweeks.append(np.full(len(present), column))
+        if not players:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(players), np.concatenate(gameweeks)
+
+    #stat values of the given cells (a copy, only of the requested stats)
+    def values(self, players, gameweeks, stat):
+        if stat not in self.stat_index:
+            return np.zeros(len(players))
+        return self.stat(stat)[players, gameweeks]
+
+    def player_column(self, key, players):
+        return np.array([self.index["players"][p][key] for p in players], dtype=object)
+
+    def team_names(self, team_indexes):
+        teams = np.array(self.index["teams"], dtype=object)
+        return teams[team_indexes]
+
+    #same columns (and dtypes) as a frame built from the raw documents
+    def frame(self, gameweek_ids, stats):
+        players, gameweeks = self.played_cells(gameweek_ids)
+        columns = {
+            "player_id": np.array([self.index["players"][p]["player_id"] for p in players], dtype=np.int64),
+            "name": self.player_column("name", players),
+            "team": self.team_names(self.teams[players, gameweeks]),
+            "position_id": np.array([self.index["players"][p]["position_id"] for p in players], dtype=np.int64),
+            "gameweek": gameweeks + 1,
+        }
+        for stat, default in stats.items():
+            values = self.values(players, gameweeks, stat)
+            kind = self.index["kinds"].get(stat, stat_kind(default))
+            if kind == "bool":
+                values = values != 0
+            elif kind == "int":
+                values = values.astype(np.int64)
+            columns[stat] = values
+        return pd.DataFrame(columns)
+
+    #digest of one gameweek's cells, changes whenever a value of the gameweek changes
+    def gameweek_digest(self, gameweek_id):
+        players, gameweeks = self.played_cells([gameweek_id])
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.index["players"][p] for p in players]).encode("utf-8"))
+        digest.update(json.dumps(self.index["stats"]).encode("utf-8"))
+        digest.update(np.ascontiguousarray(self.team_names(self.teams[players, gameweeks])).astype(str).tobytes())
+        digest.update(np.ascontiguousarray(self.stats[players, gameweeks, :]).tobytes())
+        return digest.hexdigest()
+
+
+def read_index(path):
+    try:
+        with open(os.path.join(path, "index.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+#array files of older generations, readers that mapped them keep their mapping
+#a file still mapped on windows cannot be removed, it is tried again after the next swap
+def remove_stale_arrays(path, index):
+    current = {array_file(name, index.get("generation", 0)) for name in ARRAYS}
+    for file_name in os.listdir(path):
+        if file_name.endswith(".npy") and file_name not in current:
+            try:
+                os.remove(os.path.join(path, file_name))
+            except OSError:
+                pass
+
+def open_store(path=None, read_only=True):
+    return TensorStore(path, read_only=read_only)
+
+#used by the ingestion after each upload
+def append_gameweek_files(json_file_paths, path=None):
+    store = TensorStore(path)
+    gameweeks = store.append_files(json_file_paths)
+    print(f"Tensor store updated with gameweeks {gameweeks} {store.shape}")
+    return gameweeks
+
+#builds a new store next to the live one and switches to it, {gameweek: docs}
+#prepare(path) runs on the new store before the swap (e.g. its leaderboards)
+#the new arrays are moved in under a new generation and the index is replaced last, a single atomic rename,
+#so the live directory always holds a complete store: open memory maps keep reading the old files,
+#new readers open the new ones
+def replace_store(by_gameweek, path=None, prepare=None):
+    path = (path or TENSOR_PATH).rstrip(os.sep)
+    staging = path + ".staging"
+    shutil.rmtree(staging, ignore_errors=True)
+
+    live = read_index(path)
+    store = TensorStore(staging)
+    store.index["generation"] = (live or {}).get("generation", 0) + 1
+    for gameweek_id in sorted(by_gameweek):
+        store.append_gameweek(gameweek_id, by_gameweek[gameweek_id])
+    store.flush()
+    if prepare is not None:
+        prepare(staging)
+    shape = store.shape
+    store.close()
+
+    os.makedirs(path, exist_ok=True)
+    for file_name in os.listdir(staging):
+        if file_name != "index.json":
+            os.replace(os.path.join(staging, file_name), os.path.join(path, file_name))
+    os.replace(os.path.join(staging, "index.json"), os.path.join(path, "index.json"))
+
+    remove_stale_arrays(path, read_index(path))
+    shutil.rmtree(staging, ignore_errors=True)
+    print(f"Tensor store rebuilt with {len(by_gameweek)} gameweeks {shape}")
+    return path
+
+#rebuilds the store from every raw file
+if __name__ == "__main__":
+    raw_folder = os.path.join(current_dir, "raw")
+    files = [os.path.join(raw_folder, f) for f in os.listdir(raw_folder) if f.endswith(".json")]
+    append_gameweek_files(sorted(files))
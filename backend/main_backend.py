@@ -1,47 +1,59 @@
 #entire workflow for the backend in a single file/execution
-import os
-from data_layer.api_ingestion import data_extraction
-from data_layer.database import upload_to_mongo
-from algorithm.player_evaluator import calculate_metrics 
-from algorithm.season_evaluator import calculate_season_stats 
+import sys
+from data_layer.instrumentation import STAGES
+from data_layer.storage import ensure_indexes, close_storage
+from pipeline import run_pipeline
 
-def main():
-    #update just if there are new gameweeks
-    new_files_list = data_extraction() #creates the json of each gw 
-    
-    if len(new_files_list) == 0:
+#force recomputes analytics even when their input rows did not change
+#basic_data is a bootstrap already downloaded by the caller (watch mode), returns the gameweeks uploaded
+#profile_stage captures a stage with cProfile (data_extraction, upload_to_mongo, calculate_metrics...)
+#raise_on_failure raises when a gameweek failed, so the watcher runs the same events again
+def main(force=False, basic_data=None, profile_stage=None, raise_on_failure=False):
+    #idempotent, cheap when the indexes already exist
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
+    #each new gameweek is downloaded, uploaded and analysed as soon as the previous stage is done with it
+    #the season stats are updated once at the end, see pipeline.py
+    #timings, rows and memory of the run are written to data_layer/run_report.json and run_metrics.prom
+    result = run_pipeline(basic_data=basic_data, force=force, profile_stage=profile_stage)
+
+    if len(result["uploaded"]) == 0:
         print("There are no new gameweeks to update.")
-        return
+    if result["failed"] and raise_on_failure:
+        raise RuntimeError(f"Gameweeks {result['failed']} failed")
 
-    #to know if seasons stats must be update later
-    updates_made = False
+    return result["uploaded"]
 
-    for file_path in new_files_list:
-        #path to string
-        path_str = str(file_path)
-        
-        if os.path.exists(path_str):
-            
-            #upload the entire json of this gameweek
-            upload_to_mongo(path_str)
-            
-            try:
-                filename = os.path.basename(path_str)
-                #from gameweek_14.json to [gameweek, 14.json]
-                parts = filename.split('_')
-                number_with_extension = parts[1]
-                number_string = number_with_extension.replace('.json', '')
-                gw_id = int(number_string)
-                
-                #specific metrics of this gameweek
-                calculate_metrics(gw_id)
-                updates_made = True 
-                
-            except Exception as e:
-                print(f"Error calculating metrics for {filename}: {e}")
-    #seasons stats uploaded only if a new gameweek is detected/analysed
-    if updates_made:
-        calculate_season_stats()
+#python main_backend.py --profile calculate_metrics, None without --profile
+def profile_argument(argv):
+    if "--profile" not in argv:
+        return None
+    position = argv.index("--profile") + 1
+    stage = argv[position] if position < len(argv) else None
+    if stage not in STAGES:
+        raise ValueError(f"--profile needs one of {', '.join(STAGES)}")
+    return stage
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        if "--watch" in sys.argv:
+            #long running mode, see watcher.py
+            from watcher import run_watcher
+            run_watcher(force="--force" in sys.argv)
+        elif "--rebuild" in sys.argv:
+            #everything again from the raw files, see rebuild.py
+            from rebuild import rebuild
+            rebuild()
+        else:
+            try:
+                profile_stage = profile_argument(sys.argv)
+            except ValueError as e:
+                print(e)
+                sys.exit(2)
+            main(force="--force" in sys.argv, profile_stage=profile_stage)
+    finally:
+        #shared connections (mongo pool or sqlite) are closed once at the end of the run
+        close_storage()
\ No newline at end of file
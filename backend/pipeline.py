@@ -0,0 +1,304 @@
+#staged ingestion: download -> upload -> metrics, every gameweek moves to the next stage as soon as it is ready
+#stages run concurrently with bounded queues between them, so a backfill takes about as long as the slowest stage
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from data_layer import instrumentation
+from data_layer.api_ingestion import (OUT_PATH, MAX_WORKERS, get_session, get_bootstrap, pending_gameweeks,
+                                      build_maps, download_gameweek)
+from data_layer.storage import upload_to_mongo, publish_data_version
+from data_layer.tensor_store import append_gameweek_files
+from snapshots import publish_snapshot
+from algorithm.leaderboard import refresh_leaderboard
+from algorithm import player_evaluator
+from algorithm.player_evaluator import metrics_for_gameweek
+from algorithm.season_totals import update_season_incremental
+
+#workers per stage, downloads wait on the network, metrics on the cpu
+DOWNLOAD_WORKERS = int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", str(MAX_WORKERS)))
+UPLOAD_WORKERS = int(os.getenv("PIPELINE_UPLOAD_WORKERS", "2"))
+METRICS_WORKERS = int(os.getenv("PIPELINE_METRICS_WORKERS", "2"))
+
+#gameweeks waiting between two stages, a fast stage blocks instead of piling up work in memory
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+#end of the input, passed from stage to stage once all the workers of a stage are done
+DONE = object()
+
+#gameweeks uploaded whose metrics failed, analysed again by the next run (their file exists, so they are not pending)
+PENDING_PATH = os.getenv("PIPELINE_PENDING_PATH",
+                         os.path.join(os.path.dirname(instrumentation.REPORT_PATH), "pending_metrics.json"))
+
+
+#metrics pool of the staged run, its workers are spawned and all started before the stage threads
+#a forked worker would copy the locks the running threads hold at that moment
+def start_pool(workers):
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    #workers start on demand, one task per worker starts them all now
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    return pool
+
+
+class Stage:
+
+    def __init__(self, name, function, workers=1):
+        #function(item) returns the item for the next stage, None to drop it, raises to fail it
+        self.name = name
+        self.function = function
+        self.workers = max(int(workers), 1)
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    def stats(self):
+        return {"workers": self.workers, "processed": self.processed, "skipped": self.skipped,
+                "failed": self.failed, "busy_seconds": round(self.busy, 3)}
+
+
+class Pipeline:
+
+    def __init__(self, stages, queue_size=None, key=None):
+        self.stages = stages
+        self.queue_size = max(int(queue_size or QUEUE_SIZE), 1)
+        self.key = key or (lambda item: item)
+        self.lock = threading.Lock()
+        self.errors = {}
+
+    def work(self, stage, inbox, outbox, running):
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                #wake the next worker of this stage, the last one to leave tells the next stage
+                inbox.put(DONE)
+                with self.lock:
+                    running[stage.name] -= 1
+                    last = running[stage.name] == 0
+                if last:
+                    outbox.put(DONE)
+                return
+
+            start = time.perf_counter()
+            try:
+                result = stage.function(item)
+            except Exception as e:
+                #only this item stops here, the rest of the batch keeps flowing
+                with self.lock:
+                    stage.failed += 1
+                    stage.busy += time.perf_counter() - start
+                    self.errors[self.key(item)] = {"stage": stage.name, "error": str(e)}
+                print(f"Error in {stage.name} for {self.key(item)}: {e}")
+                continue
+
+            with self.lock:
+                stage.busy += time.perf_counter() - start
+                if result is None:
+                    stage.skipped += 1
+                else:
+                    stage.processed += 1
+            if result is not None:
+                outbox.put(result)
+
+    #runs every item through the stages, returns the items out of the last one and a report
+    def run(self, items):
+        start = time.perf_counter()
+        #the last queue only collects the results
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+        running = {stage.name: stage.workers for stage in self.stages}
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self.work, args=(stage, queues[i], queues[i + 1], running),
+                                          name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        #blocks while the first stage is full
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(DONE)
+
+        for thread in threads:
+            thread.join()
+
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is DONE:
+                break
+            results.append(item)
+
+        report = {
+            "wall_seconds": round(time.perf_counter() - start, 3),
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+            "failed": dict(self.errors)
+        }
+        return results, report
+
+
+#downloads, uploads and analyses the pending gameweeks, then updates the season once
+#every run is instrumented, see data_layer/instrumentation.py for the report and the profile mode
+#returns {"uploaded": [...], "updated": [...], "failed": [...], "report": {...}}
+#the analytics files as read api snapshots, a failure leaves the previous snapshot in place
+def publish_files(published):
+    try:
+        publish_snapshot(published.get("version") if published else None, player_evaluator.ANALYTICS_FOLDER)
+    except Exception as e:
+        print(f"Error publishing snapshot: {e}")
+
+def read_pending(path=None):
+    try:
+        with open(path or PENDING_PATH) as f:
+            return json.load(f)["gameweeks"]
+    except FileNotFoundError:
+        return []
+
+def write_pending(gameweeks, path=None):
+    instrumentation.write_atomic(path or PENDING_PATH, json.dumps({"gameweeks": sorted(gameweeks)}))
+
+def run_pipeline(basic_data=None, force=False, session=None, base_url=None, out_path=None,
+                 download_workers=None, upload_workers=None, metrics_workers=None, queue_size=None,
+                 profile_stage=None, report_path=None, prometheus_path=None, pending_path=None):
+    run = instrumentation.start_run(profile_stage)
+    try:
+        result = staged_run(basic_data, force, session, base_url, out_path, download_workers, upload_workers,
+                            metrics_workers, queue_size, run.profile_stage, pending_path)
+    finally:
+        report = instrumentation.finish_run(report_path, prometheus_path)
+    result["report"] = report
+    return result
+
+def staged_run(basic_data, force, session, base_url, out_path, download_workers, upload_workers, metrics_workers,
+               queue_size, profile_stage, pending_path=None):
+    out_path = out_path or OUT_PATH
+    session = session or get_session()
+    result = {"uploaded": [], "updated": [], "failed": [], "report": None}
+
+    #make sure that output path exists
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    if basic_data is None:
+        print("Getting Bootstrap...")
+        with instrumentation.stage("data_extraction"):
+            basic_data = get_bootstrap(session=session, base_url=base_url)
+    if not basic_data:
+        return result
+
+    missing = pending_gameweeks(basic_data, out_path)
+    #uploaded by an earlier run whose metrics failed, they only go through the metrics stage
+    retry = sorted(set(read_pending(pending_path)) - {gw["id"] for gw in missing})
+    if not missing and not retry:
+        return result
+
+    player_map, team_map = build_maps(basic_data)
+    workers = {
+        "data_extraction": download_workers or DOWNLOAD_WORKERS,
+        "upload_to_mongo": upload_workers or UPLOAD_WORKERS,
+        "calculate_metrics": metrics_workers or METRICS_WORKERS
+    }
+    #cProfile follows one thread, the profiled stage runs on one worker and the metrics in this process
+    if profile_stage in workers:
+        workers[profile_stage] = 1
+    #the tensor store has a single writer
+    tensor_lock = threading.Lock()
+    uploaded = []
+
+    def download(item):
+        if item.get("retry"):
+            return item
+        with instrumentation.stage("data_extraction", item["gameweek"]):
+            path = download_gameweek(item["event"], player_map, team_map, session, base_url, out_path)
+            if not path:
+                raise RuntimeError("download failed")
+        item["path"] = path
+        return item
+
+    def upload(item):
+        if item.get("retry"):
+            return item
+        with instrumentation.stage("upload_to_mongo", item["gameweek"]):
+            #without its file the gameweek is downloaded again on the next run
+            #mongo returns None on a failed upload, sqlite raises
+            try:
+                if upload_to_mongo(item["path"]) is None:
+                    raise RuntimeError("upload failed")
+            except Exception:
+                os.remove(item["path"])
+                raise
+
+            #columnar copy used by the tensor engines, the documents stay the source of truth
+            with tensor_lock:
+                try:
+                    append_gameweek_files([item["path"]])
+                except Exception as e:
+                    print(f"Error updating tensor store: {e}")
+        uploaded.append(item["gameweek"])
+        return item
+
+    metrics_workers = workers["calculate_metrics"]
+    in_process = metrics_workers <= 1 or profile_stage == "calculate_metrics"
+    pool = None if in_process else start_pool(metrics_workers)
+
+    def metrics(item):
+        with instrumentation.stage("calculate_metrics", item["gameweek"]):
+            summary = metrics_for_gameweek(item["gameweek"], force=force, pool=pool)
+        if summary is None:
+            return None
+        item["summary"] = summary
+        return item
+
+    pipeline = Pipeline([
+        Stage("download", download, workers["data_extraction"]),
+        Stage("upload", upload, workers["upload_to_mongo"]),
+        Stage("metrics", metrics, metrics_workers)
+    ], queue_size=queue_size, key=lambda item: item["gameweek"])
+
+    try:
+        items = [{"gameweek": gw["id"], "event": gw} for gw in missing]
+        items += [{"gameweek": gameweek, "retry": True} for gameweek in retry]
+        done, report = pipeline.run(items)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    result["uploaded"] = sorted(uploaded)
+    result["updated"] = sorted(item["gameweek"] for item in done)
+    #failed downloads and uploads leave no file, the next run downloads them again
+    #failed metrics are kept in the pending file, the next run analyses them again
+    result["failed"] = sorted(report["failed"])
+    write_pending([gw for gw, error in report["failed"].items() if error["stage"] == "metrics"], pending_path)
+    instrumentation.annotate(pipeline=report)
+
+    stages = ", ".join(f"{name} {stats['busy_seconds']}s" for name, stats in report["stages"].items())
+    print(f"Pipeline finished in {report['wall_seconds']}s ({stages}), {len(report['failed'])} gameweeks failed")
+
+    if result["uploaded"]:
+        #sorted once here so the web app only slices them
+        try:
+            refresh_leaderboard()
+        except Exception as e:
+            print(f"Error updating leaderboards: {e}")
+
+    #season totals once at the end, with every gameweek uploaded or analysed in this run
+    #a gameweek folded before its summary exists is folded again (a rebuild) once it is analysed
+    season = None
+    folded = sorted(set(result["uploaded"]) | set(result["updated"]))
+    if folded:
+        with instrumentation.stage("calculate_season_stats"):
+            season = update_season_incremental(folded)
+
+    #tells the web app that its cached pages are stale
+    if result["uploaded"] or result["updated"]:
+        last_gameweek = season["last_updated_gw"] if season else max(result["uploaded"] + result["updated"])
+        published = publish_data_version(last_gameweek)
+        publish_files(published)
+
+    return result
@@ -0,0 +1,114 @@
+#full rebuild/backfill from the raw gameweek files, replaces the database content in one swap
+#run: python rebuild.py   (or python main_backend.py --rebuild)
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from data_layer import instrumentation
+from data_layer.api_ingestion import OUT_PATH
+from data_layer.database import load_player_docs
+from data_layer.storage import replace_all, publish_data_version, close_storage
+from data_layer.tensor_store import replace_store
+from snapshots import publish_snapshot
+from algorithm import player_evaluator
+from algorithm.leaderboard import refresh_leaderboard
+from algorithm.player_evaluator import (METRICS_WORKERS, gameweek_digests, gameweek_tasks, summarise_tasks,
+                                        write_summary_file)
+from algorithm.season_evaluator import summaries_digest, write_season_file
+from algorithm.season_totals import empty_totals, fold_gameweek, summary_from_totals
+
+REBUILD_WORKERS = int(os.getenv("REBUILD_WORKERS", str(METRICS_WORKERS)))
+
+
+def raw_files(raw_path=None):
+    files = glob.glob(os.path.join(raw_path or OUT_PATH, "gameweek_*.json"))
+    #gameweek order, the row order the rest of the backend expects
+    return sorted(files, key=lambda p: int(os.path.basename(p).split('_')[1].replace('.json', '')))
+
+#parses the files on a process pool, json decoding does not release the gil
+def load_raw_docs(paths, workers=None):
+    workers = workers or REBUILD_WORKERS
+    if workers <= 1 or len(paths) <= 1:
+        loaded = [load_player_docs(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            loaded = list(pool.map(load_player_docs, paths))
+
+    docs = []
+    for file_docs in loaded:
+        docs.extend(file_docs)
+    return docs
+
+#every summary and the season computed in memory from the raw documents, nothing is read back from the database
+def build_all(docs, workers=None):
+    by_gameweek = {}
+    for doc in docs:
+        by_gameweek.setdefault(doc["gameweek"], []).append(doc)
+
+    with instrumentation.stage("calculate_metrics"):
+        digests = gameweek_digests(docs)
+        summaries = summarise_tasks(gameweek_tasks(docs), workers or REBUILD_WORKERS)
+        for summary in summaries:
+            summary["input_digest"] = digests[summary["gameweek"]]
+        instrumentation.count(rows=len(docs))
+
+    with instrumentation.stage("calculate_season_stats"):
+        mvps = {summary["gameweek"]: summary.get("mvp", {}).get("name") for summary in summaries}
+        totals = empty_totals()
+        for gameweek_id in sorted(by_gameweek):
+            fold_gameweek(totals, gameweek_id, by_gameweek[gameweek_id], mvps.get(gameweek_id))
+        season_summary = summary_from_totals(totals)
+        season_summary["input_digest"] = summaries_digest(digests)
+
+    return by_gameweek, summaries, season_summary, totals
+
+#reads every raw file, computes everything, then swaps the new content in
+#readers keep seeing the previous content until the swap
+def rebuild(raw_path=None, workers=None, report_path=None, prometheus_path=None):
+    paths = raw_files(raw_path)
+    if not paths:
+        print(f"No raw files found in {raw_path or OUT_PATH}")
+        return None
+
+    instrumentation.start_run()
+    try:
+        with instrumentation.stage("data_extraction"):
+            docs = load_raw_docs(paths, workers)
+            instrumentation.count(rows=len(docs), bytes=sum(os.path.getsize(path) for path in paths))
+        print(f"Loaded {len(docs)} rows from {len(paths)} files")
+
+        by_gameweek, summaries, season_summary, totals = build_all(docs, workers)
+
+        with instrumentation.stage("upload_to_mongo"):
+            counts = replace_all(docs, summaries, season_summary, totals)
+        print(f"Database content replaced: {counts}")
+
+        #the columnar copy and its leaderboards are swapped the same way
+        try:
+            replace_store(by_gameweek, prepare=refresh_leaderboard)
+        except Exception as e:
+            print(f"Error rebuilding tensor store: {e}")
+
+        #the json copies are written once the database holds the same content
+        for summary in summaries:
+            write_summary_file(summary)
+        write_season_file(season_summary)
+
+        #tells the web app that its cached pages are stale, and gives it the new files to serve
+        published = publish_data_version(season_summary["last_updated_gw"])
+        try:
+            publish_snapshot(published.get("version") if published else None, player_evaluator.ANALYTICS_FOLDER)
+        except Exception as e:
+            print(f"Error publishing snapshot: {e}")
+    finally:
+        report = instrumentation.finish_run(report_path, prometheus_path)
+
+    print(f"Rebuild finished in {report['wall_seconds']}s")
+    return {"gameweeks": sorted(by_gameweek), "counts": counts, "report": report}
+
+if __name__ == "__main__":
+    try:
+        rebuild()
+    finally:
+        close_storage()
@@ -0,0 +1,151 @@
+#read api snapshots: the analytics json files published as ready-to-send responses, served by the web app from disk
+#every publication is a new versioned directory, the `current` pointer file is swapped to it in one rename
+#run: python snapshots.py   (publishes the files currently in data_layer/analytics)
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime, timezone
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+ANALYTICS_FOLDER = os.path.join(current_dir, "data_layer", "analytics")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(current_dir, "data_layer", "snapshots"))
+KEEP_SNAPSHOTS = int(os.getenv("SNAPSHOT_KEEP", "3"))      #previous versions kept for the readers still sending them
+
+CURRENT = "current"
+MANIFEST = "manifest.json"
+
+
+#same body as the api: the documents without their _id
+def response_body(doc):
+    doc = dict(doc)
+    doc.pop("_id", None)
+    return json.dumps(doc, separators=(",", ":")).encode("utf-8")
+
+def read_analytics(folder):
+    summaries = []
+    for path in glob.glob(os.path.join(folder, "analytics_gw_*.json")):
+        with open(path) as f:
+            summaries.append(json.load(f))
+    summaries.sort(key=lambda summary: summary.get("gameweek", 0))
+
+    season = {}
+    season_path = os.path.join(folder, "season_overview.json")
+    if os.path.exists(season_path):
+        with open(season_path) as f:
+            season = json.load(f)
+    return summaries, season
+
+#{name: body} of every response in the snapshot
+def snapshot_bodies(summaries, season):
+    bodies = {
+        "gameweeks": json.dumps([json.loads(response_body(s)) for s in summaries],
+                                separators=(",", ":")).encode("utf-8"),
+        "season": response_body(season),
+    }
+    for summary in summaries:
+        bodies[f"gameweek_{summary['gameweek']}"] = response_body(summary)
+    return bodies
+
+def write_snapshot(directory, bodies, version):
+    files = {}
+    for name, body in bodies.items():
+        with open(os.path.join(directory, name + ".json"), "wb") as f:
+            f.write(body)
+        #mtime=0 so the same content always gives the same bytes
+        with open(os.path.join(directory, name + ".json.gz"), "wb") as f:
+            f.write(gzip.compress(body, compresslevel=9, mtime=0))
+        files[name] = {"etag": hashlib.sha256(body).hexdigest()[:20], "size": len(body)}
+
+    manifest = {"version": version, "published_at": datetime.now(timezone.utc).isoformat(), "files": files}
+    with open(os.path.join(directory, MANIFEST), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+#repoints `current` with a rename over the old pointer, readers get either the old or the new directory
+#a file holding the name and not a symlink: creating a symlink needs extra privileges on windows
+def swap_current(path, name):
+    pointer = os.path.join(path, CURRENT)
+    tmp_pointer = pointer + ".tmp"
+    with open(tmp_pointer, "w") as f:
+        f.write(name)
+    os.replace(tmp_pointer, pointer)
+
+#name of the current directory, None if nothing was published
+#a `current` symlink left by an older publication is still followed until the next swap replaces it
+def read_current(path):
+    pointer = os.path.join(path, CURRENT)
+    try:
+        if os.path.islink(pointer):
+            return os.readlink(pointer)
+        with open(pointer) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def prune_snapshots(path, keep=None):
+    keep = KEEP_SNAPSHOTS if keep is None else keep
+    current = read_current(path)
+    names = sorted(name for name in os.listdir(path) if name.startswith("v") and name != current
+                   and os.path.isdir(os.path.join(path, name)))
+    #an open file stays readable after its directory is removed, a response being sent is not cut
+    for name in names[:max(len(names) - keep, 0)]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def publish_snapshot(version=None, folder=None, path=None):
+    folder = folder or ANALYTICS_FOLDER
+    path = path or SNAPSHOT_PATH
+    os.makedirs(path, exist_ok=True)
+
+    summaries, season = read_analytics(folder)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    name = f"v{version or 0:06d}-{stamp}"
+
+    #written under a hidden name, renamed once complete
+    staging = os.path.join(path, "." + name)
+    os.makedirs(staging)
+    try:
+        manifest = write_snapshot(staging, snapshot_bodies(summaries, season), version)
+        os.rename(staging, os.path.join(path, name))
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    swap_current(path, name)
+    prune_snapshots(path)
+    print(f"Snapshot {name} published ({len(manifest['files'])} responses)")
+    return name
+
+
+_current = {}
+_current_lock = threading.Lock()
+
+#(directory, manifest) of the current snapshot, None if nothing was published
+#the manifest is only re-read when the pointer names a new directory
+def current_snapshot(path=None):
+    path = path or SNAPSHOT_PATH
+    name = read_current(path)
+    if name is None:
+        return None
+
+    cached = _current.get(path)
+    if cached is not None and cached[0] == name:
+        return cached[1], cached[2]
+
+    with _current_lock:
+        directory = os.path.join(path, name)
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Snapshot error: {e}")
+            return None
+        _current[path] = (name, directory, manifest)
+    return directory, manifest
+
+if __name__ == "__main__":
+    publish_snapshot(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,201 @@
+#long running mode of the backend: polls the fpl events and runs the pipeline when a gameweek is verified
+#run: python main_backend.py --watch   (or python watcher.py)
+import hashlib
+import json
+import os
+import signal
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+from data_layer.api_ingestion import get_bootstrap_if_changed, get_session
+
+#poll intervals in seconds
+FAST_INTERVAL = int(os.getenv("WATCH_FAST_INTERVAL", "60"))        #around deadlines and verifications
+MEDIUM_INTERVAL = int(os.getenv("WATCH_MEDIUM_INTERVAL", "600"))   #gameweek being played
+SLOW_INTERVAL = int(os.getenv("WATCH_SLOW_INTERVAL", "21600"))     #between gameweeks
+
+#how close to a deadline polling becomes fast
+DEADLINE_WINDOW = timedelta(hours=int(os.getenv("WATCH_DEADLINE_WINDOW_HOURS", "2")))
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+STATUS_FILE = os.getenv("WATCH_STATUS_FILE", os.path.join(current_dir, "data_layer", "watch_status.json"))
+
+
+def parse_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+#what the pipeline depends on: which gameweeks are finished and verified
+def events_digest(basic_data):
+    events = [(e["id"], e.get("finished"), e.get("data_checked")) for e in basic_data.get("events", [])]
+    return hashlib.sha256(json.dumps(events).encode("utf-8")).hexdigest()
+
+#seconds until the next poll, from the state of the events
+def next_interval(events, now=None):
+    now = now or utc_now()
+    near_deadline = False
+    playing = False
+    upcoming = None
+
+    for event in events:
+        #finished but not verified yet, data_checked can flip any minute
+        if event.get("finished") and not event.get("data_checked"):
+            near_deadline = True
+
+        deadline = parse_time(event.get("deadline_time"))
+        if deadline is None:
+            continue
+        if abs(deadline - now) <= DEADLINE_WINDOW:
+            near_deadline = True
+        elif deadline < now and not event.get("finished"):
+            #deadline passed and not finished: the gameweek is being played
+            playing = True
+        elif deadline > now and (upcoming is None or deadline < upcoming):
+            upcoming = deadline
+
+    if near_deadline:
+        return FAST_INTERVAL
+    if playing:
+        return MEDIUM_INTERVAL
+    if upcoming is None:
+        return SLOW_INTERVAL
+    #sleep until the fast window of the next deadline opens
+    until_window = (upcoming - DEADLINE_WINDOW - now).total_seconds()
+    return int(max(FAST_INTERVAL, min(SLOW_INTERVAL, until_window)))
+
+def write_status(status, path=None):
+    path = path or STATUS_FILE
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(status, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+def read_status(path=None):
+    try:
+        with open(path or STATUS_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class Watcher:
+
+    def __init__(self, process=None, fetch=None, status_path=None, force=False, pending=None):
+        #process(basic_data) runs the pipeline, main_backend.main by default
+        #pending() lists the gameweeks uploaded but not analysed yet, the pipeline pending file by default
+        if process is None:
+            from main_backend import main
+            from pipeline import read_pending
+            #a run with failed gameweeks raises: the digest is not kept and the next poll runs it again
+            process = lambda basic_data: main(force=force, basic_data=basic_data, raise_on_failure=True)
+            pending = pending or read_pending
+        self.process = process
+        self.pending = pending or (lambda: [])
+        self.fetch = fetch or (lambda validators: get_bootstrap_if_changed(validators, session=get_session()))
+        self.status_path = status_path or STATUS_FILE
+        self.stop_event = threading.Event()
+
+        self.validators = {}
+        self.digest = None
+        self.events = []
+        self.errors = 0
+        self.status = {
+            "pid": os.getpid(),
+            "state": "starting",
+            "started_at": utc_now().isoformat(),
+            "polls": 0,
+            "not_modified": 0,
+            "runs": 0,
+            "last_poll": None,
+            "last_change": None,
+            "last_run": None,
+            "last_gameweeks": [],
+            "last_error": None,
+            "interval": None,
+            "next_poll": None
+        }
+
+    def update_status(self, **changes):
+        self.status.update(changes)
+        write_status(self.status, self.status_path)
+
+    #one poll, returns the seconds to wait before the next one
+    def poll_once(self):
+        self.update_status(state="polling")
+        try:
+            status_code, basic_data, validators = self.fetch(self.validators)
+            self.status["polls"] += 1
+            self.status["last_poll"] = utc_now().isoformat()
+
+            if basic_data is None:
+                self.status["not_modified"] += 1
+            else:
+                self.events = basic_data.get("events", [])
+                digest = events_digest(basic_data)
+                #prices and news change the bootstrap all the time, only the events matter here
+                if digest != self.digest:
+                    self.status["last_change"] = utc_now().isoformat()
+                    self.update_status(state="processing")
+                    gameweeks = self.process(basic_data) or []
+                    self.digest = digest
+                    self.status["runs"] += 1
+                    self.status["last_run"] = utc_now().isoformat()
+                    self.status["last_gameweeks"] = list(gameweeks)
+
+            #only kept once processed, a failed run gets the full bootstrap again next time
+            #same while gameweeks wait for their metrics: the next poll runs the pipeline with the same events
+            if self.pending():
+                self.digest = None
+            else:
+                self.validators = validators
+            self.errors = 0
+            self.status["last_error"] = None
+            interval = next_interval(self.events)
+
+        except Exception as e:
+            #back off on repeated failures, the run is retried on the next poll
+            self.errors += 1
+            print(f"Watch error: {e}")
+            self.status["last_error"] = str(e)
+            interval = min(SLOW_INTERVAL, FAST_INTERVAL * 2 ** self.errors)
+
+        next_poll = utc_now() + timedelta(seconds=interval)
+        self.update_status(state="idle", interval=interval, next_poll=next_poll.isoformat())
+        return interval
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    #polls until stop() (or SIGTERM/SIGINT), a run in progress is finished before exiting
+    def run(self, max_polls=None):
+        polls = 0
+        while not self.stop_event.is_set():
+            interval = self.poll_once()
+            polls += 1
+            if max_polls is not None and polls >= max_polls:
+                break
+            self.stop_event.wait(interval)
+        self.update_status(state="stopped", next_poll=None)
+
+def run_watcher(force=False):
+    watcher = Watcher(force=force)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    print(f"Watching FPL events, status in {watcher.status_path}")
+    watcher.run()
+    print("Watcher stopped")
+
+if __name__ == "__main__":
+    from data_layer.storage import close_storage
+    try:
+        run_watcher(force="--force" in sys.argv)
+    finally:
+        close_storage()
@@ -1,56 +1,81 @@
 # app.py
 import os
-from flask import Flask, render_template, jsonify, request, abort
-from pymongo import MongoClient
+import sys
+import time
+from flask import Flask, Blueprint, current_app, render_template, jsonify, request, abort
 from dotenv import load_dotenv
 
 load_dotenv()
 
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("DB_NAME")
-RAW_COLL = os.getenv("COLLECTION")          # raw player-by-gw collection
-ANALYTICS_COLL = os.getenv("ANALYTICS_COLL")# analytics per-gameweek collection
-SEASON_COLL = os.getenv("SEASON_COLL")      # season summary collection
+#backend modules (storage backend shared with the pipeline)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+from data_layer.storage import get_storage
+from algorithm.form_engine import get_form_engine, DEFAULT_WINDOW, DEFAULT_TOP_K
+from algorithm.leaderboard import get_leaderboard
+from algorithm.player_search import get_player_search, DEFAULT_LIMIT
+from algorithm.player_compare import compare_players, parse_ids, parse_stats
+from watcher import read_status
+from response_cache import cached, data_version
+from snapshot_server import snapshot
+from json_stream import page_args, stream_page
 
-if not MONGO_URI:
-    raise RuntimeError("Set MONGO_URI in .env")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+#columns of the players table of the gameweek page, the rest of the statistics is not read
+GAMEWEEK_PAGE_FIELDS = ["player_id", "name", "team", "statistics.minutes", "statistics.total_points",
+                        "statistics.goals_scored"]
+PLAYERS_PER_PAGE = int(os.getenv("PLAYERS_PER_PAGE", "100"))
+#pages rendered into the response cache when a worker starts, before its first request
+WARM_PATHS = ["/api/season", "/api/gameweeks", "/season", "/gameweeks", "/players"]
 
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+if STORAGE_BACKEND == "mongo" and not os.getenv("MONGO_URI"):
+    raise RuntimeError("Set MONGO_URI in .env")
 
-app = Flask(__name__, static_folder="static", template_folder="templates")
+#routes of the app, registered on each app built by create_app
+bp = Blueprint("fpl", __name__)
 
 
 # ---------- Utility helpers ----------
-def safe_find_one(coll_name, query):
+#search index of the published data, rebuilt when the backend publishes a new version
+def player_search():
     try:
-        coll = db[coll_name]
-        doc = coll.find_one(query, projection={"_id": False})
-        return doc
+        version = data_version.get()["etag"]
     except Exception as e:
-        print("DB error:", e)
-        return None
+        print(f"Data version error: {e}")
+        version = None
+    return get_player_search(version)
 
-def safe_find_many(coll_name, query={}, limit=0):
+#numeric id, or the id of the player whose name best matches the text (None if nothing matches)
+def resolve_player_id(player_id):
     try:
-        coll = db[coll_name]
-        cursor = coll.find(query, projection={"_id": False})
-        if limit:
-            cursor = cursor.limit(limit)
-        return list(cursor)
-    except Exception as e:
-        print("DB error:", e)
-        return []
+        return int(player_id)
+    except ValueError:
+        player = player_search().best_match(player_id)
+        return player["_id"] if player else None
+
+#players document with the totals and gameweek series of the player page, None if unknown
+def player_doc(player_id):
+    player_id = resolve_player_id(player_id)
+    if player_id is None:
+        return None
+    return get_storage().fetch_player(player_id)
+
+def gameweek_summary(gw):
+    summary = get_storage().fetch_gameweek_summary(gw)
+    if summary:
+        summary.pop("_id", None)
+    return summary
 
 
 # ---------- Frontend pages ----------
+#@cached views are served from the response cache until the backend publishes new data
 # in app.py - update the dashboard route
-@app.route("/")
+@bp.route("/")
+@cached
 def dashboard():
     # for loading season summary
-    season = safe_find_one(SEASON_COLL, {})
+    season = get_storage().fetch_season()
     # this is to get list of analytics (gameweeks) for summary cards
-    analytics = safe_find_many(ANALYTICS_COLL, {}, limit=50)
+    analytics = get_storage().fetch_gameweek_summaries(limit=50)
     # sort by gameweek if present
     analytics_sorted = sorted(
     analytics,
@@ -69,85 +94,190 @@ def dashboard():
                            recent=recent_gws)
 
 
-@app.route("/gameweek/<int:gw>")
+@bp.route("/gameweek/<int:gw>")
+@cached
 def gameweek_page(gw):
-    summary = safe_find_one(ANALYTICS_COLL, {"gameweek": gw})
+    summary = gameweek_summary(gw)
     if not summary:
         abort(404, f"No summary for gameweek {gw}")
     # for convenience, also load top players raw for that gw from raw collection
-    players = safe_find_many(RAW_COLL, {"gameweek": gw})
+    players = get_storage().fetch_gameweek_players(gw, fields=GAMEWEEK_PAGE_FIELDS)
     return render_template("gameweek.html", gw=gw, summary=summary, players=players)
 
 
-@app.route("/player/<player_id>")
+@bp.route("/player/<player_id>")
+@cached
 def player_page(player_id):
     # player_id may be numeric or string; search by player_id or name
-    try:
-        pid = int(player_id)
-        query = {"player_id": pid}
-    except:
-        query = {"name": {"$regex": player_id, "$options": "i"}}
-    # fetch all gw records for player
-    records = safe_find_many(RAW_COLL, query)
-    if not records:
+    # one read of the players document, its series is kept in gameweek order by the ingestion
+    player = player_doc(player_id)
+    if not player:
         abort(404, "Player not found")
-    # sort records by gameweek
-    records_sorted = sorted(records, key=lambda x: x.get("gameweek", 0))
-    # build simple series for chart (points per gw)
-    series = []
-    for r in records_sorted:
-        stats = r.get("statistics", {})
-        series.append({
-            "gw": r.get("gameweek"),
-            "name": r.get("name"),
-            "points": stats.get("total_points", 0),
-            "minutes": stats.get("minutes", 0)
-        })
-    return render_template("player.html", records=records_sorted, series=series)
-
-
-@app.route("/season")
+    return render_template("player.html", player=player)
+
+
+@bp.route("/season")
+@cached
 def season_page():
-    season = safe_find_one(SEASON_COLL, {})
+    season = get_storage().fetch_season()
     if not season:
         abort(404, "Season summary not found")
     return render_template("season.html", season=season)
 
 
 # ---------- JSON API endpoints (optional for AJAX) ----------
-@app.route("/api/gameweeks")
+#@snapshot views are sent from the published files in snapshot mode (SERVE_SNAPSHOTS=1)
+@bp.route("/api/gameweeks")
+@snapshot("gameweeks")
+@cached
 def api_gameweeks():
-    analytics = safe_find_many(ANALYTICS_COLL)
-    return jsonify(analytics)
+    try:
+        args, format = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    docs, following = get_storage().gameweek_summaries_page(**args)
+    return stream_page(docs, following, format)
 
 
-@app.route("/api/gameweek/<int:gw>")
+@bp.route("/api/gameweek/<int:gw>")
+@snapshot("gameweek_{gw}")
+@cached
 def api_gameweek(gw):
-    summary = safe_find_one(ANALYTICS_COLL, {"gameweek": gw})
+    summary = gameweek_summary(gw)
     if not summary:
         return jsonify({"error": "not found"}), 404
     return jsonify(summary)
 
 
-@app.route("/api/player/<player_id>")
+@bp.route("/api/player/<player_id>")
+@cached
 def api_player(player_id):
     try:
-        pid = int(player_id)
-        query = {"player_id": pid}
-    except:
-        query = {"name": {"$regex": player_id, "$options": "i"}}
-    records = safe_find_many(RAW_COLL, query)
-    return jsonify(records)
+        args, format = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    player_id = resolve_player_id(player_id)
+    if player_id is None:
+        return stream_page([], None, format)
+    docs, following = get_storage().player_records_page(player_id, **args)
+    return stream_page(docs, following, format)
 
 
-@app.route("/api/season")
+#gameweek series and season totals of a player, the full records are paged by /api/player/<player_id>
+@bp.route("/api/player/<player_id>/series")
+@cached
+def api_player_series(player_id):
+    player = player_doc(player_id)
+    if not player:
+        return jsonify({"error": "not found"}), 404
+    player.pop("_id", None)
+    return jsonify(player)
+
+
+@bp.route("/api/season")
+@snapshot("season")
+@cached
 def api_season():
-    season = safe_find_one(SEASON_COLL, {})
+    season = get_storage().fetch_season()
     return jsonify(season or {})
 
-@app.route("/gameweeks")
+#top players over the last `window` gameweeks, e.g. /api/form?stat=goals_scored&window=5&position=fwd
+@bp.route("/api/form")
+@cached
+def api_form():
+    try:
+        result = get_form_engine().top(
+            request.args.get("stat", "total_points"),
+            window=request.args.get("window", DEFAULT_WINDOW, type=int),
+            k=request.args.get("k", DEFAULT_TOP_K, type=int),
+            position=request.args.get("position"),
+            end=request.args.get("end", type=int),
+            per_match=request.args.get("per_match", "false").lower() in ("1", "true", "yes")
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "form data not available"}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+#season leaderboards, precomputed for every stat
+@bp.route("/api/leaderboard")
+@cached
+def api_leaderboards():
+    try:
+        leaderboard = get_leaderboard()
+    except FileNotFoundError:
+        return jsonify({"error": "leaderboards not available"}), 503
+    return jsonify({"stats": leaderboard.stats, "groups": leaderboard.groups,
+                    "gameweeks": leaderboard.meta["gameweeks"]})
+
+#e.g. /api/leaderboard/goals_scored?k=10&position=fwd or ?team=Arsenal
+@bp.route("/api/leaderboard/<stat>")
+@cached
+def api_leaderboard(stat):
+    try:
+        result = get_leaderboard().top(
+            stat,
+            k=request.args.get("k", DEFAULT_TOP_K, type=int),
+            position=request.args.get("position"),
+            team=request.args.get("team"),
+            offset=request.args.get("offset", 0, type=int)
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "leaderboards not available"}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@bp.route("/api/leaderboard/<stat>/player/<int:player_id>")
+@cached
+def api_leaderboard_rank(stat, player_id):
+    try:
+        result = get_leaderboard().rank(player_id, stat)
+    except FileNotFoundError:
+        return jsonify({"error": "leaderboards not available"}), 503
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(result)
+
+#players side by side, e.g. /api/players/compare?ids=328,351&stats=goals_scored,assists&from_gw=1&to_gw=8
+@bp.route("/api/players/compare")
+@cached
+def api_players_compare():
+    try:
+        from_gw, to_gw = (request.args.get(name) for name in ("from_gw", "to_gw"))
+        result = compare_players(
+            parse_ids(request.args.getlist("ids")),
+            parse_stats(request.args.get("stats")),
+            int(from_gw) if from_gw not in (None, "") else None,
+            int(to_gw) if to_gw not in (None, "") else None
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+#autocomplete, e.g. /api/search?q=odeg&limit=5 -> players ranked by how well their name matches
+#answered from memory, so it skips the response cache
+@bp.route("/api/search")
+def api_search():
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    return jsonify(player_search().search(query, limit))
+
+#state of the backend running in watch mode (python main_backend.py --watch)
+@bp.route("/api/pipeline/status")
+def api_pipeline_status():
+    status = read_status()
+    if status is None:
+        return jsonify({"state": "not running"}), 404
+    return jsonify(status)
+
+@bp.route("/gameweeks")
+@cached
 def gameweeks():
-    analytics = safe_find_many(ANALYTICS_COLL)
+    analytics = get_storage().fetch_gameweek_summaries()
     analytics_sorted = sorted(
         analytics,
         key=lambda x: x.get("gameweek", 0),
@@ -155,19 +285,85 @@ def gameweeks():
     )
     return render_template("gameweeks.html", analytics=analytics_sorted)
 
-@app.route("/players")
+@bp.route("/players")
+@cached
 def players_page():
-    # get one record per player 
-    players = db[RAW_COLL].aggregate([
-        {"$group": {
-            "_id": "$player_id",
-            "name": {"$first": "$name"},
-            "team": {"$first": "$team"}
-        }},
-        {"$sort": {"name": 1}}
-    ])
-
-    return render_template("players.html", players=list(players))
+    # one document per player from the materialised directory, one page at a time
+    page = max(request.args.get("page", 1, type=int), 1)
+    total = get_storage().count_players()
+    pages = max((total + PLAYERS_PER_PAGE - 1) // PLAYERS_PER_PAGE, 1)
+    if page > pages:
+        abort(404, "Page not found")
+    players = get_storage().fetch_players_directory(skip=(page - 1) * PLAYERS_PER_PAGE, limit=PLAYERS_PER_PAGE)
+
+    return render_template("players.html", players=players, page=page, pages=pages, total=total)
+
+
+# ---------- Health ----------
+#liveness: the worker answers, nothing else is checked
+@bp.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+#readiness: the storage answers and the caches of this worker are warm
+@bp.route("/readyz")
+def readyz():
+    checks = {"pid": os.getpid(), "warmed_in": current_app.config["WARMED_IN"]}
+    ready = current_app.config["WARMED_IN"] is not None or not current_app.config["WARM_CACHES"]
+    try:
+        get_storage().ping()
+        checks["storage"] = "ok"
+    except Exception as e:
+        checks["storage"] = str(e)
+        ready = False
+    try:
+        checks["data_version"] = data_version.get()["version"]
+    except Exception as e:
+        checks["data_version"] = None
+        ready = False
+    checks["status"] = "ready" if ready else "not ready"
+    return jsonify(checks), 200 if ready else 503
+
+
+# ---------- App factory ----------
+#per-process caches filled before the worker takes requests: the data version, the players search index
+#(the whole players directory) and the pages of WARM_PATHS (season, gameweek list, first players page)
+def warm_caches(app):
+    started = time.perf_counter()
+    player_search()
+    with app.test_client() as client:
+        for path in WARM_PATHS:
+            response = client.get(path)
+            #the cache keeps streamed bodies once they are read to the end
+            response.get_data()
+            if response.status_code != 200:
+                print(f"Warm-up of {path}: {response.status_code}")
+    return time.perf_counter() - started
+
+#builds the app, called by the server in each worker (see gunicorn.conf.py), so the mongo client,
+#sqlite connections and caches are created after the fork and belong to that worker
+def create_app(warm=True):
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+    app.register_blueprint(bp)
+    app.config["WARM_CACHES"] = warm
+    app.config["WARMED_IN"] = None
+    if not warm:
+        return app
+
+    try:
+        get_storage().ensure_indexes()
+    except Exception as e:
+        print("Index creation error:", e)
+    try:
+        app.config["WARMED_IN"] = round(warm_caches(app), 3)
+        print(f"Worker {os.getpid()} warmed in {app.config['WARMED_IN']}s")
+    except Exception as e:
+        print(f"Warm-up error: {e}")
+    return app
+
+#module level app for the tests and imports, without warm-up
+#servers build their own with create_app(): gunicorn -c gunicorn.conf.py, see the README
+app = create_app(warm=False)
 
 if __name__ == "__main__":
-    app.run(debug=True, port=int(os.getenv("PORT", 5000)))
\ No newline at end of file
+    create_app().run(debug=True, port=int(os.getenv("PORT", 5000)))
\ No newline at end of file
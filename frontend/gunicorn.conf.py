@@ -0,0 +1,28 @@
+#gunicorn settings of the web app: one worker process per core, a few threads in each
+#run from frontend/: gunicorn -c gunicorn.conf.py
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+#.env values win over the defaults set below
+load_dotenv()
+
+#the factory runs in each worker after the fork, see create_app in app.py
+wsgi_app = "app:create_app()"
+preload_app = False
+
+bind = os.getenv("BIND", "0.0.0.0:" + os.getenv("PORT", "8000"))
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))        #requests of a worker waiting on the database at the same time
+
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))       #also covers the cache warm-up of a new worker
+graceful_timeout = 30
+keepalive = 5
+accesslog = os.getenv("WEB_ACCESS_LOG", "-")
+
+#each worker has its own mongo pool, a thread holds at most one connection
+#workers x threads connections for the box, one kept open per worker between bursts
+os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(threads))
+os.environ.setdefault("MONGO_MIN_POOL_SIZE", "1")
@@ -0,0 +1,66 @@
+#paginated and streamed responses of the bulk read api
+#?after=<gameweek>&limit=<n> pages on the gameweek, ?fields=a,b.c selects fields, ?format=ndjson one document per line
+import itertools
+import json
+import os
+
+from flask import Response, request, url_for
+
+from data_layer.database import parse_fields
+
+MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "1000"))
+
+
+#query arguments of a page, ValueError on a bad value (sent back as a 400)
+def page_args():
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    #without a limit the whole list is streamed
+    args = {
+        "after": int(after) if after not in (None, "") else None,
+        "limit": int(limit) if limit not in (None, "") else 0,
+        "fields": parse_fields(request.args.get("fields")),
+    }
+    if limit not in (None, "") and not 1 <= args["limit"] <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    format = request.args.get("format", "json")
+    if format not in ("json", "ndjson"):
+        raise ValueError(f"Unknown format: {format}")
+    return args, format
+
+def encode(doc):
+    return json.dumps(doc, default=str, separators=(",", ":"))
+
+def json_chunks(docs):
+    yield "["
+    first = True
+    for doc in docs:
+        yield encode(doc) if first else "," + encode(doc)
+        first = False
+    yield "]\n"
+
+def ndjson_chunks(docs):
+    for doc in docs:
+        yield encode(doc) + "\n"
+
+#the documents are encoded as the storage yields them, the response is never built in memory
+#the next page is announced in the headers, the body stays a plain list
+#a storage error before the first document is raised here (a 500, never an empty list), one after it
+#cuts the body short, and an unterminated list is not valid json
+def stream_page(docs, following, format):
+    docs = iter(docs)
+    first = next(docs, None)
+    if first is not None:
+        docs = itertools.chain([first], docs)
+
+    if format == "ndjson":
+        response = Response(ndjson_chunks(docs), mimetype="application/x-ndjson")
+    else:
+        response = Response(json_chunks(docs), mimetype="application/json")
+
+    if following is not None:
+        args = request.args.to_dict()
+        args["after"] = following
+        response.headers["Link"] = '<' + url_for(request.endpoint, **request.view_args, **args) + '>; rel="next"'
+        response.headers["X-Next-After"] = str(following)
+    return response
@@ -0,0 +1,184 @@
+#response cache of the web app: the data only changes when the backend publishes a new version
+#pages are kept in an in-process LRU keyed on that version and revalidated by the browsers with ETags (304)
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from data_layer.database import read_error_count
+from data_layer.storage import get_storage
+
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))          #responses kept per worker
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))          #seconds, safety net on top of the version
+VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "5"))            #seconds between two checks of the version
+HTTP_MAX_AGE = int(os.getenv("HTTP_MAX_AGE", "30"))                #seconds browsers reuse a page without asking
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", "1048576"))  #larger streamed bodies are not kept
+
+
+class ResponseCache:
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+#version published by the backend, re-read at most every VERSION_TTL seconds
+class DataVersion:
+
+    def __init__(self, ttl=VERSION_TTL, clock=time.monotonic, on_change=None):
+        self.ttl = ttl
+        self.clock = clock
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.checked = None
+        self.current = None
+
+    def load(self):
+        storage = get_storage()
+        doc = storage.fetch_data_version()
+        if doc is None:
+            #nothing published yet, the season document identifies the data
+            season = storage.fetch_season() or {}
+            doc = {"version": 0, "last_updated_gw": season.get("last_updated_gw"),
+                   "digest": season.get("input_digest"), "published_at": None}
+
+        key = json.dumps([doc.get("version"), doc.get("last_updated_gw"), doc.get("digest")], default=str)
+        last_modified = None
+        if doc.get("published_at"):
+            last_modified = datetime.fromisoformat(doc["published_at"]).replace(microsecond=0)
+        return {
+            "etag": hashlib.sha256(key.encode("utf-8")).hexdigest()[:20],
+            "version": doc.get("version"),
+            "last_updated_gw": doc.get("last_updated_gw"),
+            "last_modified": last_modified
+        }
+
+    def get(self):
+        now = self.clock()
+        if self.current is not None and now - self.checked < self.ttl:
+            return self.current
+        with self.lock:
+            if self.current is None or now - self.checked >= self.ttl:
+                version = self.load()
+                changed = self.current is not None and version["etag"] != self.current["etag"]
+                self.current = version
+                self.checked = now
+                if changed and self.on_change is not None:
+                    self.on_change()
+        return self.current
+
+
+cache = ResponseCache()
+#entries of an old version are never hit again, they are dropped at once to free the memory
+data_version = DataVersion(on_change=cache.clear)
+
+def not_modified(version):
+    if request.if_none_match:
+        return request.if_none_match.contains(version["etag"])
+    if request.if_modified_since and version["last_modified"]:
+        return version["last_modified"] <= request.if_modified_since
+    return False
+
+def add_validators(response, version):
+    response.set_etag(version["etag"])
+    if version["last_modified"]:
+        response.last_modified = version["last_modified"]
+    response.headers["Cache-Control"] = f"public, max-age={HTTP_MAX_AGE}"
+    return response
+
+#sends a streamed body unchanged and keeps a copy in the cache once complete, unless it grows past max_bytes
+#a body cut short by an error is never stored, the exception leaves the loop before cache.set
+def cache_stream(chunks, key, status, mimetype, max_bytes=None):
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    kept = []
+    size = 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size <= max_bytes:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None:
+        cache.set(key, (b"".join(kept), status, mimetype))
+
+#decorator for the views that only read published data
+def cached(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            version = data_version.get()
+        except Exception as e:
+            #the version cannot be read, serve without caching rather than failing
+            print(f"Data version error: {e}")
+            return view(*args, **kwargs)
+
+        #the browser already has this version, nothing to render and no query
+        if not_modified(version):
+            response = Response(status=304)
+            response.headers["X-Cache"] = "REVALIDATED"
+            return add_validators(response, version)
+
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), version["etag"])
+        entry = cache.get(key)
+        if entry is not None:
+            body, status, mimetype = entry
+            response = Response(body, status=status, mimetype=mimetype)
+            response.headers["X-Cache"] = "HIT"
+            return add_validators(response, version)
+
+        errors = read_error_count()
+        response = make_response(view(*args, **kwargs))
+        #errors are not cached and carry no validators, nor is a page built from a read that failed
+        #(the storage printed the error and answered empty)
+        if response.status_code != 200 or response.direct_passthrough:
+            return response
+        if read_error_count() != errors:
+            response.headers["X-Cache"] = "BYPASS"
+            return response
+        if response.is_streamed:
+            response.response = cache_stream(response.iter_encoded(), key, response.status_code, response.mimetype)
+        else:
+            cache.set(key, (response.get_data(), response.status_code, response.mimetype))
+        response.headers["X-Cache"] = "MISS"
+        return add_validators(response, version)
+    return wrapper
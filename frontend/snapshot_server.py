@@ -0,0 +1,46 @@
+#snapshot mode of the read api: responses sent from the files published by the backend (see backend/snapshots.py)
+#no database query, so these endpoints keep answering while the database is slow or down
+import os
+from functools import wraps
+
+from flask import jsonify, request, send_file
+
+from snapshots import current_snapshot
+from response_cache import HTTP_MAX_AGE
+
+SERVE_SNAPSHOTS = os.getenv("SERVE_SNAPSHOTS", "0") == "1"
+
+
+def snapshot_response(directory, name, entry):
+    gzipped = request.accept_encodings.quality("gzip") > 0
+    path = os.path.join(directory, name + (".json.gz" if gzipped else ".json"))
+    #send_file hands the open file to the server, which can use sendfile() instead of copying it
+    response = send_file(path, mimetype="application/json", etag=entry["etag"] + ("-gz" if gzipped else ""),
+                         conditional=True, max_age=HTTP_MAX_AGE)
+    #an api response, not a download of the .gz file
+    response.headers.pop("Content-Disposition", None)
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.headers["X-Snapshot"] = os.path.basename(directory)
+    return response
+
+#serves the view from the current snapshot, name is formatted with the view arguments ("gameweek_{gw}")
+#the view itself only runs when snapshot mode is off or nothing has been published yet
+def snapshot(name):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            #pages and field selections are not in the snapshot
+            current = current_snapshot() if SERVE_SNAPSHOTS and not request.args else None
+            if current is None:
+                return view(*args, **kwargs)
+
+            directory, manifest = current
+            entry = manifest["files"].get(name.format(**kwargs))
+            #the snapshot holds every gameweek of its version
+            if entry is None:
+                return jsonify({"error": "not found"}), 404
+            return snapshot_response(directory, name.format(**kwargs), entry)
+        return wrapper
+    return decorator
@@ -0,0 +1,33 @@
+#benchmark of the gameweek metrics: row by row implementation vs vectorised one
+#run: python tests/bench_player_evaluator.py [players per gameweek ...]
+import sys
+import os
+import time
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from algorithm.player_evaluator import docs_to_frame, build_gameweek_summary
+from synthetic_stats import synthetic_gameweek, legacy_gameweek_summary
+
+
+def best_time(function, repeats=3):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 50000]
+
+    for size in sizes:
+        docs = synthetic_gameweek(size)
+        legacy = best_time(lambda: legacy_gameweek_summary(docs, 1))
+        vectorised = best_time(lambda: build_gameweek_summary(docs_to_frame(docs), 1))
+        print(f"{size} players: legacy {legacy * 1000:.1f} ms, vectorised {vectorised * 1000:.1f} ms, "
+              f"speedup x{legacy / vectorised:.1f}")
@@ -0,0 +1,45 @@
+#in-memory mongo for the tests that run the real queries and pipelines without a server
+#mongomock is optional, mongo_client() returns None when it is not installed
+try:
+    import mongomock
+    import mongomock.aggregate as mongomock_aggregate
+    import mongomock.collection as mongomock_collection
+except ImportError:
+    mongomock = None
+
+_patched = False
+
+
+#operators the pipelines use that mongomock does not have
+def _patch():
+    global _patched
+    if _patched:
+        return
+    _patched = True
+
+    #$round, on the server since 4.2
+    mongomock_aggregate.arithmetic_operators.add("$round")
+    handle_arithmetic = mongomock_aggregate._Parser._handle_arithmetic_operator
+
+    def handle_round(self, operator, values):
+        if operator == "$round":
+            number, places = self.parse_many(values)
+            return None if number is None else round(number, places)
+        return handle_arithmetic(self, operator, values)
+    mongomock_aggregate._Parser._handle_arithmetic_operator = handle_round
+
+    #pymongo 4.11+ passes a sort to the bulk operations, mongomock does not know it
+    for name in ("add_replace", "add_update"):
+        add = getattr(mongomock_collection.BulkOperationBuilder, name)
+
+        def without_sort(self, *args, _add=add, **kwargs):
+            kwargs.pop("sort", None)
+            return _add(self, *args, **kwargs)
+        setattr(mongomock_collection.BulkOperationBuilder, name, without_sort)
+
+
+def mongo_client():
+    if mongomock is None:
+        return None
+    _patch()
+    return mongomock.MongoClient()
@@ -0,0 +1,139 @@
+#synthetic gameweek rows shared by the tests and the benchmarks
+import random
+
+import pandas as pd
+
+TEAMS = ["Team 1", "Team 2", "Team 3", "Team 4"]
+
+def player_stats(pid, gw):
+    return {
+        "minutes": 90 if pid % 5 else 45, "total_points": (pid * gw) % 13,
+        "goals_scored": (pid + gw) % 3, "assists": (pid * 3 + gw) % 2,
+        "goals_conceded": (pid + gw) % 4, "clean_sheets": int((pid + gw) % 4 == 0),
+        "penalties_saved": int(pid == 1 and gw == 2), "yellow_cards": int((pid + gw) % 7 == 0),
+        "red_cards": int(pid == gw), "expected_goals": round(0.13 * ((pid * gw) % 7), 2),
+        "influence": round(1.7 * ((pid + gw) % 9), 1), "in_dreamteam": (pid + gw) % 6 == 0
+    }
+
+#rows of one gameweek in the order of player_ids, the mover plays for TEAMS[0] from gameweek moves_at on
+def gameweek_docs(gw, player_ids, mover, moves_at):
+    docs = []
+    for pid in player_ids:
+        team = TEAMS[pid % 4] if pid != mover or gw < moves_at else TEAMS[0]
+        docs.append({
+            "_id": f"gw{gw}_p{pid}",
+            "player_id": pid,
+            "name": f"Player {pid}",
+            "team": team,
+            "position_id": (pid % 4) + 1,
+            "gameweek": gw,
+            "statistics": player_stats(pid, gw)
+        })
+    return docs
+
+#one gameweek of a 20 team league with random stats, for the gameweek metrics
+LEAGUE_TEAMS = [f"Team {i}" for i in range(1, 21)]
+
+def synthetic_gameweek(n_players, gameweek_id=1, seed=0, unique_points=False):
+    rng = random.Random(seed)
+    #unique points make the dream team free of ties, so both versions pick the same players
+    points = rng.sample(range(n_players * 4), n_players) if unique_points else None
+
+    docs = []
+    for pid in range(1, n_players + 1):
+        docs.append({
+            "_id": f"gw{gameweek_id}_p{pid}",
+            "player_id": pid,
+            "name": f"Player {pid}",
+            "team": LEAGUE_TEAMS[pid % len(LEAGUE_TEAMS)],
+            "position_id": rng.randint(1, 4),
+            "gameweek": gameweek_id,
+            "statistics": {
+                "minutes": rng.choice([15, 45, 60, 90]),
+                "total_points": points[pid - 1] if points else rng.randint(0, 20),
+                "goals_scored": rng.choice([0, 0, 0, 1, 2]),
+                "assists": rng.choice([0, 0, 1]),
+                "influence": round(rng.random() * 60, 1),
+                "yellow_cards": rng.choice([0, 0, 0, 1]),
+                "in_dreamteam": rng.random() < 0.02,
+                "red_cards": rng.choice([0] * 30 + [1]),
+                "goals_conceded": rng.randint(0, 4)
+            }
+        })
+    return docs
+
+#the implementation before vectorising, kept as the reference output
+def legacy_gameweek_summary(gameweek_data, gameweek_id):
+    players_list = []
+    for doc in gameweek_data:
+        stats = doc.get('statistics', {})
+        players_list.append({
+            'player_id': doc['player_id'],
+            'name': doc['name'],
+            'team': doc['team'],
+            'position_id': doc['position_id'],
+            'minutes': stats.get('minutes', 0),
+            'total_points': stats.get('total_points', 0),
+            'goals_scored': stats.get('goals_scored', 0),
+            'assists': stats.get('assists', 0),
+            'influence': stats.get('influence', 0.0),
+            'yellow_cards': stats.get('yellow_cards', 0),
+            'in_dreamteam': stats.get('in_dreamteam', False),
+            'red_cards': stats.get('red_cards', 0),
+            'goals_conceded': stats.get('goals_conceded', 0)
+        })
+    df = pd.DataFrame(players_list)
+
+    df_sorted = df.sort_values(
+        by=['total_points', 'goals_scored', 'in_dreamteam', 'influence', 'yellow_cards'],
+        ascending=[False, False, False, False, True]
+    )
+    mvp_row = df_sorted.iloc[0]
+    mvp_dict = {
+        "name": mvp_row['name'],
+        "team": mvp_row['team'],
+        "points": int(mvp_row['total_points']),
+        "goals": int(mvp_row['goals_scored'])
+    }
+
+    max_goals = df['goals_scored'].max()
+    top_scorers = []
+    for index, player in df.iterrows():
+        if player['goals_scored'] == max_goals:
+            top_scorers.append({"name": player['name'], "team": player['team'], "goals": int(player['goals_scored'])})
+
+    dream_team = []
+    for pos_id, count in [(1, 1), (2, 3), (3, 4), (4, 3)]:
+        position_df = df[df['position_id'] == pos_id]
+        best = position_df.sort_values(by='total_points', ascending=False).head(count)
+        for index, p in best.iterrows():
+            dream_team.append({"name": p['name'], "team": p['team'], "total_points": int(p['total_points'])})
+
+    team_stats = df.groupby('team').agg({
+        'goals_scored': 'sum',
+        'goals_conceded': 'max',
+        'yellow_cards': 'sum',
+        'red_cards': 'sum'
+    }).reset_index()
+    team_stats['total_cards'] = team_stats['yellow_cards'] + team_stats['red_cards']
+
+    def top(column, method):
+        target = team_stats[column].max() if method == 'max' else team_stats[column].min()
+        result = []
+        for index, row in team_stats[team_stats[column] == target].iterrows():
+            result.append({"team": row['team'], "value": int(row[column])})
+        return result
+
+    return {
+        "_id": "summary_gw_" + str(gameweek_id),
+        "gameweek": gameweek_id,
+        "mvp": mvp_dict,
+        "top_scorers": top_scorers,
+        "dream_team": dream_team,
+        "team_stats": {
+            "most_goals_scored": top('goals_scored', 'max'),
+            "least_goals_conceded": top('goals_conceded', 'min'),
+            "most_cards_conceded": top('total_cards', 'max'),
+            "least_cards_conceded": top('total_cards', 'min')
+        }
+    }
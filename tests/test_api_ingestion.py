@@ -1,11 +1,17 @@
 import unittest
 import sys
 import os
+import json
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
 
-from backend.data_layer.api_ingestion import get_bootstrap, last_gameweek, data_extraction
+from data_layer.api_ingestion import get_bootstrap, last_gameweek, data_extraction, make_session
 
 class TestApiIngestionReal(unittest.TestCase):
     
@@ -46,5 +52,107 @@ class TestApiIngestionReal(unittest.TestCase):
             first_file = new_files[0]
             self.assertTrue(os.path.exists(first_file))
 
+
+#small fake FPL api served from a local thread
+BOOTSTRAP = {
+    "events": [
+        {"id": 1, "name": "Gameweek 1", "finished": True, "data_checked": True},
+        {"id": 2, "name": "Gameweek 2", "finished": True, "data_checked": True},
+        {"id": 3, "name": "Gameweek 3", "finished": True, "data_checked": True},
+        {"id": 4, "name": "Gameweek 4", "finished": False, "data_checked": False}
+    ],
+    "elements": [
+        {"id": 10, "first_name": "Stub", "second_name": "Keeper", "team": 1, "element_type": 1},
+        {"id": 11, "first_name": "Stub", "second_name": "Striker", "team": 2, "element_type": 4}
+    ],
+    "teams": [{"id": 1, "name": "Team A"}, {"id": 2, "name": "Team B"}]
+}
+
+def live_payload(gw):
+    return {"elements": [
+        {"id": 10, "stats": {"minutes": 90, "goals_scored": 0, "total_points": gw}},
+        {"id": 11, "stats": {"minutes": 0, "goals_scored": 0, "total_points": 0}}
+    ]}
+
+class StubHandler(BaseHTTPRequestHandler):
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubHandler.lock:
+            StubHandler.hits[self.path] = StubHandler.hits.get(self.path, 0) + 1
+            hits = StubHandler.hits[self.path]
+
+        if self.path == "/bootstrap-static/":
+            body = BOOTSTRAP
+        elif self.path == "/event/2/live/" and hits == 1:
+            #first call fails, the session must retry it
+            self.send_response(503)
+            self.end_headers()
+            return
+        elif self.path.startswith("/event/"):
+            body = live_payload(int(self.path.split("/")[2]))
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class TestApiIngestionStub(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    def setUp(self):
+        StubHandler.hits = {}
+        self.out_path = tempfile.mkdtemp()
+        self.session = make_session(pool_size=2, retries=3, backoff=0)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.out_path)
+
+    def test_concurrent_extraction_writes_each_gameweek(self):
+        files = data_extraction(max_workers=3, session=self.session, base_url=self.base_url, out_path=self.out_path)
+
+        names = [os.path.basename(f) for f in files]
+        self.assertEqual(names, ["gameweek_1.json", "gameweek_2.json", "gameweek_3.json"])
+
+        with open(files[2]) as f:
+            rows = json.load(f)
+        #player with 0 minutes is dropped
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["name"], "Stub Keeper")
+        self.assertEqual(rows[0]["team"], "Team A")
+        self.assertEqual(rows[0]["gameweek_index"], 3)
+
+    def test_retry_on_server_error(self):
+        data_extraction(max_workers=2, session=self.session, base_url=self.base_url, out_path=self.out_path)
+        self.assertEqual(StubHandler.hits["/event/2/live/"], 2)
+
+    def test_existing_files_are_skipped(self):
+        data_extraction(session=self.session, base_url=self.base_url, out_path=self.out_path)
+        files = data_extraction(session=self.session, base_url=self.base_url, out_path=self.out_path)
+        self.assertEqual(files, [])
+        self.assertEqual(StubHandler.hits["/event/1/live/"], 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
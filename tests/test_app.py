@@ -0,0 +1,92 @@
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+#to resolve backend and frontend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+import algorithm.player_search as player_search
+from data_layer import storage
+import response_cache
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')))[:3]
+SEASON_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer', 'analytics',
+                           'season_overview.json')
+
+
+class TestAppFactory(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        storage.upload_many(RAW_FILES)
+        with open(SEASON_FILE) as f:
+            storage.save_season_data(json.load(f))
+
+        import app
+        cls.module = app
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        response_cache.cache.clear()
+        player_search._search = None
+
+    def test_worker_starts_warm(self):
+        app = self.module.create_app()
+        self.assertIsNotNone(app.config["WARMED_IN"])
+        self.assertIsNotNone(player_search._search)
+
+        client = app.test_client()
+        #the pages of WARM_PATHS are served from the cache from the first request on
+        for path in self.module.WARM_PATHS:
+            self.assertEqual(client.get(path).headers.get("X-Cache"), "HIT", path)
+
+        with patch.object(storage.SQLiteStorage, "fetch_players_directory") as directory:
+            self.assertEqual(client.get("/api/search?q=salah").status_code, 200)
+        directory.assert_not_called()
+
+    def test_apps_are_independent(self):
+        first = self.module.create_app(warm=False)
+        second = self.module.create_app(warm=False)
+        self.assertIsNot(first, second)
+        self.assertEqual(sorted(rule.rule for rule in first.url_map.iter_rules()),
+                         sorted(rule.rule for rule in second.url_map.iter_rules()))
+        self.assertIsNone(first.config["WARMED_IN"])
+        self.assertEqual(response_cache.cache.stats()["size"], 0)
+
+    def test_health(self):
+        client = self.module.create_app(warm=False).test_client()
+        self.assertEqual(client.get("/healthz").get_json()["status"], "ok")
+
+        ready = client.get("/readyz")
+        self.assertEqual(ready.status_code, 200)
+        self.assertEqual(ready.get_json()["storage"], "ok")
+
+        with patch.object(storage.SQLiteStorage, "ping", side_effect=RuntimeError("database is locked")):
+            ready = client.get("/readyz")
+        self.assertEqual(ready.status_code, 503)
+        self.assertEqual(ready.get_json()["storage"], "database is locked")
+
+        #a worker that failed its warm-up is not sent traffic
+        with patch.object(self.module, "warm_caches", side_effect=RuntimeError("boom")):
+            cold = self.module.create_app()
+        self.assertEqual(cold.test_client().get("/readyz").status_code, 503)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,33 +1,55 @@
 #Using classh method to just connect with database one time
+import glob
 import json
+import shutil
+import tempfile
 import unittest
 import sys
 import os
+from unittest.mock import patch
 from pymongo import MongoClient
 
 #to resolve backend imports
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
 
-from backend.data_layer.database import (clean_metrics, upload_to_mongo, save_gameweek_data,
-                                          fetch_mvp_data, MONGO_URI, DB_NAME, COLLECTION, ANALYTICS_COLL)
+import data_layer.database as database
+from data_layer.database import (clean_metrics, build_player_doc, bulk_replace,
+                                 get_client, close_client, normalise_name,
+                                 MONGO_URI, DB_NAME, COLLECTION, ANALYTICS_COLL)
+from data_layer import indexes, instrumentation, storage
+from mock_mongo import mongo_client
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')))
 
 class TestDatabase(unittest.TestCase):      #inheriting Testcase
 
     @classmethod
     def setUpClass(cls):
+        #integration tests run on the embedded sqlite storage when no server answers
+        cls.mongo_available = False
+        cls.tmp = None
         try:
-            cls.client = MongoClient(MONGO_URI)
+            cls.client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
             cls.db = cls.client[DB_NAME]
             cls.players_coll = cls.db[COLLECTION]
             cls.gw_coll = cls.db[ANALYTICS_COLL]
+            cls.directory_coll = cls.db[database.PLAYERS_COLL]
+            cls.client.admin.command("ping")
+            cls.mongo_available = True
+            cls.storage = storage.MongoStorage()
             print("Connected with MongoDB")
         except Exception as e:
-            print(f"Error: {e}")
-             
+            print(f"Error: {e}, running on SQLite")
+            cls.tmp = tempfile.mkdtemp()
+            cls.storage = storage.SQLiteStorage(os.path.join(cls.tmp, "test.db"))
+
     def setUp(self):
         self.test_gw_id = 9999  #to do not overwrite the right ones
-        self.test_player_id = "test_p1"
+        #player ids are integers, the sqlite players table keys on them
+        self.test_player_id = 99999
 
         self.unique_id = f"gw{self.test_gw_id}_p{self.test_player_id}"
         
@@ -61,9 +83,11 @@ class TestDatabase(unittest.TestCase):      #inheriting Testcase
             json.dump(self.test_json_data, f)
 
     def tearDown(self):
-        self.players_coll.delete_one({"_id": self.unique_id})
-        self.gw_coll.delete_many({"gameweek": self.test_gw_id})
-        self.gw_coll.delete_one({"_id": "test_gw_summary"})
+        if self.mongo_available:
+            self.players_coll.delete_one({"_id": self.unique_id})
+            self.directory_coll.delete_one({"_id": self.test_player_id})
+            self.gw_coll.delete_many({"gameweek": self.test_gw_id})
+            self.gw_coll.delete_one({"_id": "test_gw_summary"})
 
         if os.path.exists(self.test_json_filename):
             os.remove(self.test_json_filename)
@@ -87,14 +111,19 @@ class TestDatabase(unittest.TestCase):      #inheriting Testcase
 
     #integration tests
     def test_upload(self):
-        print(f"Testing upload flow...")
+        print(f"Testing upload flow on {self.storage.name}...")
 
-        upload_to_mongo(self.test_json_filename)
-        doc = self.players_coll.find_one({"_id": self.unique_id})
+        self.storage.upload_many([self.test_json_filename])
+        docs = {doc["_id"]: doc for doc in self.storage.fetch_gameweek_data(self.test_gw_id)}
+        doc = docs.get(self.unique_id)
         self.assertIsNotNone(doc)
         self.assertEqual(doc['name'], "Integration Tester")
         #checking clean metrics worked properly
         self.assertEqual(doc['statistics']['influence'], 50.5)
+        #the players directory follows the upload
+        player = self.storage.fetch_player(self.test_player_id)
+        self.assertEqual((player['appearances'], player['latest_gameweek']), (1, self.test_gw_id))
+        self.assertEqual(player['totals']['goals_scored'], 1)
     
     def test_save_and_read(self):
         gw_summary = {
@@ -104,8 +133,8 @@ class TestDatabase(unittest.TestCase):      #inheriting Testcase
             "top_scorers": []
         }
 
-        save_gameweek_data(gw_summary)
-        all_mvps = fetch_mvp_data()
+        self.storage.save_gameweek_data(gw_summary)
+        all_mvps = self.storage.fetch_mvp_data()
         
         found = False
         for item in all_mvps:
@@ -118,8 +147,276 @@ class TestDatabase(unittest.TestCase):      #inheriting Testcase
     @classmethod
     def tearDownClass(cls):
         cls.client.close()
+        if cls.tmp:
+            cls.storage.close()
+            shutil.rmtree(cls.tmp, ignore_errors=True)
     
-    
+
+#records the bulk_write calls instead of sending them
+class FakeBulkResult:
+    def __init__(self, operations):
+        self.inserted_count = 0
+        self.modified_count = 0
+        self.upserted_count = len(operations)
+        self.matched_count = 0
+
+class FakeCollection:
+    def __init__(self):
+        self.calls = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls.append((operations, ordered))
+        return FakeBulkResult(operations)
+
+class TestBulkUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = []
+        for i in range(25):
+            self.rows.append({
+                "player_id": i,
+                "name": f"Player {i}",
+                "team": "Test FC",
+                "position_code": 3,
+                "gameweek_index": 7,
+                "statistics": {"minutes": 90, "influence": "1.5"}
+            })
+
+    def test_build_player_doc(self):
+        doc = build_player_doc(self.rows[3])
+        self.assertEqual(doc["_id"], "gw7_p3")
+        self.assertEqual(doc["gameweek"], 7)
+        self.assertEqual(doc["position_id"], 3)
+        self.assertEqual(doc["statistics"]["influence"], 1.5)
+
+    def test_normalise_name_folds_accents(self):
+        self.assertEqual(normalise_name("Gabriel dos Santos Magalhães"), "gabriel dos santos magalhaes")
+        self.assertEqual(normalise_name("David Raya  Martín"), "david raya martin")
+        self.assertEqual(build_player_doc(self.rows[0])["name_search"], "player 0")
+
+    def test_fold_player_sets_one_slot(self):
+        docs = {gw: dict(build_player_doc(dict(self.rows[0], gameweek_index=gw)), statistics={"minutes": gw})
+                for gw in (1, 2, 3)}
+        player = database.fold_player(database.fold_player(None, docs[3]), docs[1])
+        player = database.fold_player(player, docs[2])
+        self.assertEqual(player["series"]["gameweek"], [1, 2, 3])
+        self.assertEqual(player["series"]["minutes"], [1, 2, 3])
+
+        replaced = dict(docs[2], statistics={"minutes": 90})
+        player = database.fold_player(player, replaced, docs[2])
+        self.assertEqual(player["series"]["minutes"], [1, 90, 3])
+        self.assertEqual(player["totals"]["minutes"], 94)
+        self.assertEqual(player["appearances"], 3)
+
+    def test_bulk_replace_batches(self):
+        col = FakeCollection()
+        docs = [build_player_doc(r) for r in self.rows]
+        counts = bulk_replace(col, docs, batch_size=10)
+
+        self.assertEqual(len(col.calls), 3)
+        self.assertEqual(counts["round_trips"], 3)
+        self.assertEqual(counts["upserted"], 25)
+        #unordered so one failing upsert does not stop the batch
+        for operations, ordered in col.calls:
+            self.assertFalse(ordered)
+
+@unittest.skipIf(mongo_client() is None, "mongomock not installed")
+class TestPlayersFold(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mongo_client()
+        self.db = self.client["fpl_test"]
+        self.patch = patch.multiple(database, get_client=lambda: self.client, DB_NAME="fpl_test",
+                                    COLLECTION="raw")
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def players(self):
+        return {doc["_id"]: doc for doc in self.db[database.PLAYERS_COLL].find()}
+
+    def expected(self, rows):
+        return {doc["_id"]: doc for doc in database.build_players_directory(list(rows.values()))}
+
+    def test_uploads_fold_into_the_players(self):
+        #out of gameweek order, the series slots are inserted where they belong
+        files = RAW_FILES[:5]
+        rows = {}
+        for path in reversed(files):
+            for doc in database.load_player_docs(path):
+                rows[doc["_id"]] = doc
+            self.assertIsNotNone(database.upload_many([path]))
+        self.assertEqual(self.players(), self.expected(rows))
+
+        #a full regroup of the same rows gives the same documents
+        pipeline = database.player_directory_pipeline()[:-1]
+        regrouped = {doc["_id"]: doc for doc in self.db["raw"].aggregate(pipeline)}
+        self.assertEqual(regrouped, self.expected(rows))
+
+    def test_reupload_replaces_the_contribution(self):
+        path = RAW_FILES[0]
+        database.upload_many(RAW_FILES[:2])
+        before = self.players()
+        #same file again: no row changed, nothing to fold
+        with patch.object(database, "player_fold_update") as update:
+            database.upload_many([path])
+        update.assert_not_called()
+        self.assertEqual(self.players(), before)
+
+        docs = database.load_player_docs(path)
+        changed = dict(docs[0], team="Changed", statistics=dict(docs[0]["statistics"], total_points=40))
+        database.fold_players([changed], {changed["_id"]: docs[0]})
+        self.db["raw"].replace_one({"_id": changed["_id"]}, changed)
+
+        rows = {doc["_id"]: doc for doc in self.db["raw"].find()}
+        player = self.players()[changed["player_id"]]
+        self.assertEqual(player, self.expected(rows)[changed["player_id"]])
+        self.assertEqual(player["appearances"], sum(doc["player_id"] == changed["player_id"] for doc in rows.values()))
+
+    def test_failed_fold_is_regrouped_by_the_backfill(self):
+        path = RAW_FILES[0]
+        database.upload_many(RAW_FILES[1:3])
+
+        #the raw rows are replaced, then the fold fails
+        with patch.object(database, "fold_players", side_effect=RuntimeError("connection lost")):
+            self.assertIsNone(database.upload_many([path]))
+        rows = {doc["_id"]: doc for doc in self.db["raw"].find()}
+        self.assertNotEqual(self.players(), self.expected(rows))
+
+        #a re-upload of the same rows folds nothing, the failed upload stays listed for the backfill
+        with patch.object(database, "player_fold_update") as update:
+            self.assertIsNotNone(database.upload_many([path]))
+        update.assert_not_called()
+        self.assertEqual(len(database.stale_uploads()), 1)
+
+        #mongomock has no $merge, the regroup of refresh_players without it
+        def regroup(db):
+            for doc in db["raw"].aggregate(database.player_directory_pipeline()[:-1]):
+                db[database.PLAYERS_COLL].replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            return {"players": None, "round_trips": 1}
+
+        with patch.object(indexes, "refresh_players", side_effect=regroup), patch.object(indexes, "COLLECTION", "raw"):
+            self.assertTrue(indexes.backfill_players(self.db))
+            self.assertFalse(indexes.backfill_players(self.db))
+        self.assertEqual(self.players(), self.expected(rows))
+        self.assertEqual(database.stale_uploads(), [])
+
+    def test_round_trips_are_counted_by_the_command_listener(self):
+        #the mongo client counts every command it sends, the upload does not count them a second time
+        tmp = tempfile.mkdtemp()
+        instrumentation.start_run()
+        try:
+            with instrumentation.stage("upload_to_mongo", 1):
+                counts = database.upload_many(RAW_FILES[:1])
+                database.refresh_players()
+        finally:
+            report = instrumentation.finish_run(os.path.join(tmp, "report.json"), os.path.join(tmp, "metrics.prom"))
+            shutil.rmtree(tmp, ignore_errors=True)
+        #the in-memory client has no listener
+        self.assertEqual(report["stages"]["upload_to_mongo"]["round_trips"], 0)
+        self.assertGreater(counts["round_trips"], 0)
+
+    def test_upload_only_touches_its_gameweek_slot(self):
+        first, second, third = [os.path.join(os.path.dirname(RAW_FILES[0]), f"gameweek_{gw}.json") for gw in (1, 2, 3)]
+        database.upload_many([first, third])
+        before = self.players()
+
+        #gameweek 2 goes between the two, every other entry keeps its value
+        database.upload_many([second])
+        after = self.players()
+        rows = {doc["player_id"]: doc for doc in database.load_player_docs(second)}
+        for player_id, player in after.items():
+            series = player["series"]
+            old = before.get(player_id, {"series": {field: [] for field in series}})["series"]
+            if player_id in rows:
+                slot = series["gameweek"].index(2)
+                self.assertEqual(series["total_points"][slot], rows[player_id]["statistics"]["total_points"])
+                series = {field: values[:slot] + values[slot + 1:] for field, values in series.items()}
+            self.assertEqual(series, old)
+
+        #a re-upload of gameweek 2 replaces its entry in place
+        doc = next(iter(rows.values()))
+        changed = dict(doc, statistics=dict(doc["statistics"], total_points=99))
+        database.fold_players([changed], {doc["_id"]: doc})
+        series = self.players()[doc["player_id"]]["series"]
+        expected = after[doc["player_id"]]["series"]
+        expected["total_points"][expected["gameweek"].index(2)] = 99
+        self.assertEqual(series, expected)
+
+
+@unittest.skipIf(mongo_client() is None, "mongomock not installed")
+class TestReplaceCollections(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mongo_client()
+        self.db = self.client["fpl_test"]
+        self.patch = patch.multiple(database, get_client=lambda: self.client, DB_NAME="fpl_test")
+        self.patch.start()
+        self.db["raw"].insert_many([{"_id": "old_1", "gameweek": 1}, {"_id": "old_2", "gameweek": 1}])
+        self.db["analytics"].insert_one({"_id": "old", "gameweek": 1})
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_swap_after_every_load(self):
+        contents = {"raw": [{"_id": f"new_{i}", "gameweek": 2} for i in range(5)],
+                    "analytics": [{"_id": "new", "gameweek": 2}]}
+        indexes = {"raw": [([("gameweek", 1)], {"name": "gameweek_1"})]}
+        collection = type(self.db["raw"])
+        events = []
+        seen = []
+
+        def record(method):
+            original = getattr(collection, method)
+
+            def wrapper(self_, *args, **kwargs):
+                events.append((method, self_.name))
+                if method == "rename":
+                    #what a reader sees in the middle of the swap
+                    seen.append({name: sorted(doc["_id"] for doc in self.db[name].find()) for name in contents})
+                return original(self_, *args, **kwargs)
+            return patch.object(collection, method, wrapper)
+
+        with record("insert_many"), record("create_index"), record("rename"):
+            counts = database.replace_collections(contents, indexes, batch_size=2)
+
+        self.assertEqual(counts, {"raw": 5, "analytics": 1})
+        #all loading and indexing is done before the first rename, the renames are back to back
+        renames = [i for i, (method, _) in enumerate(events) if method == "rename"]
+        self.assertEqual(renames, list(range(len(events) - len(contents), len(events))))
+        self.assertEqual([events[i][1] for i in renames], ["raw_staging", "analytics_staging"])
+        self.assertEqual(sum(method == "insert_many" for method, _ in events), 4)
+
+        #the documented window: new raw rows with the old analytics until the last rename
+        self.assertEqual(seen, [{"raw": ["old_1", "old_2"], "analytics": ["old"]},
+                                {"raw": [f"new_{i}" for i in range(5)], "analytics": ["old"]}])
+        self.assertEqual(sorted(doc["_id"] for doc in self.db["raw"].find()), [f"new_{i}" for i in range(5)])
+        self.assertEqual([doc["_id"] for doc in self.db["analytics"].find()], ["new"])
+        self.assertIn("gameweek_1", self.db["raw"].index_information())
+        self.assertFalse([name for name in self.db.list_collection_names() if name.endswith("_staging")])
+
+
+class TestSharedClient(unittest.TestCase):
+
+    def tearDown(self):
+        close_client()
+
+    def test_client_is_reused(self):
+        #connect=False so no server is needed to create it
+        self.assertIs(get_client(), get_client())
+
+    def test_close_creates_new_client(self):
+        first = get_client()
+        close_client()
+        self.assertIsNot(first, get_client())
+
+    def test_new_client_after_fork(self):
+        first = get_client()
+        #pretend we are a child process that inherited the client
+        database._client_pid = -1
+        self.assertIsNot(first, get_client())
+        first.close()
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
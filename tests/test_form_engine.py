@@ -0,0 +1,121 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from data_layer.tensor_store import TensorStore, open_store
+from algorithm.form_engine import FormEngine, get_form_engine, position_id
+
+TEAMS = ["Team 1", "Team 2", "Team 3", "Team 4", "Team 5"]
+
+def season_docs(gameweeks=10, players=40, seed=3):
+    rng = random.Random(seed)
+    by_gameweek = {}
+    for gw in range(1, gameweeks + 1):
+        docs = []
+        for pid in range(1, players + 1):
+            #not every player plays every gameweek
+            if rng.random() < 0.2:
+                continue
+            docs.append({
+                "_id": f"gw{gw}_p{pid}", "player_id": pid, "name": f"Player {pid}",
+                "team": TEAMS[pid % 5] if gw < 6 or pid != 7 else TEAMS[0],
+                "position_id": (pid % 4) + 1, "gameweek": gw,
+                "statistics": {"minutes": 90, "goals_scored": rng.choice([0, 0, 1, 2]),
+                               "total_points": rng.randint(0, 15), "expected_goals": round(rng.random(), 2)}
+            })
+        by_gameweek[gw] = docs
+    return by_gameweek
+
+
+class TestFormEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.by_gameweek = season_docs()
+        store = TensorStore(self.path)
+        for gw, docs in self.by_gameweek.items():
+            store.append_gameweek(gw, docs)
+        self.engine = FormEngine(open_store(self.path))
+
+        rows = []
+        for docs in self.by_gameweek.values():
+            for doc in docs:
+                rows.append(dict(doc["statistics"], player_id=doc["player_id"], gameweek=doc["gameweek"],
+                                 position_id=doc["position_id"]))
+        self.df = pd.DataFrame(rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    #the same window computed with a filter and a groupby
+    def brute_force(self, stat, start, end, position=None, per_match=False):
+        window = self.df[(self.df["gameweek"] >= start) & (self.df["gameweek"] <= end)]
+        if position is not None:
+            window = window[window["position_id"] == position]
+        grouped = window.groupby("player_id")[stat].agg(["sum", "count"])
+        values = grouped["sum"] / grouped["count"] if per_match else grouped["sum"]
+        return {int(pid): round(float(v), 2) for pid, v in values.items()}
+
+    def test_window_sums_match_brute_force(self):
+        for stat in ("goals_scored", "total_points", "expected_goals"):
+            for start, end in [(1, 10), (3, 7), (10, 10), (6, 9)]:
+                sums = self.engine.window_sums(stat, start, end)
+                expected = self.brute_force(stat, start, end)
+                for pid, value in expected.items():
+                    self.assertAlmostEqual(sums[self.engine.store.player_index[pid]], value, places=6)
+
+    def test_top_k_matches_brute_force(self):
+        for position in (None, 2, 4):
+            for per_match in (False, True):
+                result = self.engine.top("total_points", window=4, k=5, position=position, per_match=per_match)
+                self.assertEqual((result["start"], result["end"]), (7, 10))
+
+                expected = self.brute_force("total_points", 7, 10, position, per_match)
+                ranked = sorted(expected.items(), key=lambda item: (-item[1], item[0]))[:5]
+                self.assertEqual([(p["player_id"], p["value"]) for p in result["players"]], ranked)
+
+    def test_window_before_the_season_start_is_clipped(self):
+        result = self.engine.top("goals_scored", window=5, end=3)
+        self.assertEqual((result["start"], result["end"], result["window"]), (1, 3, 3))
+
+    def test_team_is_the_latest_in_the_window(self):
+        form = self.engine.player_form(7, window=3)
+        self.assertEqual(form["team"], TEAMS[0])
+        self.assertEqual(self.engine.player_form(7, end=5, window=5)["team"], TEAMS[2])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.engine.top("unknown_stat")
+        with self.assertRaises(ValueError):
+            self.engine.top("goals_scored", window=0)
+        for k in (0, -1):
+            with self.assertRaisesRegex(ValueError, "k must be at least 1"):
+                self.engine.top("goals_scored", k=k)
+        self.assertEqual(len(self.engine.top("goals_scored", k=1)["players"]), 1)
+        with self.assertRaises(ValueError):
+            position_id("keeper")
+        self.assertEqual(position_id("FWD"), 4)
+
+    def test_shared_engine_reloads_after_append(self):
+        engine = get_form_engine(self.path)
+        self.assertIs(get_form_engine(self.path), engine)
+
+        time.sleep(0.01)
+        store = TensorStore(self.path)
+        store.append_gameweek(11, self.by_gameweek[1])
+        reloaded = get_form_engine(self.path)
+        self.assertIsNot(reloaded, engine)
+        self.assertEqual(reloaded.last_gameweek(), 11)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+import data_layer.indexes as indexes
+from data_layer.indexes import find_collscans
+from mock_mongo import mongo_client
+
+class TestIndexes(unittest.TestCase):
+
+    def test_collscan_found_in_nested_plan(self):
+        plan = {
+            "stage": "FETCH",
+            "inputStage": {"stage": "OR", "inputStages": [
+                {"stage": "IXSCAN", "indexName": "gameweek_1"},
+                {"stage": "COLLSCAN", "direction": "forward"}
+            ]}
+        }
+        scans = find_collscans(plan)
+        self.assertEqual(len(scans), 1)
+
+    def test_index_plan_has_no_collscan(self):
+        plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "player_id_1_gameweek_1"}}
+        self.assertEqual(find_collscans(plan), [])
+
+    def test_name_checks_are_anchored(self):
+        checks = [query for coll_name, query in indexes.QUERY_CHECKS if "name_tokens" in str(query)]
+        self.assertIn(indexes.name_query("salah"), checks)
+        for query in checks:
+            for clause in query.get("$and", [query]):
+                self.assertTrue(clause["name_tokens"]["$regex"].startswith("^"))
+
+    @unittest.skipIf(mongo_client() is None, "mongomock not installed")
+    def test_name_query_after_backfill(self):
+        col = mongo_client()["other"]["raw"]
+        col.insert_many([{"_id": 1, "name": "Mohamed Salah"}, {"_id": 2, "name": "William Saliba"},
+                         {"_id": 3, "name": "Ben Davies"}])
+        with patch.object(indexes, "COLLECTION", "raw"):
+            self.assertEqual(indexes.backfill_name_search(col.database), 3)
+        for text, ids in (("SAL", [1, 2]), ("mo salah", [1]), ("alah", []), ("", [1, 2, 3])):
+            self.assertEqual(sorted(doc["_id"] for doc in col.find(indexes.name_query(text))), ids, text)
+
+    @unittest.skipIf(mongo_client() is None, "mongomock not installed")
+    def test_backfill_builds_the_given_database(self):
+        db = mongo_client()["other"]
+        with patch.object(indexes, "refresh_players") as refresh, patch.object(indexes, "COLLECTION", "raw"):
+            self.assertFalse(indexes.backfill_players(db))
+            db["raw"].insert_one({"_id": "gw1_p1", "player_id": 1, "gameweek": 1})
+            self.assertTrue(indexes.backfill_players(db))
+        refresh.assert_called_once_with(db)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+#same copy of the module as the pipeline and the storage layer
+from data_layer import instrumentation
+from data_layer.storage import SQLiteStorage
+
+RAW_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer', 'raw',
+                        'gameweek_1.json')
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.report_path = os.path.join(self.tmp, "report.json")
+        self.prometheus_path = os.path.join(self.tmp, "metrics.prom")
+
+    def tearDown(self):
+        instrumentation.finish_run(self.report_path, self.prometheus_path)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def finish(self):
+        return instrumentation.finish_run(self.report_path, self.prometheus_path)
+
+    def test_no_op_outside_a_run(self):
+        with instrumentation.stage("calculate_metrics", 1) as span:
+            instrumentation.count(rows=10)
+        self.assertIsNone(span)
+        self.assertIsNone(self.finish())
+
+    def test_counters_go_to_the_innermost_stage_of_each_thread(self):
+        instrumentation.start_run()
+
+        def work(gameweek):
+            with instrumentation.stage("data_extraction", gameweek):
+                instrumentation.count(rows=gameweek, bytes=100 * gameweek)
+
+        threads = [threading.Thread(target=work, args=(gw,)) for gw in range(1, 6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with instrumentation.stage("calculate_season_stats"):
+            instrumentation.count(rows=1)
+            with instrumentation.stage("upload_to_mongo", 9):
+                instrumentation.count(round_trips=2)
+
+        report = self.finish()
+        for gw in range(1, 6):
+            span = report["gameweeks"][str(gw)]["data_extraction"]
+            self.assertEqual((span["rows"], span["bytes"]), (gw, 100 * gw))
+        self.assertEqual(report["stages"]["data_extraction"]["rows"], 15)
+        self.assertEqual(report["stages"]["data_extraction"]["calls"], 5)
+        self.assertEqual(report["stages"]["calculate_season_stats"]["rows"], 1)
+        self.assertEqual(report["stages"]["upload_to_mongo"]["round_trips"], 2)
+
+        with open(self.report_path) as f:
+            self.assertEqual(json.load(f)["stages"], report["stages"])
+
+    def test_errors_are_recorded(self):
+        instrumentation.start_run()
+        with self.assertRaises(ValueError):
+            with instrumentation.stage("calculate_metrics", 4):
+                raise ValueError("no rows")
+        report = self.finish()
+        self.assertEqual(report["gameweeks"]["4"]["calculate_metrics"]["error"], "no rows")
+        self.assertEqual(report["stages"]["calculate_metrics"]["errors"], 1)
+
+    def test_storage_rows_and_round_trips(self):
+        storage = SQLiteStorage(os.path.join(self.tmp, "test.db"))
+        instrumentation.start_run()
+        with instrumentation.stage("upload_to_mongo", 1):
+            counts = storage.upload_many([RAW_FILE])
+        with instrumentation.stage("calculate_metrics", 1):
+            rows = storage.fetch_gameweek_data(1)
+        storage.close()
+
+        report = self.finish()
+        upload = report["gameweeks"]["1"]["upload_to_mongo"]
+        self.assertEqual(upload["rows"], len(rows))
+        self.assertEqual(upload["round_trips"], counts["round_trips"])
+        self.assertEqual(report["gameweeks"]["1"]["calculate_metrics"]["round_trips"], 1)
+        self.assertGreater(report["peak_rss_bytes"], 0)
+
+    def test_peak_memory_growth_of_a_span(self):
+        instrumentation.start_run()
+        #process high water mark at the start and at the end of each span
+        with patch.object(instrumentation, "peak_rss_bytes", side_effect=[100, 150, 150, 150]):
+            with instrumentation.stage("calculate_metrics", 1):
+                pass
+            with instrumentation.stage("calculate_metrics", 2):
+                pass
+        report = self.finish()
+
+        first, second = (report["gameweeks"][gw]["calculate_metrics"] for gw in ("1", "2"))
+        self.assertEqual((first["process_peak_rss_bytes"], first["peak_rss_growth_bytes"]), (150, 50))
+        self.assertEqual((second["process_peak_rss_bytes"], second["peak_rss_growth_bytes"]), (150, 0))
+        self.assertEqual(report["stages"]["calculate_metrics"]["peak_rss_growth_bytes"], 50)
+
+    def test_prometheus_exposition(self):
+        instrumentation.start_run()
+        with instrumentation.stage("data_extraction", 2):
+            instrumentation.count(bytes=512)
+        self.finish()
+
+        with open(self.prometheus_path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('fpl_pipeline_stage_bytes{stage="data_extraction"} 512', lines)
+        self.assertIn("# TYPE fpl_pipeline_run_seconds gauge", lines)
+        self.assertTrue(any(line.startswith('fpl_pipeline_gameweek_seconds{stage="data_extraction",gameweek="2"} ')
+                            for line in lines))
+        for line in lines:
+            if not line.startswith("#"):
+                float(line.rsplit(" ", 1)[1])
+
+    def test_profile_capture(self):
+        profiles = os.path.join(self.tmp, "profiles")
+        instrumentation.start_run(profile_stage="calculate_metrics", profile_dir=profiles)
+        for gw in (1, 2):
+            with instrumentation.stage("calculate_metrics", gw):
+                sorted(range(10000), key=lambda x: -x)
+        with instrumentation.stage("upload_to_mongo", 1):
+            pass
+        report = self.finish()
+
+        self.assertEqual(sorted(os.listdir(profiles)),
+                         ["calculate_metrics.txt", "calculate_metrics_gw1.prof", "calculate_metrics_gw2.prof"])
+        self.assertEqual(len(report["profiles"]), 2)
+        with open(report["profile_summary"]) as f:
+            self.assertIn("function calls", f.read())
+
+if __name__ == "__main__":
+    unittest.main()
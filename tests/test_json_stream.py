@@ -0,0 +1,161 @@
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import types
+import unittest
+from unittest.mock import patch
+
+#to resolve backend and frontend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+from data_layer import database, storage
+from data_layer.database import parse_fields, projection
+import response_cache
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')))[:3]
+
+
+class TestFields(unittest.TestCase):
+
+    def test_parse_fields(self):
+        self.assertIsNone(parse_fields(""))
+        self.assertEqual(parse_fields("name, statistics.minutes"), ["name", "statistics.minutes"])
+        #inside a selected field, or repeated
+        self.assertEqual(parse_fields("statistics.minutes,statistics,name,name"), ["statistics", "name"])
+        for bad in ("a;b", "$where", "a..b", "statistics.'x'"):
+            with self.assertRaises(ValueError):
+                parse_fields(bad)
+
+    def test_projection(self):
+        self.assertEqual(projection(), {"_id": False})
+        self.assertEqual(projection(["name"]), {"_id": False, "name": True})
+
+    def test_mongo_reads_raise(self):
+        with patch.object(database, "get_db", side_effect=ConnectionError("no server")):
+            with self.assertRaises(ConnectionError):
+                list(database.iter_docs("analytics", {}))
+            with self.assertRaises(ConnectionError):
+                database.next_after("analytics", {}, limit=2)
+
+
+class TestPagedReads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        storage.upload_many(RAW_FILES)
+        storage.save_gameweeks_data([{"_id": f"summary_gw_{gw}", "gameweek": gw, "mvp": {"name": "A", "points": gw},
+                                      "top_scorers": [], "dream_team": [], "team_stats": {}}
+                                     for gw in (1, 2, 3, 4, 5)])
+        cls.gameweeks = storage.fetch_gameweek_ids()
+        cls.player_id = storage.fetch_gameweek_data(1)[0]["player_id"]
+
+        import app
+        cls.client = app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        response_cache.cache.clear()
+
+    def test_pages_cover_everything_once(self):
+        seen = []
+        after = None
+        while True:
+            docs, after = storage.gameweek_summaries_page(after=after, limit=2)
+            #a generator, the page is never a list in memory
+            self.assertIsInstance(docs, types.GeneratorType)
+            seen += [doc["gameweek"] for doc in docs]
+            if after is None:
+                break
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+
+        docs, after = storage.gameweek_summaries_page(after=4, limit=1)
+        self.assertEqual(([doc["gameweek"] for doc in docs], after), ([5], None))
+
+    def test_fields_are_pushed_down(self):
+        docs, _ = storage.player_records_page(self.player_id, fields=["gameweek", "statistics.minutes", "nothing"])
+        docs = list(docs)
+        self.assertEqual(len(docs), len(RAW_FILES))
+        for doc in docs:
+            #missing fields are left out, like a mongo projection
+            self.assertEqual(set(doc), {"gameweek", "statistics"})
+            self.assertEqual(set(doc["statistics"]), {"minutes"})
+
+        players = storage.get_storage().fetch_gameweek_players(1, fields=["name"])
+        self.assertEqual(len(players), len(storage.fetch_gameweek_data(1)))
+        self.assertEqual(set(players[0]), {"name"})
+
+    def test_api_follows_next_links(self):
+        url = "/api/gameweeks?limit=2&fields=gameweek"
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append(response.get_json())
+            url = None
+            if "Link" in response.headers:
+                url = response.headers["Link"].split(">")[0].lstrip("<")
+        self.assertEqual(pages, [[{"gameweek": 1}, {"gameweek": 2}], [{"gameweek": 3}, {"gameweek": 4}],
+                                 [{"gameweek": 5}]])
+
+    def test_ndjson(self):
+        response = self.client.get(f"/api/player/{self.player_id}?format=ndjson&fields=gameweek,player_id")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [{"gameweek": gw, "player_id": self.player_id} for gw in self.gameweeks])
+
+        page = self.client.get(f"/api/player/{self.player_id}?after=1&limit=1")
+        self.assertEqual([doc["gameweek"] for doc in page.get_json()], self.gameweeks[1:2])
+        self.assertEqual(page.headers["X-Next-After"], str(self.gameweeks[1]))
+
+    def test_bad_arguments(self):
+        for query in ("limit=-1", "limit=0", "limit=100000", "after=x", "fields=a;b", "format=xml"):
+            self.assertEqual(self.client.get("/api/gameweeks?" + query).status_code, 400, query)
+
+    def test_storage_errors_are_not_served_as_pages(self):
+        def failing(after_docs):
+            def page(*args, **kwargs):
+                def docs():
+                    for gw in range(1, after_docs + 1):
+                        yield {"gameweek": gw}
+                    raise sqlite3.OperationalError("disk I/O error")
+                return docs(), None
+            return page
+
+        #before the first document: an error status, not an empty list
+        with patch.object(storage.SQLiteStorage, "gameweek_summaries_page", side_effect=failing(0)):
+            response = self.client.get("/api/gameweeks")
+        self.assertEqual(response.status_code, 500)
+
+        #after it: the body is cut short and not cached
+        with patch.object(storage.SQLiteStorage, "gameweek_summaries_page", side_effect=failing(2)):
+            response = self.client.get("/api/gameweeks?format=ndjson")
+            with self.assertRaises(sqlite3.OperationalError):
+                response.get_data()
+        self.assertEqual(response_cache.cache.stats()["size"], 0)
+        self.assertEqual(self.client.get("/api/gameweeks?format=ndjson").headers["X-Cache"], "MISS")
+
+    def test_gameweek_page_reads_only_its_columns(self):
+        with patch.object(storage.SQLiteStorage, "fetch_gameweek_players", autospec=True,
+                          side_effect=storage.SQLiteStorage.fetch_gameweek_players) as fetch:
+            self.assertEqual(self.client.get("/gameweek/1").status_code, 200)
+        fields = fetch.call_args.kwargs["fields"]
+        self.assertIn("statistics.minutes", fields)
+        self.assertNotIn("statistics", fields)
+
+if __name__ == "__main__":
+    unittest.main()
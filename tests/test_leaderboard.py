@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from data_layer.tensor_store import TensorStore, open_store
+from algorithm.leaderboard import Leaderboard, get_leaderboard, refresh_leaderboard
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from test_form_engine import season_docs, TEAMS
+
+
+class TestLeaderboard(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.by_gameweek = season_docs()
+        store = TensorStore(self.path)
+        for gw, docs in self.by_gameweek.items():
+            store.append_gameweek(gw, docs)
+        self.leaderboard = Leaderboard.build(open_store(self.path))
+
+        rows = []
+        for gw in sorted(self.by_gameweek):
+            for doc in self.by_gameweek[gw]:
+                rows.append(dict(doc["statistics"], player_id=doc["player_id"], team=doc["team"],
+                                 position_id=doc["position_id"]))
+        df = pd.DataFrame(rows)
+        self.totals = df.groupby("player_id").agg(
+            {"goals_scored": "sum", "total_points": "sum", "expected_goals": "sum", "minutes": "count",
+             "position_id": "first", "team": "last"}
+        ).rename(columns={"minutes": "matches_played"})
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def expected_top(self, stat, k, frame=None):
+        frame = self.totals if frame is None else frame
+        ranked = sorted(((round(float(v), 2), pid) for pid, v in frame[stat].items()), key=lambda x: (-x[0], x[1]))
+        return [(pid, value) for value, pid in ranked[:k]]
+
+    def test_top_matches_groupby(self):
+        for stat in ("goals_scored", "total_points", "expected_goals", "matches_played"):
+            result = self.leaderboard.top(stat, k=8)
+            self.assertEqual([(p["player_id"], p["value"]) for p in result["players"]], self.expected_top(stat, 8))
+            self.assertEqual(result["total"], len(self.totals))
+
+    def test_position_and_team_groups(self):
+        forwards = self.totals[self.totals["position_id"] == 4]
+        result = self.leaderboard.top("total_points", k=5, position="fwd")
+        self.assertEqual([(p["player_id"], p["value"]) for p in result["players"]],
+                         self.expected_top("total_points", 5, forwards))
+
+        #player 7 moved to Team 1 and is ranked with their latest team
+        team = self.totals[self.totals["team"] == TEAMS[0]]
+        result = self.leaderboard.top("goals_scored", k=100, team=TEAMS[0])
+        self.assertIn(7, [p["player_id"] for p in result["players"]])
+        self.assertEqual(result["total"], len(team))
+
+    def test_ranks_are_competition_ranks(self):
+        values = self.totals["goals_scored"]
+        for player_id, value in values.items():
+            result = self.leaderboard.rank(player_id, "goals_scored")
+            self.assertEqual(result["ranks"]["overall"]["rank"], int((values > value).sum()) + 1)
+
+        ranks = [p["rank"] for p in self.leaderboard.top("goals_scored", k=len(values))["players"]]
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertIsNone(self.leaderboard.rank(999, "goals_scored"))
+
+    def test_pagination(self):
+        full = self.leaderboard.top("total_points", k=20)["players"]
+        page = self.leaderboard.top("total_points", k=5, offset=10)["players"]
+        self.assertEqual(page, full[10:15])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            self.leaderboard.top("unknown_stat")
+        with self.assertRaises(ValueError):
+            self.leaderboard.top("goals_scored", team="Unknown FC")
+        with self.assertRaises(ValueError):
+            self.leaderboard.top("goals_scored", team=TEAMS[0], position=1)
+
+    def test_saved_leaderboard_is_refreshed_with_the_store(self):
+        saved = refresh_leaderboard(self.path)
+        loaded = get_leaderboard(self.path)
+        self.assertEqual(loaded.top("total_points", k=5), saved.top("total_points", k=5))
+
+        time.sleep(0.01)
+        TensorStore(self.path).append_gameweek(11, self.by_gameweek[1])
+        refreshed = get_leaderboard(self.path)
+        self.assertIsNot(refreshed, loaded)
+        self.assertEqual(refreshed.meta["gameweeks"][-1], 11)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import os
+import sys
+import unittest
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from main_backend import profile_argument
+
+
+class TestArguments(unittest.TestCase):
+
+    def test_profile_stage(self):
+        self.assertIsNone(profile_argument(["main_backend.py", "--force"]))
+        self.assertEqual(profile_argument(["main_backend.py", "--profile", "calculate_metrics", "--force"]),
+                         "calculate_metrics")
+        for argv in (["main_backend.py", "--profile"], ["main_backend.py", "--profile", "--force"],
+                     ["main_backend.py", "--profile", "metrics"]):
+            with self.assertRaises(ValueError):
+                profile_argument(argv)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch, MagicMock
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+import pipeline
+from pipeline import Pipeline, Stage
+from data_layer.api_ingestion import make_session
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from test_api_ingestion import StubHandler
+
+def sleeper(seconds, events=None, name=None):
+    def function(item):
+        start = time.perf_counter()
+        time.sleep(seconds)
+        if events is not None:
+            events.append((name, item, start, time.perf_counter()))
+        return item
+    return function
+
+#largest number of the events running at the same time
+def concurrency(events):
+    edges = sorted([(start, 1) for _, _, start, _ in events] + [(end, -1) for _, _, _, end in events],
+                   key=lambda edge: (edge[0], edge[1]))
+    running = most = 0
+    for _, step in edges:
+        running += step
+        most = max(most, running)
+    return most
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_stages_overlap(self):
+        events = []
+        stages = [Stage(name, sleeper(0.05, events, name)) for name in ("a", "b", "c")]
+        results, report = Pipeline(stages, queue_size=2).run(range(8))
+
+        self.assertEqual(sorted(results), list(range(8)))
+        for stats in report["stages"].values():
+            self.assertEqual(stats["processed"], 8)
+        #every item goes through the stages in order
+        for item in range(8):
+            spans = {name: (start, end) for name, i, start, end in events if i == item}
+            self.assertLessEqual(spans["a"][1], spans["b"][0])
+            self.assertLessEqual(spans["b"][1], spans["c"][0])
+        #while one item is in b, a later one is already in a
+        self.assertGreater(concurrency(events), 1)
+
+    def test_slowest_stage_runs_its_workers_together(self):
+        events = []
+        stages = [Stage("fast", sleeper(0.01)), Stage("slow", sleeper(0.1, events, "slow"), workers=4),
+                  Stage("end", sleeper(0.01))]
+        results, report = Pipeline(stages, queue_size=4).run(range(8))
+        self.assertEqual(sorted(results), list(range(8)))
+        self.assertEqual(len(events), 8)
+        self.assertGreater(concurrency(events), 1)
+
+    def test_metrics_pool_is_started_with_spawn(self):
+        pool = pipeline.start_pool(2)
+        try:
+            self.assertEqual(pool._mp_context.get_start_method(), "spawn")
+            self.assertEqual(len(pool._processes), 2)
+            self.assertNotEqual(pool.submit(os.getpid).result(), os.getpid())
+        finally:
+            pool.shutdown()
+
+    def test_errors_are_isolated(self):
+        def fails_on_three(item):
+            if item == 3:
+                raise ValueError("bad gameweek")
+            return item
+
+        drop_odd = lambda item: item if item % 2 == 0 else None
+        stages = [Stage("a", fails_on_three, workers=2), Stage("b", drop_odd)]
+        results, report = Pipeline(stages).run(range(6))
+
+        self.assertEqual(sorted(results), [0, 2, 4])
+        self.assertEqual(report["failed"], {3: {"stage": "a", "error": "bad gameweek"}})
+        self.assertEqual(report["stages"]["a"]["failed"], 1)
+        self.assertEqual(report["stages"]["b"]["skipped"], 2)
+
+    def test_queues_are_bounded(self):
+        produced = []
+        consumed = []
+        backlog = []
+        lock = threading.Lock()
+
+        def fast(item):
+            with lock:
+                produced.append(item)
+                backlog.append(len(produced) - len(consumed))
+            return item
+
+        def slow(item):
+            time.sleep(0.02)
+            with lock:
+                consumed.append(item)
+            return item
+
+        Pipeline([Stage("fast", fast), Stage("slow", slow)], queue_size=2).run(range(20))
+        #at most the queue plus the one being processed plus the one being put
+        self.assertLessEqual(max(backlog), 2 + 2)
+        self.assertEqual(len(consumed), 20)
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubHandler.hits = {}
+        self.out_path = tempfile.mkdtemp()
+        self.reports = tempfile.mkdtemp()
+        self.session = make_session(pool_size=2, retries=3, backoff=0)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.out_path)
+        shutil.rmtree(self.reports)
+
+    def run_pipeline(self):
+        return pipeline.run_pipeline(session=self.session, base_url=self.base_url, out_path=self.out_path,
+                                     metrics_workers=1, report_path=os.path.join(self.reports, "report.json"),
+                                     prometheus_path=os.path.join(self.reports, "metrics.prom"),
+                                     pending_path=os.path.join(self.reports, "pending.json"))
+
+    def test_failed_gameweek_does_not_stop_the_others(self):
+        def upload(path):
+            return None if path.endswith("gameweek_2.json") else {"upserted": 1}
+
+        season = MagicMock(return_value={"last_updated_gw": 3})
+        with patch.object(pipeline, "upload_to_mongo", side_effect=upload), \
+             patch.object(pipeline, "append_gameweek_files") as tensor, \
+             patch.object(pipeline, "metrics_for_gameweek", side_effect=lambda gw, **kw: {"gameweek": gw}), \
+             patch.object(pipeline, "refresh_leaderboard") as leaderboard, \
+             patch.object(pipeline, "update_season_incremental", season), \
+             patch.object(pipeline, "publish_data_version", return_value={"version": 7}) as publish, \
+             patch.object(pipeline, "publish_snapshot") as snapshot:
+            result = self.run_pipeline()
+
+        self.assertEqual(result["uploaded"], [1, 3])
+        self.assertEqual(result["updated"], [1, 3])
+        self.assertEqual(result["report"]["pipeline"]["failed"], {2: {"stage": "upload", "error": "upload failed"}})
+        self.assertEqual(tensor.call_count, 2)
+
+        #instrumented per gameweek, the failed upload is recorded in its span
+        gameweeks = result["report"]["gameweeks"]
+        self.assertGreater(gameweeks["1"]["data_extraction"]["bytes"], 0)
+        self.assertEqual(gameweeks["3"]["data_extraction"]["rows"], 1)
+        self.assertEqual(gameweeks["2"]["upload_to_mongo"]["error"], "upload failed")
+        self.assertNotIn("calculate_metrics", gameweeks["2"])
+        self.assertEqual(result["report"]["stages"]["calculate_season_stats"]["calls"], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.reports, "metrics.prom")))
+
+        #season and leaderboards once for the whole run
+        season.assert_called_once_with([1, 3])
+        leaderboard.assert_called_once()
+        publish.assert_called_once_with(3)
+        snapshot.assert_called_once_with(7, pipeline.player_evaluator.ANALYTICS_FOLDER)
+
+        #the failed gameweek is downloaded again next time
+        self.assertEqual(sorted(os.listdir(self.out_path)), ["gameweek_1.json", "gameweek_3.json"])
+
+    def test_raising_upload_is_downloaded_again(self):
+        def upload(path):
+            if path.endswith("gameweek_2.json"):
+                raise sqlite3.OperationalError("database is locked")
+            return {"upserted": 1}
+
+        with patch.object(pipeline, "upload_to_mongo", side_effect=upload), \
+             patch.object(pipeline, "append_gameweek_files"), \
+             patch.object(pipeline, "metrics_for_gameweek", side_effect=lambda gw, **kw: {"gameweek": gw}), \
+             patch.object(pipeline, "refresh_leaderboard"), \
+             patch.object(pipeline, "update_season_incremental", return_value={"last_updated_gw": 3}), \
+             patch.object(pipeline, "publish_data_version", return_value={"version": 1}), \
+             patch.object(pipeline, "publish_snapshot"):
+            result = self.run_pipeline()
+
+        self.assertEqual(result["report"]["pipeline"]["failed"],
+                         {2: {"stage": "upload", "error": "database is locked"}})
+        self.assertEqual(sorted(os.listdir(self.out_path)), ["gameweek_1.json", "gameweek_3.json"])
+
+    def test_failed_metrics_are_analysed_by_the_next_run(self):
+        attempts = []
+
+        def metrics(gw, **kwargs):
+            attempts.append(gw)
+            if gw == 2 and attempts.count(2) == 1:
+                raise ValueError("no rows")
+            return {"gameweek": gw}
+
+        season = MagicMock(return_value={"last_updated_gw": 3})
+        with patch.object(pipeline, "upload_to_mongo", return_value={"upserted": 1}) as upload, \
+             patch.object(pipeline, "append_gameweek_files"), \
+             patch.object(pipeline, "metrics_for_gameweek", side_effect=metrics), \
+             patch.object(pipeline, "refresh_leaderboard"), \
+             patch.object(pipeline, "update_season_incremental", season), \
+             patch.object(pipeline, "publish_data_version", return_value={"version": 1}), \
+             patch.object(pipeline, "publish_snapshot"):
+            first = self.run_pipeline()
+            #gameweek 2 is uploaded and folded, its summary is still missing
+            self.assertEqual((first["uploaded"], first["updated"], first["failed"]), ([1, 2, 3], [1, 3], [2]))
+            season.assert_called_once_with([1, 2, 3])
+            self.assertEqual(pipeline.read_pending(os.path.join(self.reports, "pending.json")), [2])
+
+            upload.reset_mock()
+            second = self.run_pipeline()
+        #only the metrics run again, then the season is folded with the new summary
+        upload.assert_not_called()
+        self.assertEqual((second["uploaded"], second["updated"], second["failed"]), ([], [2], []))
+        self.assertEqual(season.call_args_list[-1].args, ([2],))
+        self.assertEqual(pipeline.read_pending(os.path.join(self.reports, "pending.json")), [])
+
+    def test_nothing_pending(self):
+        with patch.object(pipeline, "upload_to_mongo", return_value={}), \
+             patch.object(pipeline, "append_gameweek_files"), \
+             patch.object(pipeline, "metrics_for_gameweek", return_value=None), \
+             patch.object(pipeline, "refresh_leaderboard"), \
+             patch.object(pipeline, "update_season_incremental", return_value={"last_updated_gw": 3}) as season, \
+             patch.object(pipeline, "publish_data_version") as publish, \
+             patch.object(pipeline, "publish_snapshot") as snapshot:
+            first = self.run_pipeline()
+            second = self.run_pipeline()
+
+        #unchanged metrics are skipped, the uploaded rows are still folded into the season, once
+        self.assertEqual((first["uploaded"], first["updated"]), ([1, 2, 3], []))
+        self.assertEqual(second["uploaded"], [])
+        season.assert_called_once_with([1, 2, 3])
+        #new raw rows are published even when no summary changed, nothing at all the second time
+        publish.assert_called_once_with(3)
+        snapshot.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+#to resolve backend and frontend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+import algorithm.player_compare as player_compare
+from algorithm.player_compare import compare_players, parse_ids, parse_stats, MAX_PLAYERS
+from algorithm.form_engine import FormEngine
+from data_layer import storage
+from data_layer.database import load_player_docs
+from data_layer.tensor_store import TensorStore, open_store
+import response_cache
+
+#the first three gameweeks, in gameweek order
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')),
+                   key=lambda path: int(path.rsplit("_", 1)[1].split(".")[0]))[:3]
+
+
+class TestArguments(unittest.TestCase):
+
+    def test_parse_ids(self):
+        self.assertEqual(parse_ids(["3,1", "3", " 2 "]), [3, 1, 2])
+        for bad in ([], [""], ["1,x"], [",".join(str(i) for i in range(MAX_PLAYERS + 1))]):
+            with self.assertRaises(ValueError):
+                parse_ids(bad)
+
+    def test_parse_stats(self):
+        self.assertEqual(parse_stats(None), player_compare.DEFAULT_STATS)
+        self.assertEqual(parse_stats("assists, assists,bps"), ["assists", "bps"])
+        for bad in ("statistics.minutes", "foo", "bps,name"):
+            with self.assertRaises(ValueError):
+                parse_stats(bad)
+
+
+class TestComparePlayers(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        storage.upload_many(RAW_FILES)
+
+        cls.docs = {}
+        store = TensorStore(os.path.join(cls.tmp, "tensor"))
+        for path in RAW_FILES:
+            docs = load_player_docs(path)
+            store.append_gameweek(docs[0]["gameweek"], docs)
+            for doc in docs:
+                cls.docs[(doc["player_id"], doc["gameweek"])] = doc
+        cls.engine = FormEngine(open_store(os.path.join(cls.tmp, "tensor")))
+        cls.gameweeks = sorted({gw for _, gw in cls.docs})
+
+        #a player with every gameweek and one missing the first
+        cls.regular = next(pid for pid, gw in cls.docs if all((pid, g) in cls.docs for g in cls.gameweeks))
+        cls.late = next((pid for pid, gw in cls.docs if (pid, cls.gameweeks[0]) not in cls.docs), None)
+
+        import app
+        cls.client = app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        response_cache.cache.clear()
+        self.engine_patch = patch.object(player_compare, "get_form_engine", return_value=self.engine)
+        self.engine_patch.start()
+
+    def tearDown(self):
+        self.engine_patch.stop()
+
+    def stat(self, player_id, gw, stat):
+        doc = self.docs.get((player_id, gw))
+        return float(doc["statistics"].get(stat) or 0) if doc else None
+
+    def test_totals_match_the_records(self):
+        ids = [self.regular] + ([self.late] if self.late else [])
+        stats = ["total_points", "goals_scored", "expected_goals"]
+        result = compare_players(ids, stats)
+        self.assertEqual(result["gameweeks"], self.gameweeks)
+        self.assertEqual([p["player_id"] for p in result["players"]], ids)
+
+        for player in result["players"]:
+            pid = player["player_id"]
+            minutes = sum(self.stat(pid, gw, "minutes") or 0 for gw in self.gameweeks)
+            self.assertEqual(player["minutes"], minutes)
+            self.assertEqual(player["matches_played"], sum((pid, gw) in self.docs for gw in self.gameweeks))
+            for stat in stats:
+                series = [self.stat(pid, gw, stat) for gw in self.gameweeks]
+                self.assertEqual(player["series"][stat], [None if v is None else round(v, 2) for v in series])
+                total = sum(v for v in series if v is not None)
+                self.assertAlmostEqual(player["totals"][stat], total, places=2)
+                if minutes:
+                    self.assertAlmostEqual(player["per_90"][stat], round(total * 90 / minutes, 2), places=2)
+                else:
+                    self.assertIsNone(player["per_90"][stat])
+                self.assertTrue(0 <= player["percentiles"][stat] <= 100)
+
+    def test_window_and_missing_players(self):
+        gw = self.gameweeks[-1]
+        result = compare_players([self.regular, 99999], ["total_points"], from_gw=gw, to_gw=gw)
+        self.assertEqual(result["gameweeks"], [gw])
+        self.assertEqual(result["missing"], [99999])
+        self.assertEqual(result["players"][0]["totals"]["total_points"], self.stat(self.regular, gw, "total_points"))
+
+        for from_gw, to_gw in ((3, 2), (-5, None), (0, 3), (1, 2000000), (None, 39)):
+            with self.assertRaises(ValueError):
+                compare_players([self.regular], from_gw=from_gw, to_gw=to_gw)
+
+    def test_one_query_for_every_player(self):
+        ids = sorted({pid for pid, _ in self.docs})[:MAX_PLAYERS]
+        with patch.object(storage.SQLiteStorage, "fetch_records_of_players", autospec=True,
+                          side_effect=storage.SQLiteStorage.fetch_records_of_players) as fetch:
+            result = compare_players(ids)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(len(result["players"]) + len(result["missing"]), len(ids))
+
+    def test_without_the_form_engine(self):
+        with patch.object(player_compare, "get_form_engine", side_effect=FileNotFoundError("no tensor store")):
+            result = compare_players([self.regular], ["total_points"])
+        self.assertIsNone(result["players"][0]["percentiles"])
+        #stats the tensor store does not keep have no percentile
+        result = compare_players([self.regular], ["not_a_stat"])
+        self.assertEqual(result["players"][0]["percentiles"], {"not_a_stat": None})
+
+    def test_api(self):
+        response = self.client.get(f"/api/players/compare?ids={self.regular},99999&stats=total_points")
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual([p["player_id"] for p in body["players"]], [self.regular])
+        self.assertEqual(body["missing"], [99999])
+
+        for query in ("", "ids=x", "ids=1&stats=a;b", "ids=1&from_gw=3&to_gw=2", "ids=1&from_gw=x",
+                      "ids=1&to_gw=2000000", "ids=1&from_gw=-5", "ids=1&stats=foo"):
+            self.assertEqual(self.client.get("/api/players/compare?" + query).status_code, 400, query)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,13 +2,22 @@
 import unittest
 import sys
 import os
+import tempfile
+import shutil
 import pandas as pd
 
 #to resolve backend imports
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
 
-from backend.algorithm.player_evaluator import best_players, top_teams
+from algorithm.player_evaluator import (best_players, top_teams, dream_team_picks, docs_to_frame,
+                                        build_gameweek_summary, summarise_gameweeks, gameweek_digests,
+                                        changed_gameweeks, write_summary_file)
+import algorithm.player_evaluator as player_evaluator
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic_stats import synthetic_gameweek, legacy_gameweek_summary
 
 class TestPlayerEvaluation(unittest.TestCase):
 
@@ -73,5 +82,75 @@ class TestPlayerEvaluation(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]['team'], 'Team C')
 
+    def test_dream_team_picks_formation(self):
+        dream_team = dream_team_picks(self.df)
+        names = [p['name'] for p in dream_team]
+        #goalkeeper first, then defenders by points, then the striker
+        self.assertEqual(names, ['Keeper A', 'Defender Top', 'Defender Bad', 'Striker'])
+
+class TestVectorisedMetrics(unittest.TestCase):
+
+    def test_same_summary_as_row_by_row_version(self):
+        docs = synthetic_gameweek(2000, gameweek_id=5, seed=1, unique_points=True)
+        expected = legacy_gameweek_summary(docs, 5)
+        result = build_gameweek_summary(docs_to_frame(docs), 5)
+        self.assertEqual(result, expected)
+
+    def test_same_points_when_there_are_ties(self):
+        #with ties only the order among equal points may differ
+        docs = synthetic_gameweek(3000, gameweek_id=2, seed=7)
+        expected = legacy_gameweek_summary(docs, 2)
+        result = build_gameweek_summary(docs_to_frame(docs), 2)
+
+        self.assertEqual(result['mvp'], expected['mvp'])
+        self.assertEqual(result['top_scorers'], expected['top_scorers'])
+        self.assertEqual(result['team_stats'], expected['team_stats'])
+        self.assertEqual([p['total_points'] for p in result['dream_team']],
+                         [p['total_points'] for p in expected['dream_team']])
+
+class TestManyGameweeks(unittest.TestCase):
+
+    def test_parallel_summaries_match_serial(self):
+        docs = []
+        for gw in range(1, 6):
+            docs.extend(synthetic_gameweek(300, gameweek_id=gw, seed=gw, unique_points=True))
+
+        serial = summarise_gameweeks(docs, workers=1)
+        parallel = summarise_gameweeks(docs, workers=3)
+
+        self.assertEqual([s['gameweek'] for s in parallel], [1, 2, 3, 4, 5])
+        self.assertEqual(parallel, serial)
+
+class TestMetricsMemoisation(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.original_folder = player_evaluator.ANALYTICS_FOLDER
+        player_evaluator.ANALYTICS_FOLDER = self.folder
+        self.docs = synthetic_gameweek(50, gameweek_id=1) + synthetic_gameweek(50, gameweek_id=2)
+
+    def tearDown(self):
+        player_evaluator.ANALYTICS_FOLDER = self.original_folder
+        shutil.rmtree(self.folder)
+
+    def test_digest_ignores_fetch_order(self):
+        self.assertEqual(gameweek_digests(self.docs), gameweek_digests(list(reversed(self.docs))))
+
+    def test_only_changed_gameweeks_are_recomputed(self):
+        digests = gameweek_digests(self.docs)
+        for gw in digests:
+            write_summary_file({"gameweek": gw})
+
+        self.assertEqual(changed_gameweeks(digests, dict(digests)), [])
+        self.assertEqual(changed_gameweeks(digests, dict(digests), force=True), [1, 2])
+
+        self.docs[0]["statistics"]["total_points"] += 1
+        self.assertEqual(changed_gameweeks(gameweek_digests(self.docs), digests), [1])
+
+    def test_missing_file_is_recomputed(self):
+        digests = gameweek_digests(self.docs)
+        write_summary_file({"gameweek": 1})
+        self.assertEqual(changed_gameweeks(digests, dict(digests)), [2])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
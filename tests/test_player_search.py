@@ -0,0 +1,174 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+import algorithm.player_search as player_search
+from algorithm.player_search import PlayerSearch, fold, words
+from data_layer import database, storage
+import response_cache
+from data_layer.database import load_player_docs, build_players_directory
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')))
+
+def names(results):
+    return [player["name"] for player in results]
+
+
+class TestPlayerSearch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        docs = []
+        for path in RAW_FILES:
+            docs.extend(load_player_docs(path))
+        cls.players = build_players_directory(docs)
+        cls.index = PlayerSearch(cls.players)
+
+    def setUp(self):
+        player_search._search = None
+
+    def test_folding(self):
+        self.assertEqual(fold("Martin Ødegaard"), "martin odegaard")
+        self.assertEqual(words("Rayan Aït-Nouri"), ["rayan", "ait", "nouri"])
+        self.assertEqual(words("Đorđe Petrović"), ["dorde", "petrovic"])
+        self.assertEqual(words("Ferdi Kadıoğlu"), ["ferdi", "kadioglu"])
+
+    def test_accents_are_optional(self):
+        self.assertIn("Gabriel dos Santos Magalhães", names(self.index.search("magalhaes")))
+        self.assertIn("Gabriel dos Santos Magalhães", names(self.index.search("MAGALHÃES")))
+        self.assertEqual(names(self.index.search("odegaard"))[0], "Martin Ødegaard")
+
+    def test_prefixes_of_any_word(self):
+        results = self.index.search("salah")
+        self.assertEqual(names(results)[0], "Mohamed Salah")
+        #every word of the query must start a word of the name, in any order
+        self.assertEqual(names(self.index.search("sal moh"))[0], "Mohamed Salah")
+        for player in self.index.search("mart", limit=50):
+            if player["score"] >= 1:
+                self.assertTrue(any(word.startswith("mart") for word in words(player["name"])))
+
+    def test_ranking(self):
+        exact = self.index.search("mohamed salah")[0]
+        self.assertEqual(exact["score"], 3.0)
+        #names starting with the query come before a match on a later word
+        results = self.index.search("martin")
+        scores = [player["score"] for player in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual(names(results)[0].split()[0], "Martin")
+
+    def test_typos(self):
+        self.assertEqual(names(self.index.search("sallah"))[0], "Mohamed Salah")
+        self.assertEqual(names(self.index.search("odegard"))[0], "Martin Ødegaard")
+        self.assertLess(self.index.search("sallah")[0]["score"], 1)
+        self.assertEqual(self.index.search("qqqqzzzz"), [])
+
+    def test_empty_and_limits(self):
+        self.assertEqual(self.index.search(""), [])
+        self.assertEqual(self.index.search("--"), [])
+        self.assertEqual(len(self.index.search("a", limit=3)), 3)
+        self.assertEqual(len(self.index.search("a", limit=1000)), player_search.MAX_LIMIT)
+
+    def test_search_is_fast(self):
+        queries = ["sa", "salah", "odegard", "martin z", "b", "fernandez"]
+        start = time.perf_counter()
+        for _ in range(100):
+            for query in queries:
+                self.index.search(query)
+        per_query = (time.perf_counter() - start) / (100 * len(queries))
+        self.assertLess(per_query, 0.001)
+
+    def test_rebuilt_when_the_version_changes(self):
+        with patch.object(player_search, "get_storage") as get_storage:
+            get_storage.return_value.fetch_players_directory.return_value = self.players[:10]
+            first = player_search.get_player_search("v1")
+            self.assertIs(player_search.get_player_search("v1"), first)
+            self.assertEqual(len(first), 10)
+
+            get_storage.return_value.fetch_players_directory.return_value = self.players
+            second = player_search.get_player_search("v2")
+        self.assertEqual(len(second), len(self.players))
+        self.assertEqual(get_storage.return_value.fetch_players_directory.call_count, 2)
+
+    def test_failed_build_is_not_cached(self):
+        def failed_read(skip=0, limit=0):
+            database.read_error("DB error: timed out")
+            return []
+
+        with patch.object(player_search, "get_storage") as get_storage:
+            directory = get_storage.return_value.fetch_players_directory
+            directory.side_effect = failed_read
+            self.assertEqual(player_search.get_player_search("v1").search("a"), [])
+
+            #an empty directory without an error is not kept either
+            directory.side_effect = None
+            directory.return_value = []
+            self.assertEqual(len(player_search.get_player_search("v1")), 0)
+
+            directory.return_value = self.players
+            index = player_search.get_player_search("v1")
+            self.assertEqual(len(index), len(self.players))
+            self.assertIs(player_search.get_player_search("v1"), index)
+        self.assertEqual(directory.call_count, 3)
+
+
+class TestSearchViews(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        storage.upload_many(RAW_FILES[:2])
+
+        import app
+        cls.client = app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        #nothing published in this database, the index of another test could share its version
+        player_search._search = None
+
+    def test_search_endpoint(self):
+        results = self.client.get("/api/search?q=salha&limit=3").get_json()
+        self.assertEqual(results[0]["name"], "Mohamed Salah")
+        self.assertLessEqual(len(results), 3)
+        self.assertEqual(self.client.get("/api/search").get_json(), [])
+
+    def test_player_by_name_is_one_player(self):
+        records = self.client.get("/api/player/odegaard").get_json()
+        self.assertEqual({record["name"] for record in records}, {"Martin Ødegaard"})
+        self.assertEqual(len({record["player_id"] for record in records}), 1)
+        self.assertEqual(self.client.get("/player/qqqqzzzz").status_code, 404)
+
+    def test_player_page_reads_one_document(self):
+        response_cache.cache.clear()
+        with patch.object(storage.SQLiteStorage, "fetch_player", autospec=True,
+                          side_effect=storage.SQLiteStorage.fetch_player) as fetch, \
+                patch.object(storage.SQLiteStorage, "fetch_player_records") as records:
+            self.assertIn("Mohamed Salah", self.client.get("/player/salah").get_data(as_text=True))
+            series = self.client.get("/api/player/salah/series").get_json()
+        self.assertEqual(fetch.call_count, 2)
+        records.assert_not_called()
+        self.assertEqual(series["name"], "Mohamed Salah")
+        self.assertEqual(len(series["series"]["gameweek"]), series["appearances"])
+        self.assertEqual(self.client.get("/api/player/qqqqzzzz/series").status_code, 404)
+
+if __name__ == "__main__":
+    unittest.main()
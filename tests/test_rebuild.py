@@ -0,0 +1,136 @@
+#full rebuild on the embedded sqlite backend, readers must only ever see the old or the new content
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+import rebuild
+#the copies of the modules used by the rebuild
+import snapshots
+from data_layer import storage, tensor_store
+from data_layer.tensor_store import open_store
+import algorithm.player_evaluator as player_evaluator
+import algorithm.season_evaluator as season_evaluator
+from algorithm.season_totals import comparable
+
+RAW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer', 'raw')
+RAW_FILES = rebuild.raw_files(RAW_PATH)
+
+
+class TestRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "test.db")
+        self.patches = [
+            patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": self.db_path}),
+            patch.object(tensor_store, 'TENSOR_PATH', os.path.join(self.tmp, "tensor")),
+            patch.object(snapshots, 'SNAPSHOT_PATH', os.path.join(self.tmp, "snapshots")),
+            patch.object(player_evaluator, 'ANALYTICS_FOLDER', os.path.join(self.tmp, "analytics")),
+            patch.object(season_evaluator, 'ANALYTICS_FOLDER', os.path.join(self.tmp, "analytics")),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        storage.close_storage()
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_rebuild(self, raw_path=RAW_PATH, workers=2):
+        return rebuild.rebuild(raw_path, workers=workers, report_path=os.path.join(self.tmp, "report.json"),
+                               prometheus_path=os.path.join(self.tmp, "metrics.prom"))
+
+    def test_rebuild_matches_the_incremental_pipeline(self):
+        result = self.run_rebuild()
+        gameweeks = storage.fetch_gameweek_ids()
+        self.assertEqual(result["gameweeks"], gameweeks)
+        self.assertEqual(len(gameweeks), len(RAW_FILES))
+
+        #summaries recomputed from the database by the usual evaluators
+        stored = {gw: storage.fetch_gameweek_summary(gw) for gw in gameweeks}
+        expected = player_evaluator.calculate_metrics_many(gameweeks, workers=1, force=True)
+        for summary in expected:
+            self.assertEqual(stored[summary["gameweek"]], summary)
+
+        season = season_evaluator.calculate_season_stats(engine="pandas", save=False)
+        with open(season_evaluator.season_file_path()) as f:
+            self.assertEqual(comparable(json.load(f)), comparable(season))
+        #same digest, so the next incremental run skips the season
+        self.assertEqual(season_evaluator.fetch_season_digest(season["_id"]), season["input_digest"])
+
+        #tensor store and leaderboards swapped in with the same gameweeks
+        self.assertEqual(open_store(tensor_store.TENSOR_PATH).index["gameweeks"], gameweeks)
+        self.assertTrue(os.path.exists(os.path.join(tensor_store.TENSOR_PATH, "leaderboard.npz")))
+        self.assertFalse(os.path.exists(tensor_store.TENSOR_PATH + ".staging"))
+
+        #read api snapshot of the new data version
+        directory, manifest = snapshots.current_snapshot()
+        self.assertEqual(manifest["version"], storage.fetch_data_version()["version"])
+        self.assertEqual(len(manifest["files"]), len(gameweeks) + 2)
+
+        self.assertEqual(set(result["report"]["stages"]),
+                         {"data_extraction", "calculate_metrics", "calculate_season_stats", "upload_to_mongo"})
+
+    def test_rebuild_replaces_previous_content(self):
+        #rows of a gameweek that is not in the raw files anymore are gone after the rebuild
+        storage.upload_many(RAW_FILES)
+        storage.get_storage().query("UPDATE raw SET gameweek = 99 WHERE rowid = 1")
+        self.run_rebuild(workers=1)
+        self.assertNotIn(99, storage.fetch_gameweek_ids())
+        self.assertEqual(len(storage.fetch_all_raw_data()), sum(len(rebuild.load_player_docs(f)) for f in RAW_FILES))
+
+    def test_readers_never_see_a_partial_rebuild(self):
+        #previous content: the first two gameweeks only
+        small = os.path.join(self.tmp, "small")
+        os.makedirs(small)
+        for path in RAW_FILES[:2]:
+            shutil.copy(path, small)
+        self.run_rebuild(raw_path=small, workers=1)
+        before = self.counts(sqlite3.connect(self.db_path))
+
+        seen = set()
+        errors = []
+        done = threading.Event()
+
+        def reader():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            while not done.is_set():
+                try:
+                    seen.add(self.counts(conn))
+                except sqlite3.Error as e:
+                    errors.append(str(e))
+            conn.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.run_rebuild(workers=1)
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        after = self.counts(sqlite3.connect(self.db_path))
+        self.assertEqual(errors, [])
+        self.assertNotEqual(before, after)
+        self.assertTrue(seen <= {before, after}, seen)
+
+    def counts(self, conn):
+        #one statement, so one snapshot of the database
+        return conn.execute(
+            "SELECT (SELECT COUNT(*) FROM raw), (SELECT COUNT(*) FROM analytics), "
+            "(SELECT json_extract(doc, '$.input_digest') FROM season)"
+        ).fetchone()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+#to resolve backend and frontend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+from data_layer import database, storage
+from data_layer.storage import SQLiteStorage
+import response_cache
+from response_cache import ResponseCache, DataVersion
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')))[:2]
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        #b was the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(cache.stats()["size"], 2)
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = ResponseCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("a", 1)
+        clock.now = 4.9
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 5
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_version_is_checked_once_per_ttl(self):
+        clock = Clock()
+        changes = []
+        version = DataVersion(ttl=5, clock=clock, on_change=lambda: changes.append(1))
+        docs = [{"version": 1, "last_updated_gw": 3, "published_at": "2025-10-01T12:00:00+00:00"}]
+
+        with patch.object(response_cache, "get_storage") as get_storage:
+            get_storage.return_value.fetch_data_version.side_effect = lambda: docs[-1]
+            first = version.get()
+            docs.append({"version": 2, "last_updated_gw": 4, "published_at": "2025-10-08T12:00:00+00:00"})
+            self.assertEqual(version.get(), first)
+            clock.now = 5
+            second = version.get()
+
+        self.assertEqual(get_storage.return_value.fetch_data_version.call_count, 2)
+        self.assertNotEqual(first["etag"], second["etag"])
+        self.assertEqual(second["last_updated_gw"], 4)
+        self.assertEqual(changes, [1])
+
+
+class TestCachedViews(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        storage.upload_many(RAW_FILES)
+        storage.save_gameweeks_data([{"_id": "summary_gw_1", "gameweek": 1}, {"_id": "summary_gw_2", "gameweek": 2}])
+        storage.save_season_data({"_id": "season", "last_updated_gw": 2, "input_digest": "a"})
+
+        import app
+        cls.app = app.app
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        #every request checks the version, so the test sees a publication at once
+        response_cache.cache.clear()
+        response_cache.data_version.current = None
+        response_cache.data_version.ttl = 0
+        self.client = self.app.test_client()
+
+    def counted(self, method):
+        original = getattr(SQLiteStorage, method)
+        return patch.object(SQLiteStorage, method, autospec=True, side_effect=original)
+
+    def test_repeated_requests_are_served_from_the_cache(self):
+        with self.counted("gameweek_summaries_page") as fetch:
+            first = self.client.get("/api/gameweeks")
+            #the streamed body is kept once it has been sent
+            first.get_data()
+            second = self.client.get("/api/gameweeks")
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual((first.headers["X-Cache"], second.headers["X-Cache"]), ("MISS", "HIT"))
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual(second.mimetype, "application/json")
+
+    def test_conditional_requests(self):
+        etag = self.client.get("/api/season").headers["ETag"]
+        with self.counted("fetch_season") as fetch:
+            response = self.client.get("/api/season", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        #only the version check (the season stands in for it until something is published)
+        self.assertLessEqual(fetch.call_count, 1)
+
+        response = self.client.get("/api/season", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_publishing_a_version_invalidates(self):
+        storage.publish_data_version(2)
+        first = self.client.get("/api/gameweeks")
+        self.assertIn("Last-Modified", first.headers)
+
+        response = self.client.get("/api/gameweeks", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+        self.assertEqual(response.status_code, 304)
+
+        storage.save_gameweeks_data([{"_id": "summary_gw_3", "gameweek": 3}])
+        storage.publish_data_version(3)
+        second = self.client.get("/api/gameweeks", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.headers["X-Cache"], "MISS")
+        self.assertEqual(len(second.get_json()), 3)
+        self.assertNotEqual(second.headers["ETag"], first.headers["ETag"])
+
+    def test_large_streamed_bodies_are_not_kept(self):
+        with patch.object(response_cache, "CACHE_MAX_BYTES", 10):
+            self.client.get("/api/gameweeks").get_data()
+            response = self.client.get("/api/gameweeks")
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertEqual(len(response.get_json()), len(storage.get_storage().fetch_gameweek_summaries()))
+
+    def test_errors_are_not_cached(self):
+        with self.counted("fetch_gameweek_summary") as fetch:
+            self.assertEqual(self.client.get("/api/gameweek/99").status_code, 404)
+            response = self.client.get("/api/gameweek/99")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertNotIn("ETag", response.headers)
+
+    def test_failed_reads_are_not_cached(self):
+        #the mongo reads print the error and answer empty, the page renders but must not be kept
+        def failing(*args, **kwargs):
+            database.read_error("DB error: timed out")
+            return []
+        with patch.object(SQLiteStorage, "fetch_players_directory", side_effect=failing):
+            response = self.client.get("/players")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Cache"], "BYPASS")
+        self.assertNotIn("ETag", response.headers)
+
+        #the next request reads again and is kept
+        self.assertEqual(self.client.get("/players").headers["X-Cache"], "MISS")
+        self.assertEqual(self.client.get("/players").headers["X-Cache"], "HIT")
+
+if __name__ == "__main__":
+    unittest.main()
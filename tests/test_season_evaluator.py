@@ -1,13 +1,28 @@
+import glob
+import shutil
+import tempfile
 import unittest
 import sys
 import os
+from unittest.mock import patch
 import pandas as pd
 
 #to resolve backend imports
 PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
 
-from backend.algorithm.season_evaluator import find_winners, get_top_3_ranking
+from algorithm.season_evaluator import (find_winners, get_top_3_ranking, raw_to_frame, season_frames_pandas,
+                                        season_frames_pushdown, season_frames_tensor, grouped_frame,
+                                        build_season_summary, PLAYER_KEYS, PLAYER_SUM_COLUMNS)
+from data_layer import database, storage
+from data_layer.tensor_store import TensorStore
+from mock_mongo import mongo_client
+
+#in gameweek order, the order the pipeline uploads them in (the float sums depend on it)
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data_layer',
+                                          'raw', 'gameweek_*.json')),
+                   key=lambda path: int(os.path.basename(path)[len("gameweek_"):-len(".json")]))
 
 class TestSeasonEvaluation(unittest.TestCase):
 
@@ -51,6 +66,104 @@ class TestSeasonEvaluation(unittest.TestCase):
         self.assertEqual(len(results), 3)
         self.assertEqual(results[0]['value'], 20) 
         self.assertEqual(results[2]['value'], 10)
-        
+
+class TestSeasonEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = []
+        teams = ["Team 1", "Team 2", "Team 3"]
+        for gw in range(1, 6):
+            for pid in range(1, 13):
+                self.raw.append({
+                    "player_id": pid,
+                    "name": f"Player {pid}",
+                    "team": teams[pid % 3],
+                    "position_id": (pid % 4) + 1,
+                    "gameweek": gw,
+                    "statistics": {
+                        "minutes": 90, "total_points": (pid * gw) % 11, "goals_scored": (pid + gw) % 3,
+                        "assists": (pid * 7 + gw) % 2, "goals_conceded": gw % 3, "clean_sheets": 0,
+                        "penalties_saved": 0, "yellow_cards": (pid + gw) % 5 == 0, "red_cards": 0,
+                        "expected_goals": round(0.07 * ((pid + gw) % 5), 2), "in_dreamteam": pid == gw
+                    }
+                })
+
+    #aggregation output arrives unordered and with integer sums
+    def as_aggregation_rows(self, frame, columns):
+        rows = frame.to_dict('records')
+        for row in rows:
+            for column in columns:
+                if float(row[column]).is_integer():
+                    row[column] = int(row[column])
+        rows.reverse()
+        return rows
+
+    def test_grouped_frame_matches_pandas_groupby(self):
+        p_totals = season_frames_pandas(raw_to_frame(self.raw))[0]
+        columns = PLAYER_SUM_COLUMNS + ['matches_played']
+        rebuilt = grouped_frame(self.as_aggregation_rows(p_totals, columns), PLAYER_KEYS, columns)
+        pd.testing.assert_frame_equal(rebuilt, p_totals[PLAYER_KEYS + columns])
+
+    def test_summary_is_the_same_from_both_frames(self):
+        frames = season_frames_pandas(raw_to_frame(self.raw))
+        p_totals, recent_stats, team_goals, team_conceded, max_gw = frames
+        columns = PLAYER_SUM_COLUMNS + ['matches_played']
+
+        pushed = (
+            grouped_frame(self.as_aggregation_rows(p_totals, columns), PLAYER_KEYS, columns),
+            grouped_frame(self.as_aggregation_rows(recent_stats, ['goals_scored', 'assists', 'matches_played']),
+                          ['name', 'team'], ['goals_scored', 'assists', 'matches_played']),
+            grouped_frame(self.as_aggregation_rows(team_goals, ['goals_scored']), ['team'], ['goals_scored']),
+            grouped_frame(self.as_aggregation_rows(team_conceded, ['goals_conceded']), ['team'], ['goals_conceded']),
+            max_gw
+        )
+        mvps = {"names": [], "count": 0}
+        self.assertEqual(build_season_summary(*frames, mvps), build_season_summary(*pushed, mvps))
+
+#the four engines on every committed gameweek, compared frame by frame without rounding
+class TestEnginesOnRawFiles(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.raw = []
+        cls.store = TensorStore(os.path.join(cls.tmp, "tensor"))
+        for path in RAW_FILES:
+            docs = database.load_player_docs(path)
+            cls.store.append_gameweek(docs[0]["gameweek"], docs)
+            cls.raw.extend(docs)
+        cls.expected = season_frames_pandas(raw_to_frame(cls.raw))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def tearDown(self):
+        storage.close_storage()
+
+    def assert_same_frames(self, frames):
+        self.assertEqual(len(frames), len(self.expected))
+        for frame, expected in zip(frames[:-1], self.expected[:-1]):
+            keys = [column for column in expected.columns if expected[column].dtype == object]
+            pd.testing.assert_frame_equal(frame[expected.columns].sort_values(keys).reset_index(drop=True),
+                                          expected.sort_values(keys).reset_index(drop=True), check_exact=True)
+        self.assertEqual(frames[-1], self.expected[-1])
+
+    def test_tensor(self):
+        self.assert_same_frames(season_frames_tensor(self.store))
+
+    def test_sqlite_pushdown(self):
+        with patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": os.path.join(self.tmp, "test.db")}):
+            storage.upload_many(RAW_FILES)
+            self.assert_same_frames(season_frames_pushdown())
+
+    @unittest.skipIf(mongo_client() is None, "mongomock not installed")
+    def test_mongo_pipelines(self):
+        client = mongo_client()
+        client["fpl_test"]["raw"].insert_many(self.raw)
+        with patch.dict(os.environ, {"STORAGE_BACKEND": "mongo"}), \
+                patch.multiple(database, get_client=lambda: client, DB_NAME="fpl_test", COLLECTION="raw"):
+            self.assert_same_frames(season_frames_pushdown())
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from algorithm.season_totals import empty_totals, fold_gameweek, summary_from_totals, comparable
+from algorithm.season_evaluator import raw_to_frame, season_frames_pandas, build_season_summary, most_mvps
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic_stats import gameweek_docs
+
+class TestSeasonTotals(unittest.TestCase):
+
+    def setUp(self):
+        #player 16 moves to another team halfway through the season
+        self.by_gameweek = {gw: gameweek_docs(gw, range(1, 17), mover=16, moves_at=4) for gw in range(1, 7)}
+        self.mvps = {gw: f"Player {gw + 2}" for gw in self.by_gameweek}
+
+    def full_summary(self):
+        raw = []
+        for gw in sorted(self.by_gameweek):
+            raw.extend(self.by_gameweek[gw])
+        mvp_docs = [{"mvp": {"name": self.mvps[gw]}} for gw in sorted(self.mvps)]
+        return build_season_summary(*season_frames_pandas(raw_to_frame(raw)), most_mvps(mvp_docs))
+
+    def test_incremental_matches_full_recalculation(self):
+        totals = empty_totals("season_test")
+        for gw in sorted(self.by_gameweek):
+            fold_gameweek(totals, gw, self.by_gameweek[gw], self.mvps[gw])
+
+        self.assertEqual(comparable(summary_from_totals(totals)), comparable(self.full_summary()))
+
+    def test_out_of_order_folding(self):
+        totals = empty_totals("season_test")
+        for gw in [3, 1, 6, 2, 5, 4]:
+            fold_gameweek(totals, gw, self.by_gameweek[gw], self.mvps[gw])
+
+        self.assertEqual(comparable(summary_from_totals(totals)), comparable(self.full_summary()))
+
+    def test_gameweek_is_not_folded_twice(self):
+        totals = empty_totals("season_test")
+        self.assertTrue(fold_gameweek(totals, 1, self.by_gameweek[1]))
+        self.assertFalse(fold_gameweek(totals, 1, self.by_gameweek[1]))
+        self.assertEqual(totals["gameweeks"], [1])
+
+    def test_recent_window_is_trimmed(self):
+        totals = empty_totals("season_test")
+        for gw in sorted(self.by_gameweek):
+            fold_gameweek(totals, gw, self.by_gameweek[gw])
+
+        kept = {row["gameweek"] for row in totals["recent"]}
+        self.assertEqual(kept, {4, 5, 6})
+
+if __name__ == "__main__":
+    unittest.main()
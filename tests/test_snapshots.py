@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+#to resolve backend and frontend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'frontend')))
+
+import snapshots
+from snapshots import publish_snapshot, current_snapshot
+import snapshot_server
+import response_cache
+
+
+def write_analytics(folder, gameweeks, points=10):
+    os.makedirs(folder, exist_ok=True)
+    for gw in gameweeks:
+        with open(os.path.join(folder, f"analytics_gw_{gw}.json"), "w") as f:
+            json.dump({"_id": f"summary_gw_{gw}", "gameweek": gw, "mvp": {"name": "A", "points": points}}, f)
+    with open(os.path.join(folder, "season_overview.json"), "w") as f:
+        json.dump({"_id": "season", "last_updated_gw": max(gameweeks)}, f)
+
+
+class TestPublishSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.analytics = os.path.join(self.tmp, "analytics")
+        self.path = os.path.join(self.tmp, "snapshots")
+        write_analytics(self.analytics, [1, 2, 10])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_files_match_the_api(self):
+        name = publish_snapshot(4, self.analytics, self.path)
+        directory, manifest = current_snapshot(self.path)
+        self.assertEqual(os.path.basename(directory), name)
+        self.assertEqual(manifest["version"], 4)
+        self.assertEqual(set(manifest["files"]), {"gameweeks", "season", "gameweek_1", "gameweek_2", "gameweek_10"})
+
+        with open(os.path.join(directory, "gameweek_2.json"), "rb") as f:
+            body = f.read()
+        self.assertEqual(json.loads(body), {"gameweek": 2, "mvp": {"name": "A", "points": 10}})
+        with open(os.path.join(directory, "gameweek_2.json.gz"), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), body)
+        with open(os.path.join(directory, "gameweeks.json")) as f:
+            self.assertEqual([s["gameweek"] for s in json.load(f)], [1, 2, 10])
+
+    def test_swap_and_prune(self):
+        names = [publish_snapshot(version, self.analytics, self.path) for version in range(1, 7)]
+        self.assertEqual(snapshots.read_current(self.path), names[-1])
+        #the current one and the previous versions that are kept
+        kept = sorted(name for name in os.listdir(self.path) if name.startswith("v"))
+        self.assertEqual(kept, names[-1 - snapshots.KEEP_SNAPSHOTS:])
+        self.assertFalse([name for name in os.listdir(self.path) if name.startswith(".")])
+
+        #the manifest follows the pointer
+        write_analytics(self.analytics, [1, 2, 10, 11])
+        publish_snapshot(7, self.analytics, self.path)
+        self.assertIn("gameweek_11", current_snapshot(self.path)[1]["files"])
+
+    def test_pointer_is_a_plain_file(self):
+        #no symlink, which windows refuses without extra privileges
+        with patch.object(snapshots.os, "symlink", side_effect=OSError("symbolic link privilege not held")):
+            name = publish_snapshot(1, self.analytics, self.path)
+        pointer = os.path.join(self.path, "current")
+        self.assertFalse(os.path.islink(pointer))
+        with open(pointer) as f:
+            self.assertEqual(f.read(), name)
+        self.assertFalse(os.path.exists(pointer + ".tmp"))
+
+    def test_symlink_of_an_older_publication(self):
+        old = publish_snapshot(1, self.analytics, self.path)
+        pointer = os.path.join(self.path, "current")
+        os.remove(pointer)
+        os.symlink(old, pointer)
+        self.assertEqual(os.path.basename(current_snapshot(self.path)[0]), old)
+
+        #replaced by the pointer file on the next swap
+        new = publish_snapshot(2, self.analytics, self.path)
+        self.assertFalse(os.path.islink(pointer))
+        self.assertEqual(os.path.basename(current_snapshot(self.path)[0]), new)
+
+    def test_nothing_published(self):
+        self.assertIsNone(current_snapshot(self.path))
+
+
+class TestSnapshotViews(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        write_analytics(os.path.join(cls.tmp, "analytics"), [1, 2])
+        publish_snapshot(3, os.path.join(cls.tmp, "analytics"), os.path.join(cls.tmp, "snapshots"))
+        cls.patches = [patch.object(snapshots, "SNAPSHOT_PATH", os.path.join(cls.tmp, "snapshots")),
+                       patch.object(snapshot_server, "SERVE_SNAPSHOTS", True),
+                       patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                               "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})]
+        for p in cls.patches:
+            p.start()
+
+        import app
+        cls.app = app
+        cls.client = app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        for p in cls.patches:
+            p.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_served_without_the_database(self):
+        down = RuntimeError("database down")
+        with patch.object(self.app, "get_storage", side_effect=down), \
+             patch.object(response_cache, "get_storage", side_effect=down):
+            response = self.client.get("/api/gameweek/2")
+            season = self.client.get("/api/season")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"gameweek": 2, "mvp": {"name": "A", "points": 10}})
+        self.assertEqual(season.get_json(), {"last_updated_gw": 2})
+        self.assertEqual([s["gameweek"] for s in self.client.get("/api/gameweeks").get_json()], [1, 2])
+        self.assertEqual(self.client.get("/api/gameweek/5").status_code, 404)
+
+    def test_gzip_negotiation(self):
+        plain = self.client.get("/api/gameweek/1")
+        zipped = self.client.get("/api/gameweek/1", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(zipped.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(zipped.data), plain.data)
+        self.assertIn("Accept-Encoding", zipped.headers["Vary"])
+        self.assertNotEqual(zipped.headers["ETag"], plain.headers["ETag"])
+
+        refused = self.client.get("/api/gameweek/1", headers={"Accept-Encoding": "gzip;q=0"})
+        self.assertNotIn("Content-Encoding", refused.headers)
+
+    def test_conditional_requests(self):
+        etag = self.client.get("/api/season").headers["ETag"]
+        response = self.client.get("/api/season", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+if __name__ == "__main__":
+    unittest.main()
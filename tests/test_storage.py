@@ -0,0 +1,260 @@
+#runs the whole pipeline on the embedded sqlite backend, no server needed
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+#to resolve backend imports
+PROJECT_ROOT = sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+import data_layer.storage as storage
+import data_layer.database as database
+import algorithm.player_evaluator as player_evaluator
+import algorithm.season_evaluator as season_evaluator
+import algorithm.season_totals as season_totals
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import synthetic_stats
+from mock_mongo import mongo_client
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+RAW_FILES = sorted(glob.glob(os.path.join(BACKEND_DIR, 'data_layer', 'raw', 'gameweek_*.json')))
+ANALYTICS_DIR = os.path.join(BACKEND_DIR, 'data_layer', 'analytics')
+
+def names(rows):
+    return sorted(row['name'] for row in rows)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cls.env = patch.dict(os.environ, {"STORAGE_BACKEND": "sqlite",
+                                          "SQLITE_PATH": os.path.join(cls.tmp, "test.db")})
+        cls.env.start()
+        #analytics files are written to the temp folder, not over the committed ones
+        cls.folders = [patch.object(player_evaluator, 'ANALYTICS_FOLDER', cls.tmp),
+                       patch.object(season_evaluator, 'ANALYTICS_FOLDER', cls.tmp)]
+        for folder in cls.folders:
+            folder.start()
+
+        cls.counts = storage.upload_many(RAW_FILES)
+        cls.gameweeks = storage.fetch_gameweek_ids()
+        cls.summaries = player_evaluator.calculate_metrics_many(cls.gameweeks, workers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        storage.close_storage()
+        for folder in cls.folders:
+            folder.stop()
+        cls.env.stop()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_backend_follows_environment(self):
+        self.assertIsInstance(storage.get_storage(), storage.SQLiteStorage)
+
+    def test_one_copy_of_the_data_layer(self):
+        #the storage and the tests share one database module, so one client and one set of counters
+        self.assertIs(storage.database, database)
+        self.assertFalse([name for name in sys.modules if name.startswith("backend.data_layer")])
+
+    def test_read_errors_are_reported_like_mongo(self):
+        backend = storage.get_storage()
+        errors = database.read_error_count()
+        with patch.object(storage.SQLiteStorage, "conn", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertEqual(backend.fetch_gameweek_data(1), [])
+            self.assertIsNone(backend.fetch_player(1))
+            self.assertEqual(backend.count_players(), 0)
+            self.assertEqual(backend.fetch_summary_digests(), {})
+            #streamed pages and the readiness check still raise
+            with self.assertRaises(sqlite3.OperationalError):
+                docs, following = backend.player_records_page(1, limit=2)
+                list(docs)
+            with self.assertRaises(sqlite3.OperationalError):
+                backend.ping()
+        self.assertEqual(database.read_error_count(), errors + 4)
+
+    def test_upload_is_idempotent(self):
+        self.assertEqual(self.counts['upserted'], len(storage.fetch_all_raw_data()))
+        again = storage.upload_many(RAW_FILES[:1])
+        self.assertEqual(again['upserted'], 0)
+        self.assertEqual(again['modified'], 0)
+
+    def test_gameweek_metrics_match_committed_files(self):
+        self.assertEqual(len(self.summaries), len(RAW_FILES))
+        for summary in self.summaries:
+            with open(os.path.join(ANALYTICS_DIR, f"analytics_gw_{summary['gameweek']}.json")) as f:
+                expected = json.load(f)
+            self.assertEqual(summary['mvp'], expected['mvp'])
+            self.assertEqual(summary['team_stats'], expected['team_stats'])
+            #ties are listed in row order, which depends on the database
+            self.assertEqual(names(summary['top_scorers']), names(expected['top_scorers']))
+
+    def test_metrics_skipped_when_unchanged(self):
+        self.assertEqual(player_evaluator.calculate_metrics_many(self.gameweeks, workers=1), [])
+
+    def test_season_engines_match_committed_file(self):
+        pandas_summary = season_totals.comparable(season_evaluator.calculate_season_stats('pandas', save=False))
+        pushdown_summary = season_totals.comparable(season_evaluator.calculate_season_stats('pushdown', save=False))
+        self.assertEqual(pandas_summary, pushdown_summary)
+
+        with open(os.path.join(ANALYTICS_DIR, "season_overview.json")) as f:
+            expected = season_totals.comparable(json.load(f))
+        pandas_summary.pop('_id')
+        expected.pop('_id')
+        self.assertEqual(pandas_summary, expected)
+
+    def test_incremental_totals(self):
+        season_totals.update_season_incremental(self.gameweeks)
+        self.assertTrue(season_totals.verify_incremental())
+
+    def test_frontend_reads(self):
+        backend = storage.get_storage()
+        records = backend.fetch_player_records(name="SALAH")
+        self.assertTrue(records)
+        self.assertNotIn('_id', records[0])
+        by_id = backend.fetch_player_records(player_id=records[0]['player_id'])
+        self.assertEqual([r['gameweek'] for r in by_id], sorted(r['gameweek'] for r in by_id))
+        #every word of the search starts a word of the name, the middle of a word does not match
+        self.assertEqual(backend.fetch_player_records(name="mo sal"), records)
+        self.assertEqual({r['name'] for r in backend.fetch_player_records(name="sal")},
+                         {r['name'] for r in storage.fetch_all_raw_data() if any(
+                             word.startswith("sal") for word in r['name_search'].split())})
+        self.assertEqual(backend.fetch_player_records(name="alah"), [])
+        #one range of the token index per word
+        plan = backend.query("EXPLAIN QUERY PLAN SELECT _id FROM raw_tokens WHERE token >= ? AND token < ?",
+                             storage.prefix_range("sal"))
+        self.assertIn("USING COVERING INDEX", plan[0][-1])
+
+        directory = backend.fetch_players_directory()
+        self.assertEqual(len(directory), len({doc['player_id'] for doc in storage.fetch_all_raw_data()}))
+        self.assertEqual(backend.count_players(), len(directory))
+        self.assertEqual(len(backend.fetch_gameweek_summaries(limit=5)), 5)
+        self.assertTrue(backend.fetch_gameweek_players(1))
+
+    def test_players_directory(self):
+        backend = storage.get_storage()
+        raw = storage.fetch_all_raw_data()
+        expected = {player['_id']: player for player in storage.database.build_players_directory(raw)}
+        stored = backend.docs("SELECT doc FROM players")
+        self.assertEqual({player['_id']: player for player in stored}, expected)
+
+        #totals agree with the season aggregation (same player, team of the latest gameweek aside)
+        salah = next(player for player in stored if player['name_search'].endswith('salah'))
+        rows = [doc for doc in raw if doc['player_id'] == salah['player_id']]
+        self.assertEqual(salah['appearances'], len(rows))
+        self.assertEqual(salah['latest_gameweek'], max(doc['gameweek'] for doc in rows))
+        self.assertEqual(salah['totals']['goals_scored'], sum(doc['statistics']['goals_scored'] for doc in rows))
+
+        #gameweek series of the player page, parallel arrays in gameweek order
+        rows.sort(key=lambda doc: doc['gameweek'])
+        self.assertEqual(salah['series']['gameweek'], [doc['gameweek'] for doc in rows])
+        self.assertEqual(salah['series']['total_points'], [doc['statistics']['total_points'] for doc in rows])
+        self.assertEqual(sum(salah['series']['minutes']), salah['totals']['minutes'])
+        player = backend.fetch_player(salah['_id'])
+        self.assertEqual(player['series'], salah['series'])
+        self.assertNotIn('name_search', player)
+        self.assertIsNone(backend.fetch_player(-1))
+
+        #pages follow the name order without gaps or repeats
+        pages = [backend.fetch_players_directory(skip=skip, limit=50) for skip in range(0, len(expected), 50)]
+        listed = [player['_id'] for page in pages for player in page]
+        self.assertEqual(listed, [p['_id'] for p in sorted(expected.values(), key=lambda p: (p['name'], p['_id']))])
+        self.assertNotIn('totals', pages[0][0])
+        self.assertNotIn('series', pages[0][0])
+
+    def test_players_directory_is_updated_incrementally(self):
+        #gameweeks uploaded one batch after the other, latest first, end with the same directory as one upload
+        other = storage.SQLiteStorage(os.path.join(self.tmp, "incremental.db"))
+        everything = storage.get_storage().docs("SELECT doc FROM players ORDER BY _id")
+        try:
+            other.upload_many(RAW_FILES[3:])
+            #only the players of the batch are rebuilt, never the whole directory
+            with patch.object(other, "refresh_players") as refresh:
+                other.upload_many(RAW_FILES[:3])
+            refresh.assert_not_called()
+            self.assertEqual(other.docs("SELECT doc FROM players ORDER BY _id"), everything)
+
+            #a re-upload with other figures takes the old row out of the totals and series
+            path = os.path.join(self.tmp, "gameweek_changed.json")
+            with open(RAW_FILES[0]) as f:
+                rows = json.load(f)
+            rows[0]["statistics"]["total_points"] = 40
+            rows[0]["statistics"]["expected_goals"] = "1.23"
+            old_name, rows[0]["name"] = rows[0]["name"], "Zed Renamed"
+            with open(path, "w") as f:
+                json.dump(rows, f)
+            other.upload_many([path])
+            raw = other.docs("SELECT doc FROM raw")
+            expected = {p["_id"]: p for p in storage.database.build_players_directory(raw)}
+            self.assertEqual({p["_id"]: p for p in other.docs("SELECT doc FROM players")}, expected)
+            #the renamed row is found by its new name only
+            renamed = other.fetch_player_records(name="zed ren")
+            self.assertEqual([r["gameweek"] for r in renamed], [rows[0]["gameweek_index"]])
+            self.assertNotIn(rows[0]["gameweek_index"],
+                             [r["gameweek"] for r in other.fetch_player_records(name=old_name)
+                              if r["player_id"] == rows[0]["player_id"]])
+
+            #a directory written before the series existed is rebuilt when the app starts
+            with other.conn() as conn:
+                conn.execute("UPDATE players SET doc = json_remove(doc, '$.series')")
+            other.ensure_indexes()
+            self.assertEqual({p["_id"]: p for p in other.docs("SELECT doc FROM players")}, expected)
+        finally:
+            other.close()
+
+
+#the season aggregations of both backends on rows where some stats are missing
+@unittest.skipIf(mongo_client() is None, "mongomock not installed")
+class TestAggregationParity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.docs = []
+        for gw in range(1, 4):
+            for doc in synthetic_stats.gameweek_docs(gw, range(1, 9), mover=5, moves_at=3):
+                #the players of Team 4 never have these stats, a $sum of nothing is 0
+                if doc["team"] == "Team 4":
+                    for field in ("penalties_saved", "goals_conceded", "goals_scored"):
+                        doc["statistics"].pop(field)
+                self.docs.append(doc)
+
+        self.sqlite = storage.SQLiteStorage(os.path.join(self.tmp, "parity.db"))
+        self.sqlite.upsert_raw(self.docs)
+        self.client = mongo_client()
+        self.client["fpl_test"]["raw"].insert_many([dict(doc) for doc in self.docs])
+        self.patch = patch.multiple(database, get_client=lambda: self.client, DB_NAME="fpl_test", COLLECTION="raw")
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.sqlite.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def assert_same_rows(self, mongo_rows, sqlite_rows):
+        key = lambda row: json.dumps(row, sort_keys=True)
+        self.assertEqual(sorted(mongo_rows, key=key), sorted(sqlite_rows, key=key))
+
+    def test_missing_stats_sum_to_zero(self):
+        mongo = storage.MongoStorage()
+        totals = self.sqlite.aggregate_player_totals()
+        team_4 = [row for row in totals if row["team"] == "Team 4"]
+        self.assertTrue(team_4)
+        for row in team_4:
+            self.assertEqual((row["penalties_saved"], row["goals_conceded"], row["goals_scored"]), (0, 0, 0))
+
+        self.assert_same_rows(mongo.aggregate_player_totals(), totals)
+        self.assert_same_rows(mongo.aggregate_recent_stats(2), self.sqlite.aggregate_recent_stats(2))
+        self.assert_same_rows(mongo.aggregate_team_goals(), self.sqlite.aggregate_team_goals())
+        self.assert_same_rows(mongo.aggregate_team_conceded(), self.sqlite.aggregate_team_conceded())
+
+if __name__ == "__main__":
+    unittest.main()
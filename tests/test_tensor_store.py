@@ -0,0 +1,140 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas.testing as pdt
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+import data_layer.tensor_store as tensor_store
+from data_layer.tensor_store import TensorStore, open_store
+from algorithm.player_evaluator import docs_to_frame, METRIC_DEFAULTS
+from algorithm.season_evaluator import (raw_to_frame, season_frames_pandas, season_frames_tensor,
+                                        build_season_summary)
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import synthetic_stats
+
+def gameweek_docs(gw, players=12):
+    #later gameweeks list the players in a different order and add new ones, player 5 changes team
+    player_ids = sorted(range(1, players + gw), key=lambda p: (p * gw) % 7)
+    return synthetic_stats.gameweek_docs(gw, player_ids, mover=5, moves_at=3)
+
+
+class TestTensorStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.by_gameweek = {gw: gameweek_docs(gw) for gw in range(1, 6)}
+        #small capacity so the player axis has to grow while appending
+        with patch.object(tensor_store, 'PLAYER_CAPACITY', 4):
+            store = TensorStore(self.path)
+            for gw, docs in self.by_gameweek.items():
+                store.append_gameweek(gw, docs)
+        self.store = open_store(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_frame_matches_documents(self):
+        for gw, docs in self.by_gameweek.items():
+            pdt.assert_frame_equal(self.store.frame([gw], METRIC_DEFAULTS), docs_to_frame(docs))
+
+    def test_season_frames_match_pandas(self):
+        raw = [doc for gw in sorted(self.by_gameweek) for doc in self.by_gameweek[gw]]
+        expected = build_season_summary(*season_frames_pandas(raw_to_frame(raw)), [])
+        self.assertEqual(build_season_summary(*season_frames_tensor(self.store), []), expected)
+
+    def test_slices_are_views(self):
+        minutes = self.store.stat("minutes")
+        self.assertIsInstance(self.store.stats, np.memmap)
+        self.assertTrue(np.shares_memory(minutes, self.store.stats))
+        self.assertTrue(np.shares_memory(self.store.gameweek(2), self.store.stats))
+        #12 players at first, then doubled once
+        self.assertEqual(self.store.shape[0], 24)
+
+    def test_gameweek_is_replaced_when_appended_again(self):
+        before = self.store.gameweek_digest(3)
+        changed = gameweek_docs(3)[:5]
+        changed[0]["statistics"]["total_points"] = 99
+
+        store = TensorStore(self.path)
+        store.append_gameweek(3, changed)
+        self.assertEqual(int(store.played()[:, 2].sum()), 5)
+        pdt.assert_frame_equal(store.frame([3], METRIC_DEFAULTS), docs_to_frame(changed))
+        self.assertNotEqual(store.gameweek_digest(3), before)
+        self.assertEqual(store.index["gameweeks"], [1, 2, 3, 4, 5])
+
+    def test_grow_never_replaces_a_mapped_file(self):
+        replace = os.replace
+
+        #windows refuses to replace or remove a file that is still mapped
+        def replace_unmapped(src, dst):
+            if dst.endswith(".npy"):
+                raise PermissionError(f"{dst} is mapped")
+            replace(src, dst)
+
+        store = TensorStore(self.path)
+        generation = store.index["generation"]
+        with patch.object(tensor_store.os, "replace", side_effect=replace_unmapped):
+            store.append_gameweek(6, gameweek_docs(6, players=40))
+        self.assertEqual(store.index["generation"], generation + 1)
+        self.assertGreater(store.shape[0], self.store.shape[0])
+
+        #the old mapping still reads its values, new readers open the grown files
+        pdt.assert_frame_equal(self.store.frame([5], METRIC_DEFAULTS), docs_to_frame(self.by_gameweek[5]))
+        reopened = open_store(self.path)
+        pdt.assert_frame_equal(reopened.frame([6], METRIC_DEFAULTS), docs_to_frame(gameweek_docs(6, players=40)))
+        self.assertEqual(sorted(f for f in os.listdir(self.path) if f.endswith(".npy")),
+                         sorted(tensor_store.array_file(name, generation + 1) for name in tensor_store.ARRAYS))
+
+    def test_read_only(self):
+        with self.assertRaises(FileNotFoundError):
+            open_store(os.path.join(self.path, "missing"))
+        with self.assertRaises(ValueError):
+            self.store.append_gameweek(6, gameweek_docs(6))
+
+    def test_replace_store_always_leaves_a_store(self):
+        by_gameweek = {gw: gameweek_docs(gw, players=8) for gw in range(1, 3)}
+        before = self.store.gameweek_digest(5)
+        replace = os.replace
+        seen = []
+
+        #a reader opening the store after every file moved sees the old store or the new one, never none
+        def replace_and_open(src, dst):
+            replace(src, dst)
+            if os.path.dirname(dst) == self.path:
+                store = open_store(self.path)
+                seen.append((store.index["gameweeks"], store.shape[0]))
+
+        with patch.object(tensor_store.os, "replace", side_effect=replace_and_open), \
+                patch.object(tensor_store.os, "rename") as rename:
+            tensor_store.replace_store(by_gameweek, self.path, prepare=lambda path: open(
+                os.path.join(path, "extra.bin"), "wb").close())
+        rename.assert_not_called()
+        self.assertEqual(seen[0], ([1, 2, 3, 4, 5], 24))
+        self.assertEqual(seen[-1], ([1, 2], tensor_store.PLAYER_CAPACITY))
+        self.assertTrue(all(gameweeks in ([1, 2, 3, 4, 5], [1, 2]) for gameweeks, _ in seen))
+
+        #the mapping opened before the swap still reads the old arrays, the old files are gone
+        self.assertEqual(self.store.gameweek_digest(5), before)
+        store = open_store(self.path)
+        pdt.assert_frame_equal(store.frame([2], METRIC_DEFAULTS), docs_to_frame(by_gameweek[2]))
+        generation = store.index["generation"]
+        self.assertEqual(sorted(f for f in os.listdir(self.path) if f.endswith(".npy")),
+                         sorted(tensor_store.array_file(name, generation) for name in tensor_store.ARRAYS))
+        self.assertTrue(os.path.exists(os.path.join(self.path, "extra.bin")))
+        self.assertFalse(os.path.exists(self.path + ".staging"))
+
+        #the next rebuild moves on to a later generation
+        tensor_store.replace_store(by_gameweek, self.path)
+        self.assertGreater(open_store(self.path).index["generation"], generation)
+
+if __name__ == "__main__":
+    unittest.main()
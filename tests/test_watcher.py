@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#to resolve backend imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from data_layer.api_ingestion import get_bootstrap_if_changed, make_session
+from watcher import (Watcher, next_interval, read_status, FAST_INTERVAL, MEDIUM_INTERVAL, SLOW_INTERVAL,
+                     DEADLINE_WINDOW)
+#the watcher runs main_backend.main, which imports the pipeline under these names
+import main_backend
+import pipeline
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from test_api_ingestion import StubHandler
+
+NOW = datetime(2025, 11, 1, 12, 0, tzinfo=timezone.utc)
+
+def event(gw, deadline, finished=False, data_checked=False):
+    return {"id": gw, "deadline_time": deadline.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "finished": finished, "data_checked": data_checked}
+
+
+class TestNextInterval(unittest.TestCase):
+
+    def test_fast_while_waiting_for_verification(self):
+        events = [event(9, NOW - timedelta(days=4), finished=True, data_checked=False),
+                  event(10, NOW + timedelta(days=3))]
+        self.assertEqual(next_interval(events, NOW), FAST_INTERVAL)
+
+    def test_fast_around_a_deadline(self):
+        events = [event(9, NOW - timedelta(days=7), True, True), event(10, NOW + timedelta(minutes=30))]
+        self.assertEqual(next_interval(events, NOW), FAST_INTERVAL)
+
+    def test_medium_while_a_gameweek_is_played(self):
+        events = [event(9, NOW - timedelta(days=1)), event(10, NOW + timedelta(days=6))]
+        self.assertEqual(next_interval(events, NOW), MEDIUM_INTERVAL)
+
+    def test_sleeps_until_the_next_deadline_window(self):
+        events = [event(9, NOW - timedelta(days=7), True, True), event(10, NOW + timedelta(hours=4))]
+        expected = (timedelta(hours=4) - DEADLINE_WINDOW).total_seconds()
+        self.assertEqual(next_interval(events, NOW), min(SLOW_INTERVAL, expected))
+
+        events = [event(38, NOW - timedelta(days=7), True, True)]
+        self.assertEqual(next_interval(events, NOW), SLOW_INTERVAL)
+
+
+#bootstrap with an etag, 304 when the client already has it
+class BootstrapHandler(BaseHTTPRequestHandler):
+    payload = {"events": []}
+    hits = []
+
+    def do_GET(self):
+        body = json.dumps(BootstrapHandler.payload).encode("utf-8")
+        etag = '"' + str(hash(body)) + '"'
+        BootstrapHandler.hits.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWatcher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), BootstrapHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.status_path = os.path.join(self.tmp, "status.json")
+        self.session = make_session(pool_size=1, retries=0, backoff=0)
+        BootstrapHandler.hits = []
+        BootstrapHandler.payload = {"events": [event(1, NOW - timedelta(days=3), True, False)], "elements": [1]}
+        self.processed = []
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def fetch(self, validators):
+        return get_bootstrap_if_changed(validators, session=self.session, base_url=self.base_url)
+
+    def process(self, basic_data):
+        self.processed.append([e["data_checked"] for e in basic_data["events"]])
+        return [1]
+
+    def test_conditional_request(self):
+        status, data, validators = self.fetch({})
+        self.assertEqual(status, 200)
+        self.assertTrue(validators["etag"])
+        status, data, same = self.fetch(validators)
+        self.assertEqual((status, data, same), (304, None, validators))
+
+    def test_runs_only_when_the_events_change(self):
+        watcher = Watcher(process=self.process, fetch=self.fetch, status_path=self.status_path)
+        watcher.poll_once()
+        watcher.poll_once()
+        self.assertEqual(self.processed, [[False]])
+        self.assertEqual(read_status(self.status_path)["not_modified"], 1)
+
+        #prices changed but not the events: new etag, no run
+        BootstrapHandler.payload["elements"] = [1, 2]
+        watcher.poll_once()
+        self.assertEqual(len(self.processed), 1)
+
+        #data_checked flips
+        BootstrapHandler.payload["events"][0]["data_checked"] = True
+        watcher.poll_once()
+        self.assertEqual(self.processed, [[False], [True]])
+
+        status = read_status(self.status_path)
+        self.assertEqual((status["state"], status["runs"], status["polls"]), ("idle", 2, 4))
+        self.assertEqual(status["last_gameweeks"], [1])
+
+    def test_failed_run_is_retried(self):
+        calls = []
+        def failing(basic_data):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("database down")
+            return []
+
+        watcher = Watcher(process=failing, fetch=self.fetch, status_path=self.status_path)
+        interval = watcher.poll_once()
+        self.assertEqual(interval, FAST_INTERVAL * 2)
+        self.assertEqual(read_status(self.status_path)["last_error"], "database down")
+
+        watcher.poll_once()
+        self.assertEqual(len(calls), 2)
+        self.assertIsNone(read_status(self.status_path)["last_error"])
+
+    def test_runs_again_while_gameweeks_are_pending(self):
+        pending = [[2], []]
+        watcher = Watcher(process=self.process, fetch=self.fetch, status_path=self.status_path,
+                          pending=lambda: pending[0])
+        watcher.poll_once()
+        #same events, but gameweek 2 still waits for its metrics
+        pending.pop(0)
+        watcher.poll_once()
+        watcher.poll_once()
+        self.assertEqual(self.processed, [[False], [False]])
+        self.assertEqual(read_status(self.status_path)["not_modified"], 1)
+
+    def test_graceful_stop(self):
+        watcher = Watcher(process=self.process, fetch=self.fetch, status_path=self.status_path)
+        runner = threading.Thread(target=watcher.run)
+        runner.start()
+        #waits for the first poll, then stops the sleep
+        for _ in range(100):
+            if read_status(self.status_path) and read_status(self.status_path)["state"] == "idle":
+                break
+            threading.Event().wait(0.02)
+        watcher.stop()
+        runner.join(timeout=5)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(read_status(self.status_path)["state"], "stopped")
+
+
+#the watcher running the real pipeline against the stub api, where the first /event/2/live/ call fails
+class TestWatchRetriesFailedGameweeks(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubHandler.hits = {}
+        self.tmp = tempfile.mkdtemp()
+        self.out_path = os.path.join(self.tmp, "raw")
+        #no retries in the session, the failure reaches the pipeline
+        self.session = make_session(pool_size=2, retries=0, backoff=0)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_pipeline(self, **kwargs):
+        return pipeline.run_pipeline(session=self.session, base_url=self.base_url, out_path=self.out_path,
+                                     metrics_workers=1, report_path=os.path.join(self.tmp, "report.json"),
+                                     prometheus_path=os.path.join(self.tmp, "metrics.prom"),
+                                     pending_path=os.path.join(self.tmp, "pending.json"),
+                                     basic_data=kwargs["basic_data"], force=kwargs["force"])
+
+    def test_failed_download_is_retried_on_the_next_poll(self):
+        fetch = lambda validators: get_bootstrap_if_changed(validators, session=self.session, base_url=self.base_url)
+        watcher = Watcher(fetch=fetch, status_path=os.path.join(self.tmp, "status.json"))
+
+        with patch.object(main_backend, "ensure_indexes"), \
+             patch.object(main_backend, "run_pipeline", side_effect=self.run_pipeline), \
+             patch.object(pipeline, "upload_to_mongo", return_value={"upserted": 1}), \
+             patch.object(pipeline, "append_gameweek_files"), \
+             patch.object(pipeline, "metrics_for_gameweek", return_value=None), \
+             patch.object(pipeline, "refresh_leaderboard"), \
+             patch.object(pipeline, "update_season_incremental", return_value=None), \
+             patch.object(pipeline, "publish_data_version", return_value={"version": 1}), \
+             patch.object(pipeline, "publish_snapshot"):
+            first = watcher.poll_once()
+            self.assertEqual(sorted(os.listdir(self.out_path)), ["gameweek_1.json", "gameweek_3.json"])
+            self.assertIn("[2]", read_status(watcher.status_path)["last_error"])
+            self.assertEqual(first, FAST_INTERVAL * 2)
+
+            #same events, the failed gameweek is downloaded without waiting for them to change
+            watcher.poll_once()
+
+        self.assertEqual(sorted(os.listdir(self.out_path)), ["gameweek_1.json", "gameweek_2.json", "gameweek_3.json"])
+        self.assertEqual(StubHandler.hits["/event/2/live/"], 2)
+        self.assertEqual(StubHandler.hits["/event/1/live/"], 1)
+        status = read_status(watcher.status_path)
+        self.assertIsNone(status["last_error"])
+        self.assertEqual(status["last_gameweeks"], [2])
+
+    def test_failed_metrics_are_retried_on_the_next_poll(self):
+        fetch = lambda validators: get_bootstrap_if_changed(validators, session=self.session, base_url=self.base_url)
+        pending_path = os.path.join(self.tmp, "pending.json")
+        watcher = Watcher(fetch=fetch, status_path=os.path.join(self.tmp, "status.json"),
+                          pending=lambda: pipeline.read_pending(pending_path))
+        analysed = []
+
+        #gameweek 2 fails to download, gameweek 3 fails in the metrics
+        def metrics(gw, force=False, pool=None):
+            analysed.append(gw)
+            if gw == 3 and analysed.count(3) == 1:
+                raise RuntimeError("metrics failed")
+            return {"gameweek": gw}
+
+        with patch.object(main_backend, "ensure_indexes"), \
+             patch.object(main_backend, "run_pipeline", side_effect=self.run_pipeline), \
+             patch.object(pipeline, "upload_to_mongo", return_value={"upserted": 1}) as upload, \
+             patch.object(pipeline, "append_gameweek_files"), \
+             patch.object(pipeline, "metrics_for_gameweek", side_effect=metrics), \
+             patch.object(pipeline, "refresh_leaderboard"), \
+             patch.object(pipeline, "update_season_incremental", return_value=None) as season, \
+             patch.object(pipeline, "publish_data_version", return_value={"version": 1}), \
+             patch.object(pipeline, "publish_snapshot"):
+            watcher.poll_once()
+            self.assertIn("[2, 3]", read_status(watcher.status_path)["last_error"])
+            self.assertEqual(pipeline.read_pending(pending_path), [3])
+
+            #same events, gameweek 2 is downloaded and gameweek 3 analysed again without being uploaded again
+            watcher.poll_once()
+            self.assertEqual(pipeline.read_pending(pending_path), [])
+            self.assertIsNone(read_status(watcher.status_path)["last_error"])
+
+            #nothing left: the events are not run again
+            watcher.poll_once()
+
+        self.assertEqual(sorted(analysed), [1, 2, 3, 3])
+        self.assertEqual(upload.call_count, 3)
+        self.assertEqual(StubHandler.hits["/event/3/live/"], 1)
+        self.assertEqual(season.call_args_list[-1][0], ([2, 3],))
+        self.assertEqual(read_status(watcher.status_path)["runs"], 1)
+
+if __name__ == "__main__":
+    unittest.main()